@@ -1,12 +1,97 @@
 from fastapi import HTTPException, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import jwt
-from database import db
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+from pydal.objects import Row
+from database import db, after_commit
 from config import SECRET_KEY, ALGORITHM
+from utils.offload import run_db
+
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "30"))  # seconds a resolved user is reused, 0 = look up every request
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "4096"))  # users kept in memory
 
 # Security scheme
 security = HTTPBearer()
 
+
+class FrozenRow(Row):
+    """Read-only copy of a users row, safe to hand to concurrent requests"""
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("current_user is shared between requests and cannot be changed")
+
+    __setattr__ = __setitem__ = __delattr__ = __delitem__ = _read_only
+    update = pop = clear = _read_only
+
+
+class PrincipalCache:
+    """users resolved from a token's sub (email), kept for ttl seconds.
+
+    A cached request authenticates without touching the database. Writes
+    to users through PyDAL (profile, password, admin flag, deletes) drop
+    the cache via after-update/delete hooks, once when written and again
+    after the commit, so a load that read the old row in between is not
+    kept; writes made by other API
+    nodes show up once entries expire. Every request gets the same user
+    object, so it is a FrozenRow copy rather than the selected Row.
+    Entries are dropped from DB worker threads, hence the lock.
+    """
+
+    def __init__(self, ttl: float = AUTH_CACHE_TTL, size: int = AUTH_CACHE_SIZE):
+        self.ttl = ttl
+        self.size = max(1, size)
+        self._entries: "OrderedDict[str, Tuple[float, object]]" = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, email: str):
+        with self._lock:
+            entry = self._entries.get(email)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[email]
+                return None
+            self._entries.move_to_end(email)
+            return entry[1]
+
+    def load(self, email: str) -> Optional[FrozenRow]:
+        """Look the user up and keep it, unless a users write happened meanwhile"""
+        with self._lock:
+            generation = self._generation
+        row = db(db.users.email == email).select().first()
+        user = FrozenRow(row.as_dict()) if row else None
+        with self._lock:
+            if user and self.ttl > 0 and generation == self._generation:
+                self._entries[email] = (time.monotonic() + self.ttl, user)
+                self._entries.move_to_end(email)
+                while len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+        return user
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def written(self):
+        # A load may still read the old row until the write commits
+        self.invalidate()
+        after_commit(self.invalidate)
+
+    def watch(self, table):
+        table._after_update.append(lambda dbset, fields: self.written())
+        table._after_delete.append(lambda dbset: self.written())
+
+
+principal_cache = PrincipalCache()
+principal_cache.watch(db.users)
+
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Get current user from JWT token"""
     try:
@@ -22,8 +107,10 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials"
         )
-    
-    user = db(db.users.email == email).select().first()
+
+    user = principal_cache.get(email)
+    if user is None:
+        user = await run_db(principal_cache.load, email)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
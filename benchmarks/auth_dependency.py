@@ -0,0 +1,90 @@
+"""Cost per request of resolving get_current_user, with and without the principal cache.
+
+Calls the auth dependency directly with a valid bearer token, so the
+numbers are JWT decoding plus the user lookup, without routing or HTTP.
+"uncached" sets the cache TTL to 0, which is the old behaviour: one users
+SELECT on a DB worker thread per request.
+
+    python benchmarks/auth_dependency.py --requests 20000 --concurrency 50
+
+A fixture user is created in a throwaway SQLite database that is removed afterwards.
+"""
+import argparse
+import asyncio
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from fastapi.security import HTTPAuthorizationCredentials
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Never touch the configured database: run against a throwaway SQLite file
+SCRATCH_DIR = tempfile.mkdtemp(prefix="herox-bench-")
+atexit.register(shutil.rmtree, SCRATCH_DIR, True)
+os.environ["DATABASE_DIR"] = SCRATCH_DIR
+os.environ["DATABASE_URL"] = f"sqlite://{os.path.join(SCRATCH_DIR, 'bench.db')}"
+
+from database import db  # noqa: E402
+from auth import get_current_user, principal_cache  # noqa: E402
+from routers.auth_router import create_access_token  # noqa: E402
+
+
+def create_fixture():
+    stamp = datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
+    email = f"bench_{stamp}@example.com"
+    user_id = db.users.insert(username=f"bench_{stamp}", email=email, password="x")
+    db.commit()
+    return user_id, create_access_token(data={"sub": email, "user_id": user_id})
+
+
+async def resolve(token: str, requests: int, concurrency: int):
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+    statements = 0
+    execute = db._adapter.execute
+
+    def counting_execute(*args, **kwargs):
+        nonlocal statements
+        statements += 1
+        return execute(*args, **kwargs)
+
+    async def worker(count: int):
+        for _ in range(count):
+            await get_current_user(credentials)
+
+    db._adapter.execute = counting_execute
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(requests // concurrency) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    finally:
+        db._adapter.execute = execute
+    done = requests // concurrency * concurrency
+    return elapsed / done * 1e6, statements / done, done / elapsed
+
+
+async def main(requests: int, concurrency: int):
+    user_id, token = create_fixture()
+    try:
+        print(f"requests={requests} concurrency={concurrency}")
+        for label, ttl in (("uncached (AUTH_CACHE_TTL=0)", 0), ("cached", max(principal_cache.ttl, 30))):
+            principal_cache.ttl = ttl
+            principal_cache.invalidate()
+            await get_current_user(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token))  # warm up
+            per_request, queries, rate = await resolve(token, requests, concurrency)
+            print(f"{label:28} {per_request:8.1f}us/request {queries:5.2f} queries/request {rate:9.0f} requests/s")
+    finally:
+        db(db.users.id == user_id).delete()
+        db.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency))
@@ -0,0 +1,168 @@
+"""Latency of /health while /login and /analytics requests run concurrently.
+
+Every handler runs in one event loop through httpx's ASGI transport, so a
+bcrypt hash or a PyDAL query done on the loop shows up directly as /health
+latency. The benchmark runs itself twice in subprocesses: once with
+DB_WORKERS=0 CPU_WORKERS=0 (everything inline on the loop, the old
+behaviour) and once with the default worker pools.
+
+    python benchmarks/event_loop_latency.py --seconds 10 --logins 4 --analytics 8
+
+Fixtures are created in a throwaway SQLite database, shared by both runs,
+that is removed afterwards.
+"""
+import argparse
+import asyncio
+import atexit
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PROBE_INTERVAL = 0.01  # seconds between /health probes
+
+MODES = {
+    "inline (DB_WORKERS=0 CPU_WORKERS=0)": {"DB_WORKERS": "0", "CPU_WORKERS": "0"},
+    "offloaded (default pools)": {},
+}
+
+
+def create_fixtures(campaigns: int, targets: int):
+    from database import db
+    from routers.auth_router import hash_password, create_access_token
+
+    stamp = datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
+    email = f"bench_{stamp}@example.com"
+    user_id = db.users.insert(username=f"bench_{stamp}", email=email, password=hash_password("bench-password"))
+    sender_id = db.sender_profiles.insert(name="bench", user_id=user_id, auth_type="smtp", from_address="bench@example.com")
+    template_id = db.email_templates.insert(name="bench", user_id=user_id, subject="bench")
+    group_id = db.groups.insert(name="bench", user_id=user_id)
+    target_ids = [
+        db.targets.insert(email=f"t{i}_{stamp}@example.com", user_id=user_id, group_id=group_id)
+        for i in range(targets)
+    ]
+    for c in range(campaigns):
+        campaign_id = db.campaigns.insert(
+            name=f"bench_{stamp}_{c}", user_id=user_id, sender_profile_id=sender_id,
+            email_template_id=template_id, phishlet_id=None, attachment_id=None,
+            target_type="group", target_group_id=group_id, status="completed"
+        )
+        db.campaign_results.bulk_insert([
+            dict(campaign_id=campaign_id, target_id=target_id, email_sent=True, email_opened=i % 2 == 0)
+            for i, target_id in enumerate(target_ids)
+        ])
+    db.commit()
+    return user_id, email, create_access_token(data={"sub": email, "user_id": user_id})
+
+
+def percentile(samples, p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+async def measure(seconds: float, logins: int, analytics: int, campaigns: int, targets: int):
+    # The dashboard cache would hide the query cost the benchmark is after
+    os.environ["DASHBOARD_CACHE_TTL"] = "0"
+    from database import db
+    from main import app, lifespan
+
+    user_id, email, token = create_fixtures(campaigns, targets)
+    done = {"login": 0, "analytics": 0}
+    try:
+        async with lifespan(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+                stop = asyncio.Event()
+
+                async def login_worker():
+                    while not stop.is_set():
+                        resp = await client.post(
+                            "/api/v1/login",
+                            json={"email": email, "password": "bench-password"},
+                            headers={"origin": "http://localhost:3000"},
+                        )
+                        resp.raise_for_status()
+                        done["login"] += 1
+                        # In-process requests may never suspend; a socket round-trip would
+                        await asyncio.sleep(0)
+
+                async def analytics_worker():
+                    headers = {"Authorization": f"Bearer {token}"}
+                    while not stop.is_set():
+                        for path in ("/api/v1/analytics/dashboard", "/api/v1/analytics/campaigns"):
+                            resp = await client.get(path, headers=headers)
+                            resp.raise_for_status()
+                            done["analytics"] += 1
+                            await asyncio.sleep(0)
+
+                load = [asyncio.create_task(login_worker()) for _ in range(logins)]
+                load += [asyncio.create_task(analytics_worker()) for _ in range(analytics)]
+
+                # Latency counts from when the probe was due, so time spent waiting
+                # for a blocked loop to wake the probe up is included
+                samples = []
+                deadline = time.perf_counter() + seconds
+                while time.perf_counter() < deadline:
+                    due = time.perf_counter() + PROBE_INTERVAL
+                    await asyncio.sleep(PROBE_INTERVAL)
+                    resp = await client.get("/health")
+                    resp.raise_for_status()
+                    samples.append((time.perf_counter() - due) * 1000)
+
+                stop.set()
+                await asyncio.gather(*load)
+    finally:
+        db(db.users.id == user_id).delete()
+        db.commit()
+
+    print(
+        f"health p50={statistics.median(samples):.1f}ms p99={percentile(samples, 0.99):.1f}ms "
+        f"max={max(samples):.1f}ms probes={len(samples)} "
+        f"login={done['login'] / seconds:.1f}/s analytics={done['analytics'] / seconds:.1f}/s"
+    )
+
+
+def compare(args):
+    # Never touch the configured database: run against a throwaway SQLite file
+    scratch_dir = tempfile.mkdtemp(prefix="herox-bench-")
+    atexit.register(shutil.rmtree, scratch_dir, True)
+    os.environ["DATABASE_DIR"] = scratch_dir
+    os.environ["DATABASE_URL"] = f"sqlite://{os.path.join(scratch_dir, 'bench.db')}"
+    print(f"seconds={args.seconds} logins={args.logins} analytics={args.analytics} "
+          f"campaigns={args.campaigns} targets={args.targets}")
+    for label, env in MODES.items():
+        result = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child",
+             "--seconds", str(args.seconds), "--logins", str(args.logins), "--analytics", str(args.analytics),
+             "--campaigns", str(args.campaigns), "--targets", str(args.targets)],
+            env={**os.environ, **env}, cwd=ROOT, capture_output=True, text=True,
+        )
+        if result.returncode != 0:
+            print(f"{label}: failed\n{result.stderr}")
+            continue
+        # Handlers print as they go; the summary is the last line
+        print(f"{label:38} {result.stdout.strip().splitlines()[-1]}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--logins", type=int, default=4, help="concurrent /login clients")
+    parser.add_argument("--analytics", type=int, default=8, help="concurrent /analytics clients")
+    parser.add_argument("--campaigns", type=int, default=20)
+    parser.add_argument("--targets", type=int, default=200)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        asyncio.run(measure(args.seconds, args.logins, args.analytics, args.campaigns, args.targets))
+    else:
+        compare(args)
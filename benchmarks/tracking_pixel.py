@@ -0,0 +1,131 @@
+"""Requests/sec of the open tracking pixel, before and after the GIF + write-behind change.
+
+"before" mounts the previous handler (SELECT + update_record + commit, JSON
+body) next to the current /api/v1/track/f1 route and drives both in-process
+through httpx's ASGI transport, so only the handler and DB work is measured.
+
+    python benchmarks/tracking_pixel.py --requests 5000 --concurrency 50
+
+Fixtures are created in a throwaway SQLite database that is removed afterwards.
+"""
+import argparse
+import asyncio
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import httpx
+from fastapi.responses import JSONResponse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Never touch the configured database: run against a throwaway SQLite file
+SCRATCH_DIR = tempfile.mkdtemp(prefix="herox-bench-")
+atexit.register(shutil.rmtree, SCRATCH_DIR, True)
+os.environ["DATABASE_DIR"] = SCRATCH_DIR
+os.environ["DATABASE_URL"] = f"sqlite://{os.path.join(SCRATCH_DIR, 'bench.db')}"
+
+from database import db  # noqa: E402
+from main import app, lifespan  # noqa: E402
+
+
+async def legacy_track_open(unique_id: str):
+    campaign_id, user_id = (int(part) for part in unique_id.split("*"))
+    campaign = db(
+        (db.campaign_results.campaign_id == campaign_id) &
+        (db.campaign_results.target_id == user_id)
+    ).select().first()
+    if not campaign:
+        return JSONResponse(status_code=404, content={"status": 404, "detail": "Record not found"})
+    campaign.update_record(
+        email_opened=True,
+        email_opened_at=campaign.email_opened_at or datetime.utcnow()
+    )
+    db.commit()
+    return JSONResponse(
+        status_code=200,
+        content={
+            "status": 200,
+            "detail": "Email opened successfully tracked",
+            "campaign_id": campaign_id,
+            "user_id": user_id,
+            "opened_at": str(campaign.email_opened_at)
+        }
+    )
+
+
+app.add_api_route("/bench/legacy/f1/{unique_id}", legacy_track_open, methods=["GET"])
+
+
+def create_fixtures(targets: int):
+    stamp = datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
+    user_id = db.users.insert(username=f"bench_{stamp}", email=f"bench_{stamp}@example.com", password="x")
+    sender_id = db.sender_profiles.insert(name="bench", user_id=user_id, auth_type="smtp", from_address="bench@example.com")
+    template_id = db.email_templates.insert(name="bench", user_id=user_id, subject="bench")
+    group_id = db.groups.insert(name="bench", user_id=user_id)
+    campaign_id = db.campaigns.insert(
+        name=f"bench_{stamp}", user_id=user_id, sender_profile_id=sender_id,
+        email_template_id=template_id, phishlet_id=None, attachment_id=None,
+        target_type="group", target_group_id=group_id, status="completed"
+    )
+    target_ids = []
+    for i in range(targets):
+        target_id = db.targets.insert(email=f"t{i}_{stamp}@example.com", user_id=user_id, group_id=group_id)
+        db.campaign_results.insert(campaign_id=campaign_id, target_id=target_id, email_sent=True)
+        target_ids.append(target_id)
+    db.commit()
+    return user_id, campaign_id, target_ids
+
+
+def reset_opens(campaign_id: int):
+    db(db.campaign_results.campaign_id == campaign_id).update(email_opened=False, email_opened_at=None)
+    db.commit()
+
+
+async def run(client: httpx.AsyncClient, paths, concurrency: int) -> float:
+    queue = list(reversed(paths))
+
+    async def worker():
+        while queue:
+            resp = await client.get(queue.pop())
+            resp.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return len(paths) / (time.perf_counter() - start)
+
+
+async def main(requests: int, concurrency: int, targets: int):
+    user_id, campaign_id, target_ids = create_fixtures(targets)
+    try:
+        async with lifespan(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                ids = [f"{campaign_id}*{target_ids[i % len(target_ids)]}" for i in range(requests)]
+
+                reset_opens(campaign_id)
+                before = await run(client, [f"/bench/legacy/f1/{uid}" for uid in ids], concurrency)
+
+                reset_opens(campaign_id)
+                after = await run(client, [f"/api/v1/track/f1/{uid}" for uid in ids], concurrency)
+
+        print(f"requests={requests} concurrency={concurrency} targets={targets}")
+        print(f"before (JSON + per-hit commit): {before:10.0f} req/s")
+        print(f"after  (GIF + write-behind):    {after:10.0f} req/s")
+        print(f"speedup: {after / before:.1f}x")
+    finally:
+        db(db.users.id == user_id).delete()
+        db.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--targets", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency, args.targets))
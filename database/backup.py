@@ -1,8 +1,17 @@
 import sqlite3, shutil, os, uuid, sys
+import dotenv
+dotenv.load_dotenv()
 DB = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'app.db')
 BACKUP = DB + '.bak'
+# Works on the SQLite file directly; other backends are migrated with migrate_database.py
+if not os.getenv("DATABASE_URL", "sqlite").startswith("sqlite"):
+    print("DATABASE_URL is not SQLite; nothing to do here. Use migrate_database.py."); sys.exit(1)
 if not os.path.exists(DB):
     print("DB not found:", DB); sys.exit(1)
+# Fold the WAL into the main file first so the copy has every commit
+checkpoint = sqlite3.connect(DB)
+checkpoint.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+checkpoint.close()
 shutil.copy2(DB, BACKUP)
 conn = sqlite3.connect(DB)
 conn.row_factory = sqlite3.Row
@@ -5,7 +5,15 @@ from fastapi.security import HTTPBearer
 from typing import Optional
 from contextlib import asynccontextmanager
 from routers import auth_router, sender_profile_router, groups_router, targets_router, user_settings_router, phishlet_router, email_template_router, campaigns_router, analytics_router, dashboard_router, attachment_router, tracker_router
-from database import db
+from database import db, ensure_indexes, DB_MIGRATE
+from utils.delivery import delivery_engine
+from utils.scheduler import campaign_scheduler
+from utils.open_tracker import open_tracker
+from utils.cloner import website_cloner
+from utils.counters import counter_reconciler
+from utils.activity_logger import activity_sink
+from utils.target_import import import_worker
+from utils.pagination import NEXT_AFTER_ID_HEADER
 import requests
 from requests.auth import HTTPBasicAuth
 import json
@@ -45,9 +53,24 @@ security = HTTPBearer()
 async def lifespan(app: FastAPI):
     # Startup
     print("Starting up...")
+    if DB_MIGRATE:
+        ensure_indexes()
+    await delivery_engine.start()
+    await campaign_scheduler.start()
+    await open_tracker.start()
+    await activity_sink.start()
+    await counter_reconciler.start()
+    await import_worker.start()
     yield
     # Shutdown
     print("Shutting down...")
+    await import_worker.close()
+    await counter_reconciler.close()
+    await activity_sink.close()
+    await open_tracker.close()
+    await website_cloner.close()
+    await campaign_scheduler.close()
+    await delivery_engine.close()
     db.close()
 
 app = FastAPI(
@@ -114,6 +137,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_AFTER_ID_HEADER],  # lets browsers read list pagination
 )
 
 # Health check endpoint
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Migration script to create the indexes declared in database.py on an existing database.
+Safe to run any number of times; indexes that already exist are left alone.
+tests/test_query_plans.py checks that the hot lookups below use them.
+"""
+
+import sys
+from datetime import datetime
+
+from database import db, INDEXES, existing_indexes, ensure_indexes
+
+
+def hot_queries():
+    """SELECTs of the hot lookup paths, by description"""
+    results = db.campaign_results
+    targets = db.targets
+    activities = db.user_activities
+    events = db.email_events
+    queue = db.delivery_queue
+    now = datetime.utcnow()
+    return {
+        'tracker result lookup': db((results.campaign_id == 1) & (results.target_id == 1))._select(results.id),
+        'results of a target': db(results.target_id == 1)._select(results.id),
+        'phishlet by url_id': db(db.phishlets.url_id == 'x')._select(db.phishlets.id),
+        'target by user and email': db((targets.user_id == 1) & (targets.email == 'x'))._select(targets.id),
+        'targets of a group': db(targets.group_id == 1)._select(targets.id),
+        'campaigns of a user': db(db.campaigns.user_id == 1)._select(db.campaigns.id),
+        'recent activities of a user': db((activities.user_id == 1) & (activities.timestamp >= now))._select(activities.id),
+        'events of a campaign': db((events.campaign_id == 1) & (events.timestamp >= now))._select(events.id),
+        'user by email': db(db.users.email == 'x')._select(db.users.id),
+        'daily rollup row': db((db.daily_rollups.campaign_id == 1) & (db.daily_rollups.day == now.date()))._select(db.daily_rollups.id),
+        'claimable queue rows': db(queue.status == 'queued')._select(queue.id),
+    }
+
+
+def migrate_add_indexes():
+    """Create the missing indexes"""
+    missing = [index_name for _, index_name, _, _ in INDEXES if index_name not in existing_indexes()]
+    if missing:
+        print(f"Creating indexes: {missing}")
+        created = ensure_indexes()
+        print(f"Created {len(created)} of {len(missing)} indexes")
+    else:
+        print("All declared indexes already exist. No migration needed.")
+
+    failed = [index_name for index_name in missing if index_name not in existing_indexes()]
+    if failed:
+        # Usually a unique index over rows that are already duplicated; remove them and run again
+        print(f"Indexes still missing: {failed}")
+        return False
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(0 if migrate_add_indexes() else 1)
@@ -8,9 +8,19 @@ import os
 import sqlite3
 from pathlib import Path
 
+import dotenv
+
+dotenv.load_dotenv()
+
 def migrate_remove_css_js():
     """Remove css_content and js_content columns from phishlets table"""
     
+    # Only SQLite databases made before the columns were dropped from the schema have them;
+    # PyDAL creates tables on other backends from database.py, without the columns
+    if not os.getenv("DATABASE_URL", "sqlite").startswith("sqlite"):
+        print("DATABASE_URL is not SQLite. Nothing to migrate.")
+        return
+    
     # Get database path
     database_dir = os.path.join(os.path.dirname(__file__), 'database')
     db_path = os.path.join(database_dir, 'app.db')
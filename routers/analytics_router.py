@@ -1,9 +1,13 @@
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, status, Depends, Query
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 from datetime import datetime, timedelta
 from database import db
 from auth import get_current_user
+from utils.analytics import campaign_stats as aggregate_campaign_stats, daily_stats as rollup_daily_stats, rate, target_performance
+from utils.dashboard import dashboard_cache
+from utils.offload import db_endpoint
+from utils.user_directory import user_directory
 import json
 
 router = APIRouter()
@@ -63,74 +67,31 @@ class TargetPerformance(BaseModel):
     risk_score: float
 
 @router.get("/dashboard", response_model=DashboardStats)
-async def get_dashboard_stats(current_user = Depends(get_current_user)):
+@db_endpoint
+def get_dashboard_stats(current_user = Depends(get_current_user)):
     """Get comprehensive dashboard statistics"""
     
     try:
-        # Get counts from various tables
-        total_campaigns = db(db.campaigns.user_id == current_user.id).count()
-        if(current_user.is_admin):
-            total_campaigns = db(db.campaigns).count()
-        # Fix the status query - use OR condition instead of in_
-        active_campaigns = db((db.campaigns.user_id == current_user.id)|(current_user.is_admin) & 
-                             ((db.campaigns.status == 'running') | (db.campaigns.status == 'scheduled'))).count()
-        
-        
-        total_targets = db(db.targets.user_id == current_user.id).count()
-        if(current_user.is_admin):
-            total_targets = db(db.targets).count()
-        total_templates = db(db.email_templates.user_id == current_user.id).count()
-        if(current_user.is_admin):
-            total_templates = db(db.email_templates).count()
-        total_phishlets = db(db.phishlets.user_id == current_user.id).count()
-        if(current_user.is_admin):
-            total_phishlets = db(db.phishlets).count()
-        total_sender_profiles = db(db.sender_profiles.user_id == current_user.id).count()
-        if(current_user.is_admin):
-            total_sender_profiles = db(db.sender_profiles).count()
-
-        # Get campaign results statistics
-        campaign_ids = [c.id for c in db((db.campaigns.user_id == current_user.id)|(current_user.is_admin)).select(db.campaigns.id)]
-        
-        if campaign_ids:
-            total_emails_sent = db(db.campaign_results.campaign_id.belongs(campaign_ids) & 
-                                 (db.campaign_results.email_sent == True)).count()
-            total_emails_opened = db(db.campaign_results.campaign_id.belongs(campaign_ids) & 
-                                   (db.campaign_results.email_opened == True)).count()
-            total_clicks = db(db.campaign_results.campaign_id.belongs(campaign_ids) & 
-                            (db.campaign_results.link_clicked == True)).count()
-            total_form_submissions = db(db.campaign_results.campaign_id.belongs(campaign_ids) & 
-                                      (db.campaign_results.form_submitted == True)).count()
-        else:
-            total_emails_sent = 0
-            total_emails_opened = 0
-            total_clicks = 0
-            total_form_submissions = 0
+        # All counters come from one compound query, cached per user for a few seconds
+        counts = dashboard_cache.get(current_user.id, bool(current_user.is_admin))
+        total_emails_sent = counts['emails_sent']
         
         # Calculate success rate
-        if total_emails_sent > 0:
-            success_rate = (total_form_submissions / total_emails_sent) * 100
-        else:
-            success_rate = 0.0
-        
-        # Get recent activity count (last 7 days)
-        week_ago = datetime.utcnow() - timedelta(days=7)
-        recent_activity_count = db((db.user_activities.user_id == current_user.id) & 
-                                  (db.user_activities.timestamp >= week_ago)).count()
+        success_rate = rate(counts['form_submissions'], total_emails_sent)
         
         return DashboardStats(
-            total_campaigns=total_campaigns,
-            active_campaigns=active_campaigns,
-            total_targets=total_targets,
-            total_templates=total_templates,
-            total_phishlets=total_phishlets,
-            total_sender_profiles=total_sender_profiles,
+            total_campaigns=counts['total_campaigns'],
+            active_campaigns=counts['active_campaigns'],
+            total_targets=counts['total_targets'],
+            total_templates=counts['total_templates'],
+            total_phishlets=counts['total_phishlets'],
+            total_sender_profiles=counts['total_sender_profiles'],
             total_emails_sent=total_emails_sent,
-            total_emails_opened=total_emails_opened,
-            total_clicks=total_clicks,
-            total_form_submissions=total_form_submissions,
-            success_rate=round(success_rate, 2),
-            recent_activity_count=recent_activity_count
+            total_emails_opened=counts['emails_opened'],
+            total_clicks=counts['clicks'],
+            total_form_submissions=counts['form_submissions'],
+            success_rate=success_rate,
+            recent_activity_count=counts['recent_activity_count']
         )
         
     except Exception as e:
@@ -140,43 +101,31 @@ async def get_dashboard_stats(current_user = Depends(get_current_user)):
         )
 
 @router.get("/campaigns", response_model=List[CampaignStats])
-async def get_campaign_stats(current_user = Depends(get_current_user)):
+@db_endpoint
+def get_campaign_stats(current_user = Depends(get_current_user)):
     """Get statistics for all campaigns"""
     
     try:
-        campaigns = db(db.campaigns.user_id == current_user.id).select()
+        query = (db.campaigns.user_id == current_user.id)
         if(current_user.is_admin):
-             campaigns = db().select(db.campaigns.ALL)
-        campaign_stats = []
-        
-        for campaign in campaigns:
-            # Get results for this campaign
-            results = db(db.campaign_results.campaign_id == campaign.id).select()
-            
-            total_targets = len(results)
-            emails_sent = len([r for r in results if r.email_sent])
-            emails_opened = len([r for r in results if r.email_opened])
-            clicks = len([r for r in results if r.link_clicked])
-            form_submissions = len([r for r in results if r.form_submitted])
-            
-            # Calculate success rate
-            if emails_sent > 0:
-                success_rate = (form_submissions / emails_sent) * 100
-            else:
-                success_rate = 0.0
-            
-            campaign_stats.append(CampaignStats(
-                campaign_id=campaign.id,
-                campaign_name=campaign.name,
-                status=campaign.status,
-                total_targets=total_targets,
-                emails_sent=emails_sent,
-                emails_opened=emails_opened,
-                clicks=clicks,
-                form_submissions=form_submissions,
-                success_rate=round(success_rate, 2),
-                created_at=campaign.created_at
-            ))
+             query = (db.campaigns.id > 0)
+
+        # One grouped query for every campaign's result counts
+        campaign_stats = [
+            CampaignStats(
+                campaign_id=stats['id'],
+                campaign_name=stats['name'],
+                status=stats['status'],
+                total_targets=stats['total_targets'],
+                emails_sent=stats['emails_sent'],
+                emails_opened=stats['emails_opened'],
+                clicks=stats['clicks'],
+                form_submissions=stats['form_submissions'],
+                success_rate=rate(stats['form_submissions'], stats['emails_sent']),
+                created_at=stats['created_at']
+            )
+            for stats in aggregate_campaign_stats(query)
+        ]
         
         return campaign_stats
         
@@ -187,7 +136,8 @@ async def get_campaign_stats(current_user = Depends(get_current_user)):
         )
 
 @router.get("/campaigns/{campaign_id}", response_model=Dict[str, Any])
-async def get_campaign_detail_stats(
+@db_endpoint
+def get_campaign_detail_stats(
     campaign_id: int,
     current_user = Depends(get_current_user)
 ):
@@ -204,44 +154,23 @@ async def get_campaign_detail_stats(
                 detail="Campaign not found"
             )
         
-        # Get all results for this campaign
-        results = db(db.campaign_results.campaign_id == campaign_id).select()
-        
-        # Calculate statistics
-        total_targets = len(results)
-        emails_sent = len([r for r in results if r.email_sent])
-        emails_opened = len([r for r in results if r.email_opened])
-        clicks = len([r for r in results if r.link_clicked])
-        form_submissions = len([r for r in results if r.form_submitted])
-        credentials_captured = len([r for r in results if r.credentials_captured])
+        # Count results in SQL
+        counts = aggregate_campaign_stats(db.campaigns.id == campaign_id)[0]
+        total_targets = counts['total_targets']
+        emails_sent = counts['emails_sent']
+        emails_opened = counts['emails_opened']
+        clicks = counts['clicks']
+        form_submissions = counts['form_submissions']
+        credentials_captured = counts['credentials_captured']
         
         # Calculate rates
         open_rate = (emails_opened / emails_sent * 100) if emails_sent > 0 else 0
         click_rate = (clicks / emails_sent * 100) if emails_sent > 0 else 0
         submission_rate = (form_submissions / emails_sent * 100) if emails_sent > 0 else 0
         
-        # Get time series data (last 30 days)
+        # Get time series data (last 30 days) from the daily rollups
         thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-        daily_stats = {}
-        
-        for result in results:
-            if result.email_sent_at and result.email_sent_at >= thirty_days_ago:
-                date_str = result.email_sent_at.strftime('%Y-%m-%d')
-                if date_str not in daily_stats:
-                    daily_stats[date_str] = {
-                        'emails_sent': 0,
-                        'emails_opened': 0,
-                        'clicks': 0,
-                        'form_submissions': 0
-                    }
-                
-                daily_stats[date_str]['emails_sent'] += 1
-                if result.email_opened:
-                    daily_stats[date_str]['emails_opened'] += 1
-                if result.link_clicked:
-                    daily_stats[date_str]['clicks'] += 1
-                if result.form_submitted:
-                    daily_stats[date_str]['form_submissions'] += 1
+        daily_stats = rollup_daily_stats(db.campaigns.id == campaign_id, thirty_days_ago.date())
         
         return {
             'campaign': {
@@ -271,7 +200,8 @@ async def get_campaign_detail_stats(
         )
 
 @router.get("/activity", response_model=List[ActivityLog])
-async def get_activity_log(
+@db_endpoint
+def get_activity_log(
     limit: int = 50,
     offset: int = 0,
     current_user = Depends(get_current_user)
@@ -279,8 +209,7 @@ async def get_activity_log(
     """Get user activity log"""
     
     try:
-        #  replaced db.user.is_admin with db.users.is_admin
-        admin_list = [row.id for row in db(db.users.is_admin == True).select(db.users.id)]
+        admin_list = user_directory.admin_ids()
         # print('Admin List:', admin_list)
         if current_user.id in admin_list:
             query = (db.user_activities.user_id == current_user.id)
@@ -312,47 +241,30 @@ async def get_activity_log(
         )
 
 @router.get("/targets/performance", response_model=List[TargetPerformance])
-async def get_target_performance(current_user = Depends(get_current_user)):
-    """Get performance statistics for all targets"""
+@db_endpoint
+def get_target_performance(
+    limit: Optional[int] = Query(None, ge=0),
+    offset: int = Query(0, ge=0),
+    top_k: Optional[int] = Query(None, ge=1),
+    current_user = Depends(get_current_user)
+):
+    """Get performance statistics for all targets, riskiest first.
+
+    limit/offset page through the sorted list; top_k keeps only the k riskiest targets.
+    """
     
     try:
-        targets = db((db.targets.user_id == current_user.id)|(current_user.is_admin)).select()
-        target_performance = []
-        
-        for target in targets:
-            # Get all campaign results for this target
-            results = db(db.campaign_results.target_id == target.id).select()
-            
-            campaigns_participated = len(set(r.campaign_id for r in results))
-            emails_received = len([r for r in results if r.email_sent])
-            emails_opened = len([r for r in results if r.email_opened])
-            clicks = len([r for r in results if r.link_clicked])
-            form_submissions = len([r for r in results if r.form_submitted])
-            
-            # Calculate risk score (higher score = higher risk)
-            if emails_received > 0:
-                open_rate = emails_opened / emails_received
-                click_rate = clicks / emails_received
-                submission_rate = form_submissions / emails_received
-                risk_score = (open_rate * 0.3 + click_rate * 0.4 + submission_rate * 0.3) * 100
-            else:
-                risk_score = 0.0
-            
-            target_performance.append(TargetPerformance(
-                target_id=target.id,
-                target_name=f"{target.first_name or ''} {target.last_name or ''}".strip() or target.email,
-                target_email=target.email,
-                campaigns_participated=campaigns_participated,
-                emails_received=emails_received,
-                emails_opened=emails_opened,
-                clicks=clicks,
-                form_submissions=form_submissions,
-                risk_score=round(risk_score, 2)
-            ))
-        
-        # Sort by risk score (highest first)
-        target_performance.sort(key=lambda x: x.risk_score, reverse=True)
-        return target_performance
+        # Sorted and paged by the database, so only the requested page is read
+        stop = top_k
+        if limit is not None:
+            stop = min(stop, offset + limit) if stop is not None else offset + limit
+        if stop is not None and stop <= offset:
+            return []
+        query = (db.targets.user_id == current_user.id)|(current_user.is_admin)
+        if stop is None:
+            # No bound to page with; LIMIT needs one
+            return [TargetPerformance(**entry) for entry in target_performance(query)[offset:]]
+        return [TargetPerformance(**entry) for entry in target_performance(query, limitby=(offset, stop))]
         
     except Exception as e:
         raise HTTPException(
@@ -361,7 +273,8 @@ async def get_target_performance(current_user = Depends(get_current_user)):
         )
 
 @router.get("/timeseries", response_model=List[TimeSeriesData])
-async def get_time_series_data(
+@db_endpoint
+def get_time_series_data(
     days: int = 30,
     current_user = Depends(get_current_user)
 ):
@@ -370,36 +283,11 @@ async def get_time_series_data(
     try:
         start_date = datetime.utcnow() - timedelta(days=days)
         
-        # Get campaign IDs for this user
-        campaign_ids = [c.id for c in db((db.campaigns.user_id == current_user.id)|(current_user.is_admin)).select(db.campaigns.id)]
-
-        if not campaign_ids:
-            return []
-        
-        # Get results within date range
-        results = db((db.campaign_results.campaign_id.belongs(campaign_ids)) & 
-                    (db.campaign_results.email_sent_at >= start_date)).select()
-        
-        # Group by date
-        daily_stats = {}
-        
-        for result in results:
-            date_str = result.email_sent_at.strftime('%Y-%m-%d')
-            if date_str not in daily_stats:
-                daily_stats[date_str] = {
-                    'emails_sent': 0,
-                    'emails_opened': 0,
-                    'clicks': 0,
-                    'form_submissions': 0
-                }
-            
-            daily_stats[date_str]['emails_sent'] += 1
-            if result.email_opened:
-                daily_stats[date_str]['emails_opened'] += 1
-            if result.link_clicked:
-                daily_stats[date_str]['clicks'] += 1
-            if result.form_submitted:
-                daily_stats[date_str]['form_submissions'] += 1
+        # Sum the daily rollups of this user's campaigns
+        daily_stats = rollup_daily_stats(
+            (db.campaigns.user_id == current_user.id)|(current_user.is_admin),
+            start_date.date()
+        )
         
         # Convert to list format
         time_series_data = []
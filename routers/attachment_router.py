@@ -10,6 +10,8 @@ from datetime import datetime
 from database import db
 from auth import get_current_user
 from utils.activity_logger import ActivityLogger
+from utils.offload import db_endpoint, run_db
+from utils.user_directory import user_directory
 import base64
 import mimetypes
 
@@ -66,11 +68,6 @@ UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)  # Ensure folder exists
 
 
-def checkIfAdmin(user_id: int) -> bool:
-    """Check if a user is admin"""
-    user = db(db.users.id == user_id).select().first()
-    return user.is_admin if user else False
-
 @router.post("/", response_model=AttachmentResponse, status_code=status.HTTP_201_CREATED)
 async def create_attachment(
     name: str = Form(...),
@@ -81,10 +78,10 @@ async def create_attachment(
     request: Request = None
 ):
     # Check for existing attachment
-    existing_attachment = db(
+    existing_attachment = await run_db(lambda: db(
         (db.attachments.user_id == current_user.id) & 
         (db.attachments.name == name)
-    ).select().first()
+    ).select().first())
     
     if existing_attachment:
         raise HTTPException(
@@ -99,7 +96,8 @@ async def create_attachment(
         f.write(await attachmentFile.read())
 
     # Insert into DB (store relative path)
-    attachment_id = db.attachments.insert(
+    attachment_id = await run_db(
+        db.attachments.insert,
         name=name,
         description=description,
         user_id=current_user.id,
@@ -107,9 +105,8 @@ async def create_attachment(
         file_type=file_type,
         isDemo=isDemo,
     )
-    db.commit()
 
-    new_attachment = db.attachments(attachment_id)
+    new_attachment = await run_db(db.attachments, attachment_id)
 
     return AttachmentResponse(
         id=new_attachment.id,
@@ -124,13 +121,14 @@ async def create_attachment(
 
 
 @router.get("/", response_model=List[AttachmentResponse])
-async def list_attachments(current_user=Depends(get_current_user)):
+@db_endpoint
+def list_attachments(current_user=Depends(get_current_user)):
     """List all attachments for the current user"""
 
     query = (db.attachments.user_id == current_user.id) | (db.attachments.isDemo == True)
 
-    if not checkIfAdmin(current_user.id):
-        admin_ids = [user.id for user in db(db.users.is_admin == True).select(db.users.id)]
+    if not user_directory.is_admin(current_user.id):
+        admin_ids = user_directory.admin_ids()
         query |= db.attachments.user_id.belongs(admin_ids)
         attachments = db(query).select()
     else:
@@ -139,6 +137,7 @@ async def list_attachments(current_user=Depends(get_current_user)):
     if not attachments:
         attachments = db(db.attachments.isDemo == True).select()
 
+    admins = user_directory.admin_flags(attachment.user_id for attachment in attachments)
     return [
         AttachmentResponse(
             id=attachment.id,
@@ -147,7 +146,7 @@ async def list_attachments(current_user=Depends(get_current_user)):
             isDemo=attachment.isDemo,
             user_id=attachment.user_id,
             file_type=attachment.file_type,
-            is_admin=checkIfAdmin(attachment.user_id),
+            is_admin=admins.get(attachment.user_id, False),
             created_at=attachment.created_at,
             updated_at=attachment.updated_at,
         )
@@ -181,7 +180,8 @@ async def list_attachments(current_user=Depends(get_current_user)):
 
 
 @router.put("/{attachment_id}", response_model=AttachmentResponse)
-async def update_attachment(
+@db_endpoint
+def update_attachment(
     attachment_id: int,
     name: Optional[str] = Form(None),
     description: Optional[str] = Form(None),
@@ -247,12 +247,13 @@ async def update_attachment(
 import os
 
 @router.get("/{attachment_id}/download")
-async def download_attachment(
+@db_endpoint
+def download_attachment(
     attachment_id: int,
     current_user=Depends(get_current_user)
 ):
     attachment = db(db.attachments.id == attachment_id).select().first()
-    if not checkIfAdmin(attachment.user_id):
+    if not user_directory.is_admin(attachment.user_id):
         if not attachment.is_admin:
            if (attachment.user_id != current_user.id) and not current_user.is_admin:
                raise HTTPException(status_code=403, detail="Not authorized to access this file")
@@ -280,7 +281,8 @@ async def download_attachment(
     
 
 @router.delete("/{attachment_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_attachment(
+@db_endpoint
+def delete_attachment(
     attachment_id: int,
     current_user=Depends(get_current_user)
 ):
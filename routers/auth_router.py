@@ -8,6 +8,7 @@ from database import db
 from auth import get_current_user
 from config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
 from utils.activity_logger import ActivityLogger
+from utils.offload import run_cpu, run_db
 import os
 import dotenv
 from authlib.integrations.starlette_client import OAuth
@@ -130,19 +131,19 @@ async def auth_google_callback(request: Request):
             )
 
         # Step 3: Check if user exists in DB
-        user = db(db.users.email == email).select().first()
+        user = await run_db(lambda: db(db.users.email == email).select().first())
 
         if not user:
             try:
-                user_id = db.users.insert(
+                user_id = await run_db(
+                    db.users.insert,
                     username=name,
                     email=email,
                     password=None,   # No password for Google users
                     is_admin=False,
                     full_name=name
                 )
-                db.commit()
-                user = db.users(user_id)
+                user = await run_db(db.users, user_id)
             except Exception as e:
                 # logger.error(f"Error creating user: {e}")
                 raise HTTPException(
@@ -188,10 +189,10 @@ async def signup(user_data: UserCreate, request: Request):
     """Create a new user account"""
     origin = request.headers.get("origin")
     # Check if user already exists
-    existing_user = db(
+    existing_user = await run_db(lambda: db(
         (db.users.email == user_data.email) | 
         (db.users.username == user_data.username)
-    ).select().first()
+    ).select().first())
     
     if existing_user:
         raise HTTPException(
@@ -199,12 +200,13 @@ async def signup(user_data: UserCreate, request: Request):
             detail="User with this email or username already exists"
         )
     
-    hashed_password = hash_password(user_data.password)
+    hashed_password = await run_cpu(hash_password, user_data.password)
     print("Hashed password:", hashed_password)
     # Create user
     print("origin:", origin)
     if("https://hero-x-admin.vercel.app" in origin):
-        user_id = db.users.insert(
+        user_id = await run_db(
+            db.users.insert,
             username=user_data.username,
             email=user_data.email,
             password=hashed_password,
@@ -212,7 +214,8 @@ async def signup(user_data: UserCreate, request: Request):
             full_name=user_data.full_name
         )
     else:
-        user_id = db.users.insert(
+        user_id = await run_db(
+            db.users.insert,
             username=user_data.username,
             email=user_data.email,
             password=hashed_password,
@@ -220,10 +223,8 @@ async def signup(user_data: UserCreate, request: Request):
             full_name=user_data.full_name
         )
     
-    db.commit()
-    
     # Get the created user
-    user = db.users(user_id)
+    user = await run_db(db.users, user_id)
     
     # Create access token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -253,10 +254,10 @@ async def signup(user_data: UserCreate, request: Request):
     """Create a new user account"""
     origin = request.headers.get("origin")
     # Check if user already exists
-    existing_user = db(
+    existing_user = await run_db(lambda: db(
         (db.users.email == user_data.email) | 
         (db.users.username == user_data.username)
-    ).select().first()
+    ).select().first())
     
     if existing_user:
         raise HTTPException(
@@ -264,12 +265,13 @@ async def signup(user_data: UserCreate, request: Request):
             detail="User with this email or username already exists"
         )
     
-    hashed_password = hash_password(user_data.password)
+    hashed_password = await run_cpu(hash_password, user_data.password)
     print("Hashed password:", hashed_password)
     # Create user
     print("origin:",origin)
     if("https://hero-x-admin.vercel.app" in origin):
-        user_id = db.users.insert(
+        user_id = await run_db(
+            db.users.insert,
             username=user_data.username,
             email=user_data.email,
             password=hashed_password,
@@ -277,7 +279,8 @@ async def signup(user_data: UserCreate, request: Request):
             full_name=user_data.full_name
         )
     else:
-        user_id = db.users.insert(
+        user_id = await run_db(
+            db.users.insert,
             username=user_data.username,
             email=user_data.email,
             password=hashed_password,
@@ -285,10 +288,8 @@ async def signup(user_data: UserCreate, request: Request):
             full_name=user_data.full_name
         )
     
-    db.commit()
-    
     # Get the created user
-    user = db.users(user_id)
+    user = await run_db(db.users, user_id)
     
     # Create access token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -319,7 +320,7 @@ async def login(user_credentials: UserLogin, request: Request):
     """Login user and return access token"""
     origin = request.headers.get("origin")
     # Find user by email
-    user = db(db.users.email == user_credentials.email).select().first()
+    user = await run_db(lambda: db(db.users.email == user_credentials.email).select().first())
     
     if not user:
         raise HTTPException(
@@ -332,7 +333,7 @@ async def login(user_credentials: UserLogin, request: Request):
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Please login using Google OAuth"
         )
-    if not user or not verify_password(user_credentials.password, user.password):
+    if not user or not await run_cpu(verify_password, user_credentials.password, user.password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password"
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException, status, Depends, Request
+from fastapi import APIRouter, HTTPException, status, Depends, Request, Response
 from pydantic import BaseModel, EmailStr
 from typing import Optional, List, Dict, Any
 import json
@@ -6,22 +6,15 @@ from datetime import datetime, timezone, tzinfo
 from typing import Optional
 from database import db
 from auth import get_current_user
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
 from utils.activity_logger import ActivityLogger
-import requests
-import pytz
-from datetime import timedelta
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.base import MIMEBase
-from email import encoders
+from utils.delivery import delivery_engine, enqueue_campaign, campaign_progress, campaign_targets
+from utils.scheduler import campaign_scheduler, to_utc_naive
+from utils.offload import db_endpoint
+from utils.user_directory import user_directory
+from utils.pagination import Page
 from dotenv import load_dotenv
 dotenv_path = '.env'
 import os
-import httpx
-import base64
 router = APIRouter()
 
 # Pydantic models
@@ -76,14 +69,9 @@ class CampaignResponse(BaseModel):
         from_attributes = True
 
 
-def checkIfAdmin(user_id: int) -> bool:
-    """Check if a user is admin"""
-    user = db(db.users.id == user_id).select().first()
-    return user.is_admin if user else False
-
-
 @router.post("/", response_model=CampaignResponse, status_code=status.HTTP_201_CREATED)
-async def create_campaign(
+@db_endpoint
+def create_campaign(
     campaign_data: CampaignCreate,
     current_user = Depends(get_current_user),
     request: Request = None
@@ -112,8 +100,7 @@ async def create_campaign(
     else:
         initial_status = 'scheduled'  # Default to scheduled if no launch_now and no scheduled_at
         scheduled_at = None
-    if scheduled_at is None:
-        scheduled_at = datetime.now(pytz.timezone('Asia/Kolkata'))
+    scheduled_at = to_utc_naive(scheduled_at)
     print("scheduled_at:", scheduled_at)
     # Validate required fields
     if not campaign_data.sender_profile_id  :
@@ -153,44 +140,11 @@ async def create_campaign(
         is_active=True
     )
     db.commit()
-    if campaign_data.launch_now:
-        scheduled_at = scheduled_at + timedelta(minutes=2)
+    new_campaign = db.campaigns(campaign_id)
 
-    m   = scheduled_at.minute
-    h   = scheduled_at.hour
-    d   = scheduled_at.day
-    mon = scheduled_at.month
-    year = scheduled_at.year
-    week = scheduled_at.weekday()
+    # Fire it from the in-process scheduler (immediately when launching now)
+    campaign_scheduler.schedule(campaign_id, scheduled_at)
 
-    new_campaign = db.campaigns(campaign_id)
-    # print("cron_expression", f"{m} {h} {d} {mon} {week}")
-    BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
-    # BACKEND_URL = "https://m7zfbszf-8000.inc1.devtunnels.ms"
-    url= BACKEND_URL + "/api/v1/campaigns/send_email",
-    cronexpression=f"{m} {h} {d} {mon} *"
-    payload = {
-    "cron_expression": cronexpression,   
-    "url": url[0],
-    "http_method": "POST",
-    "http_headers": "Content-Type: application/json",
-    "http_message_body": json.dumps({
-        "id":new_campaign.id
-    }),
-    "timezone_from":1,
-    }
-    print("payload",payload)
-    resp = requests.post(
-        "https://api.easycron.com/v1/cron-jobs",
-        headers={
-            "Content-Type": "application/json",
-            "X-API-Key": os.getenv("EASY_CRON_API_KEY")
-        },
-        json=payload
-    )
-    print("resp",resp.json())
-        
-     
     # Log activity
     if request:
         client_ip = request.client.host if request.client else None
@@ -200,7 +154,8 @@ async def create_campaign(
             campaign_id, 
             campaign_data.name, 
             client_ip, 
-            user_agent
+            user_agent,
+            is_admin=current_user.is_admin
         )
     
     return CampaignResponse(
@@ -218,45 +173,37 @@ async def create_campaign(
         is_active=new_campaign.is_active,
         created_at=new_campaign.created_at,
         updated_at=new_campaign.updated_at,
-        is_admin=checkIfAdmin(new_campaign.user_id)
+        is_admin=user_directory.is_admin(new_campaign.user_id)
     )
 
 @router.get("/", response_model=List[CampaignResponse])
-async def list_campaigns(current_user = Depends(get_current_user)):
-    """List all campaigns for the current user"""
-    
-    # campaigns = db(db.campaigns.user_id == current_user.id).select()
-    query = db.campaigns.user_id == current_user.id
-    # campaign_user = db(db.users.id == campaigns.user_id).select().first()
-    if not current_user.is_admin:
-        campaigns = db(query).select()
-    else:
-        campaigns = db().select(db.campaigns.ALL)
-    return [
-        CampaignResponse(
-            id=campaign.id,
-            name=campaign.name,
-            description=campaign.description,
-            sender_profile_id=campaign.sender_profile_id,
-            email_template_id=campaign.email_template_id,
-            phishlet_id=campaign.phishlet_id,
-            attachment_id=campaign.attachment_id,
-            target_type=campaign.target_type,
-            target_group_id=campaign.target_group_id,
-            target_individuals=json.loads(campaign.target_individuals) if campaign.target_individuals else None,
-            scheduled_at=campaign.scheduled_at,
-            status=campaign.status,
-            is_active=campaign.is_active,
-            user_name = db(db.users.id == campaign.user_id).select().first().full_name,
-            is_admin=checkIfAdmin(campaign.user_id),
-            created_at=campaign.created_at,
-            updated_at=campaign.updated_at
+@db_endpoint
+def list_campaigns(
+    response: Response,
+    page: Page = Depends(),
+    current_user = Depends(get_current_user)
+):
+    """List campaigns for the current user, one page at a time"""
+    page.want(CampaignResponse)
+    
+    query = (db.campaigns.user_id == current_user.id) | (current_user.is_admin)
+    campaigns = page.select(db.campaigns, query, {"user_name": ("user_id",), "is_admin": ("user_id",)})
+
+    names = user_directory.full_names(campaign.user_id for campaign in campaigns) if page.wants("user_name") else {}
+    admins = user_directory.admin_flags(campaign.user_id for campaign in campaigns) if page.wants("is_admin") else {}
+    return page.respond(response, [
+        dict(
+            campaign.as_dict(),
+            target_individuals=json.loads(campaign.target_individuals) if campaign.get("target_individuals") else None,
+            user_name=names.get(campaign.get("user_id")),
+            is_admin=admins.get(campaign.get("user_id"), False)
         )
         for campaign in campaigns
-    ]
+    ])
 
 @router.get("/{campaign_id}", response_model=CampaignResponse)
-async def get_campaign(
+@db_endpoint
+def get_campaign(
     campaign_id: int,
     current_user = Depends(get_current_user)
 ):
@@ -272,7 +219,7 @@ async def get_campaign(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Campaign not found"
         )
-    campaign_user = db(db.users.id == campaign.user_id).select().first()
+    campaign_user = user_directory.get(campaign.user_id)
     
     return CampaignResponse(
         id=campaign.id,
@@ -295,7 +242,8 @@ async def get_campaign(
     
     
 @router.put("/{campaign_id}", response_model=CampaignResponse)
-async def update_campaign(
+@db_endpoint
+def update_campaign(
     campaign_id: int,
     campaign_data: CampaignUpdate,
     current_user = Depends(get_current_user),
@@ -368,7 +316,7 @@ async def update_campaign(
                 changes['status'] = 'scheduled'
     
     if campaign_data.scheduled_at is not None:
-        update_data['scheduled_at'] = campaign_data.scheduled_at
+        update_data['scheduled_at'] = to_utc_naive(campaign_data.scheduled_at)
         changes['scheduled_at'] = campaign_data.scheduled_at.isoformat()
     
     if campaign_data.status is not None:
@@ -398,6 +346,13 @@ async def update_campaign(
     
     # Get the updated campaign
     updated_campaign = db.campaigns(campaign_id)
+
+    # Keep the scheduler in step with the new schedule
+    if updated_campaign.is_active and updated_campaign.status in ('scheduled', 'running'):
+        if 'scheduled_at' in changes or 'status' in changes:
+            campaign_scheduler.schedule(campaign_id, updated_campaign.scheduled_at)
+    else:
+        campaign_scheduler.cancel(campaign_id)
     
     # Log activity
     if request and changes:
@@ -409,7 +364,8 @@ async def update_campaign(
             updated_campaign.name, 
             changes, 
             client_ip, 
-            user_agent
+            user_agent,
+            is_admin=current_user.is_admin
         )
     
     return CampaignResponse(
@@ -431,7 +387,8 @@ async def update_campaign(
     )
 
 @router.delete("/{campaign_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_campaign(
+@db_endpoint
+def delete_campaign(
     campaign_id: int,
     current_user = Depends(get_current_user),
     request: Request = None
@@ -458,17 +415,20 @@ async def delete_campaign(
             campaign_id, 
             campaign.name, 
             client_ip, 
-            user_agent
+            user_agent,
+            is_admin=current_user.is_admin
         )
     
     # Delete the campaign
     db(db.campaigns.id == campaign_id).delete()
     db.commit()
+    campaign_scheduler.cancel(campaign_id)
     
     return None
 
 @router.post("/{campaign_id}/run", status_code=status.HTTP_200_OK)
-async def run_campaign(
+@db_endpoint
+def run_campaign(
     campaign_id: int,
     current_user = Depends(get_current_user),
     request: Request = None
@@ -498,6 +458,7 @@ async def run_campaign(
         updated_at=datetime.utcnow()
     )
     db.commit()
+    campaign_scheduler.schedule(campaign_id)
     
     # Log activity
     if request:
@@ -509,13 +470,15 @@ async def run_campaign(
             campaign.name, 
             {"status": "running"}, 
             client_ip, 
-            user_agent
+            user_agent,
+            is_admin=current_user.is_admin
         )
     
     return {"message": "Campaign started successfully"}
 
 @router.post("/{campaign_id}/pause", status_code=status.HTTP_200_OK)
-async def pause_campaign(
+@db_endpoint
+def pause_campaign(
     campaign_id: int,
     current_user = Depends(get_current_user),
     request: Request = None
@@ -556,7 +519,8 @@ async def pause_campaign(
             campaign.name, 
             {"status": "paused"}, 
             client_ip, 
-            user_agent
+            user_agent,
+            is_admin=current_user.is_admin
         )
     
     return {"message": "Campaign paused successfully"}
@@ -580,7 +544,8 @@ def parse_captured_data(captured_data: str) -> List[List[str]]:
         return {"credentials": creds_list}
 
 @router.get("/{campaign_id}/results", response_model=List[dict])
-async def get_campaign_results(
+@db_endpoint
+def get_campaign_results(
     campaign_id: int,
     current_user = Depends(get_current_user)
 ):
@@ -623,9 +588,10 @@ class EmailRequest(BaseModel):
     id: Optional[int] = None
 
 
-@router.post("/send_email", status_code=status.HTTP_200_OK)
-async def send_email(email_req: EmailRequest):
-    """Send phishing or campaign emails with validations"""
+@router.post("/send_email", status_code=status.HTTP_202_ACCEPTED)
+@db_endpoint
+def send_email(email_req: EmailRequest):
+    """Validate a campaign and queue its emails for background delivery"""
     if not email_req.id:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -661,28 +627,18 @@ async def send_email(email_req: EmailRequest):
     attachment = db(campaign.attachment_id == db.attachments.id).select().first() if campaign.attachment_id else None
 
     # Collect targets
-    targets_list = []
-    if campaign.target_type == "individual":
-        try:
-            targets = json.loads(campaign.target_individuals or "[]")
-        except json.JSONDecodeError:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Invalid target individuals format"
-            )
-        for target in targets:
-            t = db(db.targets.id == target).select().first()
-            if t and t.is_active:
-                targets_list.append(t)
-    else:
-        group = db(campaign.target_group_id == db.groups.id).select().first()
-        if not group:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Target group not found"
-            )
-        targets = db(db.targets.group_id == group.id).select()
-        targets_list.extend([t for t in targets if t.is_active])
+    try:
+        targets_list = campaign_targets(campaign)
+    except LookupError as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
 
     if not targets_list:
         raise HTTPException(
@@ -699,131 +655,40 @@ async def send_email(email_req: EmailRequest):
             detail="Invalid SMTP credentials"
         )
 
-    # ---- Send emails ----
-    errors = []
-    for target in targets_list:
-        msg = MIMEMultipart("alternative")
-        msg["From"] = sender.from_address
-        msg["To"] = target.email
-        msg["Subject"] = email_temp.subject or "No Subject"
-
-        # Attachment
-        if attachment:
-            try:
-                file_path = attachment.attachmentFile.replace("\\", "/")
-                with open(file_path, "rb") as f:
-                    file_bytes = f.read()
-                maintype, subtype = attachment.file_type.split("/", 1)
-                part = MIMEBase(maintype, subtype)
-                part.set_payload(file_bytes)
-                encoders.encode_base64(part)
-                part.add_header("Content-Disposition", f'attachment; filename="{attachment.name}"')
-                msg.attach(part)
-            except Exception as e:
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail=f"Failed to attach file: {str(e)}"
-                )
-            plain_body = email_temp.text_content
-            html_body = email_temp.html_content
-
-        # Phishlet
-        elif phishlet:
-            plain_body = f"{email_temp.text_content}\n\nClick here: {phishlet.clone_url}"
-            phishlet_url = f"{phishlet.clone_url}*{campaign.id}*{target.id}"
-            html_body = email_temp.html_content.replace("{{PHISHLET_URL}}", phishlet_url)
+    if attachment and not os.path.exists(attachment.attachmentFile.replace("\\", "/")):
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to read attachment file: file not found"
+        )
 
-        else:
-            plain_body = email_temp.text_content
-            html_body = email_temp.html_content
-
-        # Tracking pixel
-        image_src = os.getenv("BACKEND_URL", "")
-        html_body = f"""
-            {html_body}
-            <br>
-            <img width="1" height="1" src="{image_src}/api/v1/track/f1/{campaign.id}*{target.id}">
-        """
-
-        msg.attach(MIMEText(plain_body, "plain"))
-        msg.attach(MIMEText(html_body, "html"))
-
-        # ---- Send via SMTP ----
-        # Build attachments payload (base64 encoded) if there's an attachment
-        attachments_payload = []
-        if attachment:
-            try:
-                file_path = attachment.attachmentFile.replace("\\", "/")
-                with open(file_path, "rb") as f:
-                    file_bytes = f.read()
-                encoded = base64.b64encode(file_bytes).decode()
-                attachments_payload.append({
-                    "filename": attachment.name,
-                    "content_base64": encoded,
-                    "mime_type": attachment.file_type,
-                })
-            except Exception as e:
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail=f"Failed to read attachment file: {str(e)}"
-                )
-
-        # Send mail via external mailer API (configurable via MAILER_API_URL)
-        MAILER_API_URL = os.getenv("EMAIL_API_URL", "http://localhost:8001/send")
-        mailer_payload = {
-            "smtp_host": sender.smtp_host,
-            "smtp_port": sender.smtp_port,
-            "smtp_username": EMAIL_USER,
-            "smtp_password": EMAIL_PASSWORD,
-            "from_address": sender.from_address,
-            "to": target.email,
-            "subject": email_temp.subject or "No Subject",
-            "plain_body": plain_body,
-            "html_body": html_body,
-            "attachments": attachments_payload,
-        }
-
-        try:
-            resp = httpx.post(MAILER_API_URL, json=mailer_payload, timeout=60)
-            if resp.status_code != 200:
-                errors.append({"email": target.email, "error": f"Mailer API error: {resp.status_code} {resp.text}"})
-                continue
-
-            now = datetime.utcnow()
-
-            # Log email events
-            db.email_events.insert(
-                campaign_id=campaign.id,
-                target_id=target.id,
-                event_type="sent",
-                event_data=json.dumps({
-                    "subject": email_temp.subject,
-                    "from": sender.from_address,
-                    "to": target.email
-                })
-            )
+    # ---- Queue one delivery per target; workers pick them up ----
+    queued = enqueue_campaign(campaign.id, [target.id for target in targets_list])
+    delivery_engine.notify()
 
-            # Update campaign results
-            db.campaign_results.update_or_insert(
-                (db.campaign_results.campaign_id == campaign.id) &
-                (db.campaign_results.target_id == target.id),
-                campaign_id=campaign.id,
-                target_id=target.id,
-                email_sent=True,
-                email_sent_at=now,
-                updated_at=now
-            )
-            db.commit()
+    return {
+        "message": "Campaign delivery queued",
+        "job_id": campaign.id,
+        "count": len(targets_list),
+        "queued": queued
+    }
 
-        except httpx.RequestError as e:
-            errors.append({"email": target.email, "error": f"Mailer request error: {str(e)}"})
-        except Exception as e:
-            errors.append({"email": target.email, "error": f"Unexpected error: {str(e)}"})
 
-    if errors:
+@router.get("/send_email/{campaign_id}", status_code=status.HTTP_200_OK)
+@db_endpoint
+def get_send_progress(
+    campaign_id: int,
+    current_user = Depends(get_current_user)
+):
+    """Get delivery progress of a campaign from the send queue"""
+    campaign = db(
+        (db.campaigns.id == campaign_id) & 
+        ((db.campaigns.user_id == current_user.id)|(current_user.is_admin))
+    ).select().first()
+
+    if not campaign:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail={"message": "Some emails failed", "errors": errors}
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Campaign not found"
         )
 
-    return {"message": "✅ Emails sent successfully!", "count": len(targets_list)}
+    return campaign_progress(campaign_id)
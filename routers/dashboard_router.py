@@ -6,6 +6,9 @@ from datetime import datetime, timedelta
 from database import db
 from auth import get_current_user
 from utils.activity_logger import ActivityLogger
+from utils.analytics import campaign_stats, rate
+from utils.dashboard import dashboard_cache
+from utils.offload import db_endpoint
 
 router = APIRouter()
 
@@ -53,61 +56,36 @@ class EmailEventSummary(BaseModel):
     recent_events: List[Dict[str, Any]]
 
 @router.get("/stats", response_model=DashboardStatsResponse)
-async def get_dashboard_stats(current_user = Depends(get_current_user)):
+@db_endpoint
+def get_dashboard_stats(current_user = Depends(get_current_user)):
     """Get comprehensive dashboard statistics"""
     
-    # Get all campaigns for the user
-    campaigns = db(db.campaigns.user_id == current_user.id).select()
-    campaign_ids = [campaign.id for campaign in campaigns]
-    
-    # Get campaign results
-    results = db(db.campaign_results.campaign_id.belongs(campaign_ids)).select() if campaign_ids else []
-    
-    # Calculate campaign stats
-    total_campaigns = len(campaigns)
-    active_campaigns = len([c for c in campaigns if c.status in ['running', 'scheduled']])
-    
-    # Calculate resource counts
-    total_targets = len(db(db.targets.user_id == current_user.id).select())
-    total_templates = len(db(db.email_templates.user_id == current_user.id).select())
-    total_phishlets = len(db(db.phishlets.user_id == current_user.id).select())
-    total_sender_profiles = len(db(db.sender_profiles.user_id == current_user.id).select())
-    total_groups = len(db(db.groups.user_id == current_user.id).select())
-    
-    # Calculate email stats
-    total_emails_sent = len([r for r in results if r.email_sent])
-    total_emails_opened = len([r for r in results if r.email_opened])
-    total_links_clicked = len([r for r in results if r.link_clicked])
-    total_forms_submitted = len([r for r in results if r.form_submitted])
-    total_credentials_captured = len([r for r in results if r.credentials_captured])
-    
-    # Calculate rates
-    overall_open_rate = (total_emails_opened / total_emails_sent * 100) if total_emails_sent > 0 else 0.0
-    overall_click_rate = (total_links_clicked / total_emails_sent * 100) if total_emails_sent > 0 else 0.0
-    overall_submission_rate = (total_forms_submitted / total_emails_sent * 100) if total_emails_sent > 0 else 0.0
-    overall_capture_rate = (total_credentials_captured / total_emails_sent * 100) if total_emails_sent > 0 else 0.0
+    # All counters come from one compound query, cached per user for a few seconds
+    counts = dashboard_cache.get(current_user.id)
+    total_emails_sent = counts['emails_sent']
     
     return DashboardStatsResponse(
-        total_campaigns=total_campaigns,
-        active_campaigns=active_campaigns,
-        total_targets=total_targets,
-        total_templates=total_templates,
-        total_phishlets=total_phishlets,
-        total_sender_profiles=total_sender_profiles,
-        total_groups=total_groups,
+        total_campaigns=counts['total_campaigns'],
+        active_campaigns=counts['active_campaigns'],
+        total_targets=counts['total_targets'],
+        total_templates=counts['total_templates'],
+        total_phishlets=counts['total_phishlets'],
+        total_sender_profiles=counts['total_sender_profiles'],
+        total_groups=counts['total_groups'],
         total_emails_sent=total_emails_sent,
-        total_emails_opened=total_emails_opened,
-        total_links_clicked=total_links_clicked,
-        total_forms_submitted=total_forms_submitted,
-        total_credentials_captured=total_credentials_captured,
-        overall_open_rate=round(overall_open_rate, 2),
-        overall_click_rate=round(overall_click_rate, 2),
-        overall_submission_rate=round(overall_submission_rate, 2),
-        overall_capture_rate=round(overall_capture_rate, 2)
+        total_emails_opened=counts['emails_opened'],
+        total_links_clicked=counts['clicks'],
+        total_forms_submitted=counts['form_submissions'],
+        total_credentials_captured=counts['credentials_captured'],
+        overall_open_rate=rate(counts['emails_opened'], total_emails_sent),
+        overall_click_rate=rate(counts['clicks'], total_emails_sent),
+        overall_submission_rate=rate(counts['form_submissions'], total_emails_sent),
+        overall_capture_rate=rate(counts['credentials_captured'], total_emails_sent)
     )
 
 @router.get("/recent-activity", response_model=DashboardActivitySummary)
-async def get_recent_activity(
+@db_endpoint
+def get_recent_activity(
     days: int = 7,
     limit: int = 50,
     current_user = Depends(get_current_user)
@@ -162,7 +140,8 @@ async def get_recent_activity(
     )
 
 @router.get("/email-events", response_model=EmailEventSummary)
-async def get_email_events_summary(
+@db_endpoint
+def get_email_events_summary(
     days: int = 7,
     current_user = Depends(get_current_user)
 ):
@@ -231,7 +210,8 @@ async def get_email_events_summary(
     )
 
 @router.get("/activity-breakdown")
-async def get_activity_breakdown(
+@db_endpoint
+def get_activity_breakdown(
     days: int = 30,
     current_user = Depends(get_current_user)
 ):
@@ -280,56 +260,40 @@ async def get_activity_breakdown(
     }
 
 @router.get("/campaign-performance")
-async def get_campaign_performance_summary(current_user = Depends(get_current_user)):
+@db_endpoint
+def get_campaign_performance_summary(current_user = Depends(get_current_user)):
     """Get campaign performance summary for dashboard"""
     
-    # Get all campaigns
-    campaigns = db(db.campaigns.user_id == current_user.id).select()
-    
+    # One grouped query for every campaign's result counts
     campaign_performance = []
-    for campaign in campaigns:
-        # Get campaign results
-        results = db(db.campaign_results.campaign_id == campaign.id).select()
-        
-        # Calculate metrics
-        total_targets = len(results)
-        emails_sent = len([r for r in results if r.email_sent])
-        emails_opened = len([r for r in results if r.email_opened])
-        links_clicked = len([r for r in results if r.link_clicked])
-        forms_submitted = len([r for r in results if r.form_submitted])
-        credentials_captured = len([r for r in results if r.credentials_captured])
-        
-        # Calculate rates
-        open_rate = (emails_opened / emails_sent * 100) if emails_sent > 0 else 0.0
-        click_rate = (links_clicked / emails_sent * 100) if emails_sent > 0 else 0.0
-        submission_rate = (forms_submitted / emails_sent * 100) if emails_sent > 0 else 0.0
-        capture_rate = (credentials_captured / emails_sent * 100) if emails_sent > 0 else 0.0
-        
+    for stats in campaign_stats(db.campaigns.user_id == current_user.id):
+        emails_sent = stats['emails_sent']
         campaign_performance.append({
-            "campaign_id": campaign.id,
-            "campaign_name": campaign.name,
-            "status": campaign.status,
-            "total_targets": total_targets,
+            "campaign_id": stats['id'],
+            "campaign_name": stats['name'],
+            "status": stats['status'],
+            "total_targets": stats['total_targets'],
             "emails_sent": emails_sent,
-            "emails_opened": emails_opened,
-            "links_clicked": links_clicked,
-            "forms_submitted": forms_submitted,
-            "credentials_captured": credentials_captured,
-            "open_rate": round(open_rate, 2),
-            "click_rate": round(click_rate, 2),
-            "submission_rate": round(submission_rate, 2),
-            "capture_rate": round(capture_rate, 2),
-            "created_at": campaign.created_at.isoformat(),
-            "updated_at": campaign.updated_at.isoformat()
+            "emails_opened": stats['emails_opened'],
+            "links_clicked": stats['clicks'],
+            "forms_submitted": stats['form_submissions'],
+            "credentials_captured": stats['credentials_captured'],
+            "open_rate": rate(stats['emails_opened'], emails_sent),
+            "click_rate": rate(stats['clicks'], emails_sent),
+            "submission_rate": rate(stats['form_submissions'], emails_sent),
+            "capture_rate": rate(stats['credentials_captured'], emails_sent),
+            "created_at": stats['created_at'].isoformat(),
+            "updated_at": stats['updated_at'].isoformat()
         })
     
     return {
-        "total_campaigns": len(campaigns),
+        "total_campaigns": len(campaign_performance),
         "campaigns": campaign_performance
     }
 
 @router.get("/quick-stats")
-async def get_quick_stats(current_user = Depends(get_current_user)):
+@db_endpoint
+def get_quick_stats(current_user = Depends(get_current_user)):
     """Get quick stats for dashboard widgets"""
     
     # Get counts for different resources
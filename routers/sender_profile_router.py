@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException, status, Depends, Request
+from fastapi import APIRouter, HTTPException, status, Depends, Request, Response
 from pydantic import BaseModel, EmailStr
 from typing import Optional, List
 from datetime import datetime, timedelta
@@ -6,6 +6,9 @@ from database import db
 from config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
 from auth import get_current_user
 from utils.activity_logger import ActivityLogger
+from utils.offload import db_endpoint
+from utils.user_directory import user_directory
+from utils.pagination import Page
 
 router = APIRouter()
 
@@ -77,14 +80,9 @@ class SenderProfileResponse(BaseModel):
     class Config:
         from_attributes = True
 
-def checkIfAdmin(user_id: int) -> bool:
-    """Check if a user is admin"""
-    user = db(db.users.id == user_id).select().first()
-    return user.is_admin if user else False
-
-
 @router.post("/", response_model=SenderProfileResponse, status_code=status.HTTP_201_CREATED)
-async def create_sender_profile(
+@db_endpoint
+def create_sender_profile(
     profile_data: SenderProfileCreate,
     current_user = Depends(get_current_user),
     request: Request = None
@@ -186,45 +184,38 @@ async def create_sender_profile(
         smtp_username=new_profile.smtp_username,
         oauth_client_id=new_profile.oauth_client_id,
         is_active=new_profile.is_active,
-        is_admin=checkIfAdmin(new_profile.user_id),
+        is_admin=user_directory.is_admin(new_profile.user_id),
         created_at=new_profile.created_at,
         updated_at=new_profile.updated_at
     )
 
 @router.get("/", response_model=List[SenderProfileResponse])
-async def list_sender_profiles(current_user = Depends(get_current_user)):
-    """List all sender profiles for the current user"""
+@db_endpoint
+def list_sender_profiles(
+    response: Response,
+    page: Page = Depends(),
+    current_user = Depends(get_current_user)
+):
+    """List sender profiles for the current user and admins, one page at a time"""
+    page.want(SenderProfileResponse)
     
-    # profiles = db(db.sender_profiles.user_id == current_user.id).select()
-    query= (db.sender_profiles.user_id == current_user.id)
+    query = (db.sender_profiles.user_id == current_user.id)
     if not current_user.is_admin:
-        admin_ids = [user.id for user in db(db.users.is_admin == True).select(db.users.id)]
+        admin_ids = user_directory.admin_ids()
         query |= db.sender_profiles.user_id.belongs(admin_ids)
-        profiles = db(query).select()
     else:
-        profiles = db(db.sender_profiles).select()  
-    
-    return [
-        SenderProfileResponse(
-            id=profile.id,
-            name=profile.name,
-            auth_type=profile.auth_type,
-            from_address=profile.from_address,
-            from_name=profile.from_name,
-            smtp_host=profile.smtp_host,
-            smtp_port=profile.smtp_port,
-            smtp_username=profile.smtp_username,
-            oauth_client_id=profile.oauth_client_id,
-            is_active=profile.is_active,
-            is_admin=checkIfAdmin(profile.user_id),
-            created_at=profile.created_at,
-            updated_at=profile.updated_at
-        )
+        query = db.sender_profiles.id > 0
+    profiles = page.select(db.sender_profiles, query, {"is_admin": ("user_id",)})
+    
+    admins = user_directory.admin_flags(profile.user_id for profile in profiles) if page.wants("is_admin") else {}
+    return page.respond(response, [
+        dict(profile.as_dict(), is_admin=admins.get(profile.get("user_id"), False))
         for profile in profiles
-    ]
+    ])
 
 @router.get("/{profile_id}", response_model=SenderProfileResponse)
-async def get_sender_profile(
+@db_endpoint
+def get_sender_profile(
     profile_id: int,
     current_user = Depends(get_current_user)
 ):
@@ -251,14 +242,15 @@ async def get_sender_profile(
         smtp_port=profile.smtp_port,
         smtp_username=profile.smtp_username,
         oauth_client_id=profile.oauth_client_id,
-        is_admin=checkIfAdmin(profile.user_id),
+        is_admin=user_directory.is_admin(profile.user_id),
         is_active=profile.is_active,
         created_at=profile.created_at,
         updated_at=profile.updated_at
     )
 
 @router.put("/{profile_id}", response_model=SenderProfileResponse)
-async def update_sender_profile(
+@db_endpoint
+def update_sender_profile(
     profile_id: int,
     profile_data: SenderProfileUpdate,
     current_user = Depends(get_current_user),
@@ -373,13 +365,14 @@ async def update_sender_profile(
         smtp_username=updated_profile.smtp_username,
         oauth_client_id=updated_profile.oauth_client_id,
         is_active=updated_profile.is_active,
-        is_admin=checkIfAdmin(updated_profile.user_id),
+        is_admin=user_directory.is_admin(updated_profile.user_id),
         created_at=updated_profile.created_at,
         updated_at=updated_profile.updated_at
     )
 
 @router.delete("/{profile_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_sender_profile(
+@db_endpoint
+def delete_sender_profile(
     profile_id: int,
     current_user = Depends(get_current_user),
     request: Request = None
@@ -1,11 +1,15 @@
-from fastapi import APIRouter, HTTPException, status, Depends, Request,UploadFile, File
+from fastapi import APIRouter, HTTPException, status, Depends, Request, Response, UploadFile, File
 from pydantic import BaseModel, EmailStr
 from typing import Dict, Optional, List, Union
 from datetime import datetime
 from database import db
 from auth import get_current_user
 from utils.activity_logger import ActivityLogger
-import io, csv
+from utils.offload import db_endpoint, run_db
+from utils.user_directory import user_directory
+from utils.pagination import Page
+from utils.target_import import import_targets, import_worker, spool_upload, InvalidTargetCSV, IMPORT_NODE
+import asyncio, json
 
 router = APIRouter()
 
@@ -47,13 +51,23 @@ class BulkImportResult(BaseModel):
     skipped_duplicates: int
     errors: List[Dict[str, str]]
 
-def checkIfAdmin(user_id: int) -> bool:
-    """Check if a user is admin"""
-    user = db(db.users.id == user_id).select().first()
-    return user.is_admin if user else False
+class ImportJobResponse(BaseModel):
+    id: int
+    file_name: Optional[str] = None
+    status: str
+    rows_processed: int
+    inserted_count: int
+    skipped_duplicates: int
+    error_count: int
+    errors: List[Dict[str, str]]
+    last_error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+    finished_at: Optional[datetime] = None
 
 @router.post("/", response_model=TargetResponse, status_code=status.HTTP_201_CREATED)
-async def create_target(
+@db_endpoint
+def create_target(
     target_data: TargetCreate,
     current_user = Depends(get_current_user),
     request: Request = None
@@ -113,7 +127,8 @@ async def create_target(
             target_id, 
             target_data.email, 
             client_ip, 
-            user_agent
+            user_agent,
+            is_admin=current_user.is_admin
         )
     
     return TargetResponse(
@@ -125,7 +140,7 @@ async def create_target(
         group_id=new_target.group_id,
         group_name=group_name,
         is_active=new_target.is_active,
-        is_admin=checkIfAdmin(new_target.user_id),
+        is_admin=user_directory.is_admin(new_target.user_id),
         created_at=new_target.created_at,
         updated_at=new_target.updated_at
     )
@@ -133,11 +148,15 @@ async def create_target(
 
 
 @router.get("/", response_model=List[TargetResponse])
-async def list_targets(
+@db_endpoint
+def list_targets(
+    response: Response,
     group_id: Optional[int] = None,
+    page: Page = Depends(),
     current_user = Depends(get_current_user)
 ):
-    """List all targets for the current user, optionally filtered by group"""
+    """List targets for the current user, optionally filtered by group, one page at a time"""
+    page.want(TargetResponse)
 
     query = (db.targets.user_id == current_user.id) | (current_user.is_admin)
 
@@ -146,7 +165,7 @@ async def list_targets(
         group = db(
             (db.groups.id == group_id) & 
             ((db.groups.user_id == current_user.id) | (current_user.is_admin))
-        ).select().first()
+        ).select(db.groups.id).first()
         
         if not group:
             raise HTTPException(
@@ -155,31 +174,25 @@ async def list_targets(
             )
         query &= db.targets.group_id == group_id
     
-    targets = db(query).select()
+    targets = page.select(db.targets, query, {"group_name": ("group_id",), "is_admin": ("user_id",)})
     
-    # Get group names for all targets
-    group_ids = [target.group_id for target in targets if target.group_id]
+    # Get group names for the page's targets
     groups = {}
-    if group_ids:
-        groups_data = db(db.groups.id.belongs(group_ids)).select()
-        groups = {group.id: group.name for group in groups_data}
-    
-    return [
-        TargetResponse(
-            id=target.id,
-            first_name=target.first_name,
-            last_name=target.last_name,
-            email=target.email,
-            position=target.position,
-            group_id=target.group_id,
-            group_name=groups.get(target.group_id) if target.group_id else None,
-            is_active=target.is_active,
-            is_admin=checkIfAdmin(target.user_id),
-            created_at=target.created_at,
-            updated_at=target.updated_at
+    if page.wants("group_name"):
+        group_ids = list({target.group_id for target in targets if target.group_id})
+        if group_ids:
+            groups_data = db(db.groups.id.belongs(group_ids)).select(db.groups.id, db.groups.name)
+            groups = {group.id: group.name for group in groups_data}
+    
+    admins = user_directory.admin_flags(target.user_id for target in targets) if page.wants("is_admin") else {}
+    return page.respond(response, [
+        dict(
+            target.as_dict(),
+            group_name=groups.get(target.get("group_id")),
+            is_admin=admins.get(target.get("user_id"), False)
         )
         for target in targets
-    ]
+    ])
     
 
 
@@ -200,92 +213,105 @@ async def import_targets_csv(
     if not file.filename.lower().endswith((".csv")):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Only CSV files are accepted")
 
-    content = await file.read()
     try:
-        text = content.decode("utf-8-sig")
-    except Exception:
-        text = content.decode("latin-1")
-
-    reader = csv.DictReader(io.StringIO(text))
-    inserted = 0
-    skipped = 0
-    errors: List[Dict[str, str]] = []
-
-    # cache group name -> id to avoid repeated DB queries
-    group_cache: Dict[str, int] = {}
-
-    for idx, row in enumerate(reader, start=1):
-        try:
-            email = (row.get("email") or "").strip()
-            first_name = (row.get("first_name") or row.get("first name") or "").strip()
-            
-            if not email or not first_name:
-                    raise HTTPException(
-                        status_code=status.HTTP_404_NOT_FOUND,
-                        detail="Upload valid csv file"
-                    )
-                
-          
-            # skip duplicate for this user
-            existing = db((db.targets.user_id == current_user.id) & (db.targets.email == email)).select().first()
-            if existing:
-                skipped += 1
-                continue
-
-            first_name = (row.get("first_name") or "").strip() or None
-            last_name = (row.get("last_name") or "").strip() or None
-            position = (row.get("position") or "").strip() or None
-            is_active_val = (row.get("is_active") or "").strip().lower()
-            is_active = True if is_active_val in ("1","true","yes","y") else False if is_active_val in ("0","false","no","n") else True
-
-            group_id = None
-            group_name = (row.get("group_name") or "").strip()
-            if group_name:
-                if group_name in group_cache:
-                    group_id = group_cache[group_name]
-                else:
-                    group_rec = db((db.groups.user_id == current_user.id) & (db.groups.name == group_name)).select().first()
-                    if not group_rec:
-                        group_id = db.groups.insert(name=group_name, user_id=current_user.id, is_active=True)
-                        db.commit()
-                        group_cache[group_name] = group_id
-                    else:
-                        group_id = group_rec.id
-                        group_cache[group_name] = group_id
-
-            # insert target
-            new_id = db.targets.insert(
-                first_name=first_name,
-                last_name=last_name,
-                email=email,
-                position=position,
-                group_id=group_id,
-                user_id=current_user.id,
-                is_active=is_active,
-            )
-            db.commit()
+        inserted, skipped, errors = await run_db(import_targets, file.file, current_user.id)
+    except InvalidTargetCSV:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Upload valid csv file"
+        )
 
-            # log activity per inserted target
-            if request:
-                client_ip = request.client.host if request.client else None
-                user_agent = request.headers.get("user-agent")
-                ActivityLogger.log_target_added(current_user.id, new_id, email, client_ip, user_agent)
+    # One summary record for the whole file
+    client_ip = request.client.host if request and request.client else None
+    user_agent = request.headers.get("user-agent") if request else None
+    ActivityLogger.log_targets_imported(current_user.id, file.filename, inserted, skipped, len(errors),
+                                        client_ip, user_agent, is_admin=current_user.is_admin)
 
-            inserted += 1
+    return BulkImportResult(inserted_count=inserted, skipped_duplicates=skipped, errors=errors)
 
-        except Exception as e:
-            raise HTTPException(
-                        status_code=status.HTTP_404_NOT_FOUND,
-                        detail="Upload valid csv file"
-                    )
-            # errors.append({"row": str(idx), "error": str(e)})
-            # continue on error for other rows
+def import_job_response(job) -> ImportJobResponse:
+    return ImportJobResponse(
+        id=job.id,
+        file_name=job.file_name,
+        status=job.status,
+        rows_processed=job.rows_processed or 0,
+        inserted_count=job.inserted_count or 0,
+        skipped_duplicates=job.skipped_duplicates or 0,
+        error_count=job.error_count or 0,
+        errors=json.loads(job.errors) if job.errors else [],
+        last_error=job.last_error,
+        created_at=job.created_at,
+        updated_at=job.updated_at,
+        finished_at=job.finished_at
+    )
 
-    return BulkImportResult(inserted_count=inserted, skipped_duplicates=skipped, errors=errors)
+def get_import_job(job_id: int, current_user):
+    job = db(
+        (db.import_jobs.id == job_id) &
+        ((db.import_jobs.user_id == current_user.id) | (current_user.is_admin))
+    ).select().first()
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Import job not found"
+        )
+    return job
+
+@router.post("/import/jobs", response_model=ImportJobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def create_import_job(
+    file: UploadFile = File(...),
+    current_user = Depends(get_current_user)
+):
+    """
+    Import targets from CSV in the background. Same format as /import; poll GET /import/{job_id} for progress
+    """
+    if not file.filename.lower().endswith((".csv")):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Only CSV files are accepted")
+
+    # Spool the upload to disk so the worker can read it, and re-read it after a restart
+    file_path = await asyncio.to_thread(spool_upload, file.file)
+
+    def create():
+        job_id = db.import_jobs.insert(user_id=current_user.id, file_name=file.filename, file_path=file_path, node=IMPORT_NODE)
+        return db.import_jobs[job_id]
+
+    job = await run_db(create)
+    import_worker.submit()
+    return import_job_response(job)
+
+@router.get("/import/{job_id}", response_model=ImportJobResponse)
+@db_endpoint
+def get_import_job_status(
+    job_id: int,
+    current_user = Depends(get_current_user)
+):
+    """Progress of a background import"""
+    return import_job_response(get_import_job(job_id, current_user))
+
+@router.delete("/import/{job_id}", response_model=ImportJobResponse)
+@db_endpoint
+def cancel_import_job(
+    job_id: int,
+    current_user = Depends(get_current_user)
+):
+    """Cancel a background import; chunks already committed stay imported"""
+    job = get_import_job(job_id, current_user)
+    jobs = db.import_jobs
+    now = datetime.utcnow()
+    if db((jobs.id == job.id) & (jobs.status == 'queued')).update(status='cancelled', finished_at=now, updated_at=now):
+        import_worker.remove_file(job.file_path)
+    elif not db((jobs.id == job.id) & (jobs.status == 'running')).update(status='cancelled', finished_at=now, updated_at=now):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Import job is already {job.status}"
+        )
+    # A running job stops at its next chunk and removes its file
+    return import_job_response(jobs[job.id])
 # ...existing code...
 
 @router.get("/{target_id}", response_model=TargetResponse)
-async def get_target(
+@db_endpoint
+def get_target(
     target_id: int,
     current_user = Depends(get_current_user)
 ):
@@ -317,13 +343,14 @@ async def get_target(
         group_id=target.group_id,
         group_name=group_name,
         is_active=target.is_active,
-        is_admin=checkIfAdmin(target.user_id),
+        is_admin=user_directory.is_admin(target.user_id),
         created_at=target.created_at,
         updated_at=target.updated_at
     )
 
 @router.put("/{target_id}", response_model=TargetResponse)
-async def update_target(
+@db_endpoint
+def update_target(
     target_id: int,
     target_data: TargetUpdate,
     current_user = Depends(get_current_user),
@@ -408,7 +435,8 @@ async def update_target(
             target_id, 
             updated_target.email, 
             client_ip, 
-            user_agent
+            user_agent,
+            is_admin=current_user.is_admin
         )
     
     # Get group name if target has a group
@@ -426,13 +454,14 @@ async def update_target(
         group_id=updated_target.group_id,
         group_name=group_name,
         is_active=updated_target.is_active,
-        is_admin=checkIfAdmin(updated_target.user_id),
+        is_admin=user_directory.is_admin(updated_target.user_id),
         created_at=updated_target.created_at,
         updated_at=updated_target.updated_at
     )
 
 @router.delete("/{target_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_target(
+@db_endpoint
+def delete_target(
     target_id: int,
     current_user = Depends(get_current_user),
     request: Request = None
@@ -459,7 +488,8 @@ async def delete_target(
             target_id, 
             target.email, 
             client_ip, 
-            user_agent
+            user_agent,
+            is_admin=current_user.is_admin
         )
     
     # Delete the target
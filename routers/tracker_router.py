@@ -10,12 +10,15 @@ from datetime import datetime
 from database import db
 from auth import get_current_user
 from utils.activity_logger import ActivityLogger
+from utils.open_tracker import open_tracker
+from utils.counters import bump_counters, bump_daily, is_unset
+from utils.offload import run_db
 import base64
 import mimetypes
 from auth import get_current_user
 import os
 from datetime import datetime
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from typing import List, Optional
 import re
 
@@ -37,6 +40,12 @@ from datetime import datetime
 import json
 
 
+# Transparent 1x1 GIF served by the open tracking pixel
+PIXEL_GIF = base64.b64decode("R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7")
+# Each pixel URL is unique per campaign and target, so repeat loads can be cached
+PIXEL_HEADERS = {"Cache-Control": "public, max-age=31536000, immutable"}
+
+
 # ----------- TRACK EMAIL OPEN -----------
 @router.get("/f1/{unique_id}")
 async def track_user(unique_id: str):
@@ -62,34 +71,10 @@ async def track_user(unique_id: str):
             content={"status": 400, "detail": "campaign_id and user_id must be integers"}
         )
 
-    campaign = db(
-        (db.campaign_results.campaign_id == campaign_id) &
-        (db.campaign_results.target_id == user_id)
-    ).select().first()
+    # Buffered; written to campaign_results by the open tracker's next flush
+    open_tracker.record(campaign_id, user_id)
 
-    if not campaign:
-        return JSONResponse(
-            status_code=status.HTTP_404_NOT_FOUND,
-            content={"status": 404, "detail": "Record not found"}
-        )
-
-    # Update tracking
-    campaign.update_record(
-        email_opened=True,
-        email_opened_at=campaign.email_opened_at or datetime.utcnow()
-    )
-    db.commit()
-
-    return JSONResponse(
-        status_code=status.HTTP_200_OK,
-        content={
-            "status": 200,
-            "detail": "Email opened successfully tracked",
-            "campaign_id": campaign_id,
-            "user_id": user_id,
-            "opened_at": str(campaign.email_opened_at)
-        }
-    )
+    return Response(content=PIXEL_GIF, media_type="image/gif", headers=PIXEL_HEADERS)
 
 
 # ----------- TRACK FORM SUBMISSION -----------
@@ -131,38 +116,54 @@ async def track_user(unique_id: str, request: Request):
             content={"status": 400, "detail": "Body must be a JSON object"}
         )
 
-    campaign_result = db(
-        (db.campaign_results.campaign_id == campaign_id) &
-        (db.campaign_results.target_id == user_id)
-    ).select().first()
+    def capture():
+        results = db.campaign_results
+        campaign_result = db(
+            (results.campaign_id == campaign_id) &
+            (results.target_id == user_id)
+        ).select(results.id, results.email_sent_at).first()
+
+        if not campaign_result:
+            return None
+
+        try:
+            new_data = json.dumps(body)
+        except TypeError:
+            new_data = str(body)  # fallback to string if body contains non-serializable data
+
+        # Conditional updates, so only the request that flips a flag counts it
+        # even when several submissions arrive at once
+        row = results.id == campaign_result.id
+        flipped = dict(
+            form_submissions=db(row & is_unset(results.form_submitted)).update(
+                form_submitted=True, form_submitted_at=datetime.utcnow()
+            ),
+            credentials_captured=db(row & is_unset(results.credentials_captured)).update(
+                credentials_captured=True
+            ),
+        )
+        # Appended in SQL, so concurrent submissions don't overwrite each other
+        db(row).update(captured_data=(results.captured_data == None).case(
+            new_data, results.captured_data + ("\n" + new_data)
+        ))
+        if any(flipped.values()):
+            bump_counters(campaign_id, **flipped)
+            bump_daily(campaign_id, campaign_result.email_sent_at, **flipped)
+
+        updated = results(campaign_result.id)
+        return {
+            "form_submitted": True,
+            "credentials_captured": True,
+            "form_submitted_at": updated.form_submitted_at,
+            "captured_data": updated.captured_data,
+        }
 
-    if not campaign_result:
+    updates = await run_db(capture)
+    if updates is None:
         return JSONResponse(
             status_code=status.HTTP_404_NOT_FOUND,
             content={"status": 404, "detail": "Record not found"}
         )
-
-    # Prepare updates
-    updates = {
-        "form_submitted": True,
-        "credentials_captured": True
-    }
-    if campaign_result.form_submitted_at is None:
-        updates["form_submitted_at"] = datetime.utcnow().isoformat()  
-
-    try:
-        new_data = json.dumps(body)
-    except TypeError:
-        new_data = str(body)  # fallback to string if body contains non-serializable data
-
-    if campaign_result.captured_data:
-        updates["captured_data"] = str(campaign_result.captured_data) + "\n" + new_data
-    else:
-        updates["captured_data"] = new_data
-
-    # Update DB
-    campaign_result.update_record(**updates)
-    db.commit()
     json_safe_updates = {k: (v.isoformat() if isinstance(v, datetime) else v) for k, v in updates.items()}
     return JSONResponse(
         status_code=status.HTTP_200_OK,
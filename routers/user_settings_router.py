@@ -5,6 +5,7 @@ import bcrypt
 from datetime import datetime
 from database import db
 from auth import get_current_user
+from utils.offload import db_endpoint, run_cpu, run_db
 
 router = APIRouter()
 
@@ -85,7 +86,8 @@ async def get_user_profile(current_user = Depends(get_current_user)):
     )
 
 @router.put("/profile", response_model=UserSettingsResponse)
-async def update_user_profile(
+@db_endpoint
+def update_user_profile(
     profile_data: UserProfileUpdate,
     current_user = Depends(get_current_user)
 ):
@@ -162,26 +164,26 @@ async def change_password(
     """Change user password"""
     
     # Verify current password
-    if not verify_password(password_data.current_password, current_user.password):
+    if not await run_cpu(verify_password, password_data.current_password, current_user.password):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Current password is incorrect"
         )
     
     # Hash new password
-    hashed_new_password = hash_password(password_data.new_password)
+    hashed_new_password = await run_cpu(hash_password, password_data.new_password)
     
     # Update password
-    db(db.users.id == current_user.id).update(
+    await run_db(lambda: db(db.users.id == current_user.id).update(
         password=hashed_new_password,
         updated_at=datetime.utcnow()
-    )
-    db.commit()
+    ))
     
     return {"message": "Password updated successfully"}
 
 @router.put("/ai-settings", response_model=UserSettingsResponse)
-async def update_ai_settings(
+@db_endpoint
+def update_ai_settings(
     ai_settings: AISettings,
     current_user = Depends(get_current_user)
 ):
@@ -0,0 +1,30 @@
+from uuid import uuid4
+
+from database import db
+from utils.analytics import RISK_WEIGHTS, target_performance
+
+
+def test_target_performance_is_sorted_and_paged_by_the_database():
+    user_id = db.users.insert(username=uuid4().hex, email=f"{uuid4().hex}@example.com", password="x")
+    campaign_id = db.campaigns.insert(name="risk", user_id=user_id, target_type="individual",
+                                      sender_profile_id=None, email_template_id=None)
+    # (sent, opened, clicked, submitted) per target
+    flags = [(1, 0, 0, 0), (1, 1, 1, 1), (0, 0, 0, 0), (1, 1, 0, 0), (1, 1, 1, 0), (1, 1, 0, 0)]
+    for sent, opened, clicked, submitted in flags:
+        target_id = db.targets.insert(email=f"{uuid4().hex}@example.com", user_id=user_id)
+        db.campaign_results.insert(campaign_id=campaign_id, target_id=target_id, email_sent=bool(sent),
+                                   email_opened=bool(opened), link_clicked=bool(clicked), form_submitted=bool(submitted))
+    db.commit()
+    query = db.targets.user_id == user_id
+
+    performance = target_performance(query)
+    open_w, click_w, submit_w = RISK_WEIGHTS
+    scores = [round((o * open_w + c * click_w + s * submit_w) * 100, 2) if r else 0.0 for r, o, c, s in flags]
+    assert [entry['risk_score'] for entry in performance] == sorted(scores, reverse=True)
+    # Ties keep target order
+    tied = [entry['target_id'] for entry in performance if entry['risk_score'] == scores[3]]
+    assert len(tied) == 2 and tied == sorted(tied)
+    assert performance[0]['form_submissions'] == 1 and isinstance(performance[0]['clicks'], int)
+
+    assert target_performance(query, limitby=(1, 3)) == performance[1:3]
+    assert target_performance(query, limitby=(5, 10)) == performance[5:]
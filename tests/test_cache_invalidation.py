@@ -0,0 +1,37 @@
+import threading
+from uuid import uuid4
+
+from auth import principal_cache
+from database import db
+
+
+def test_principal_cache_drops_a_row_loaded_before_the_commit():
+    """A load that reads the old row between the write and its commit is not kept"""
+    email = f"{uuid4().hex}@example.com"
+    user_id = db.users.insert(username=uuid4().hex, email=email, password='x', full_name='Old')
+    db.commit()
+
+    db(db.users.id == user_id).update(full_name='New')
+    # Another thread still sees the committed row and caches it after the update hook ran
+    loaded = []
+    reader = threading.Thread(target=lambda: loaded.append(principal_cache.load(email)))
+    reader.start()
+    reader.join()
+    assert loaded[0].full_name == 'Old'
+    assert principal_cache.get(email) is not None
+
+    db.commit()
+    assert principal_cache.get(email) is None
+    assert principal_cache.load(email).full_name == 'New'
+
+
+def test_rollback_drops_pending_invalidations():
+    email = f"{uuid4().hex}@example.com"
+    user_id = db.users.insert(username=uuid4().hex, email=email, password='x')
+    db.commit()
+
+    db(db.users.id == user_id).update(full_name='Discarded')
+    db.rollback()
+    principal_cache.load(email)
+    db.commit()
+    assert principal_cache.get(email) is not None
@@ -0,0 +1,54 @@
+import asyncio
+import os
+
+import httpx
+
+from utils import cloner
+from utils.cloner import WebsiteCloner
+
+ORIGIN = "https://origin.example"
+FILES = {
+    "/style.css": (b"body{background:url('img/bg.png')} @font-face{src:url(/font.woff)}", "text/css"),
+    "/img/bg.png": (b"png" * 10, "image/png"),
+    "/font.woff": (b"woff" * 10, "font/woff"),
+    "/logo.png": (b"logo" * 10, "image/png"),
+    "/big.png": (b"x" * 1000, "image/png"),
+}
+
+
+def clone(html: str, mode: str) -> str:
+    def handler(request: httpx.Request) -> httpx.Response:
+        content, content_type = FILES[request.url.path]
+        return httpx.Response(200, content=content, headers={"content-type": content_type})
+
+    async def run():
+        website_cloner = WebsiteCloner()
+        website_cloner.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            return await website_cloner.localize_assets(html, mode)
+        finally:
+            await website_cloner.close()
+    return asyncio.run(run())
+
+
+def test_store_mode_localizes_stylesheet_urls(tmp_path, monkeypatch):
+    monkeypatch.setattr(cloner, "CLONE_ASSET_DIR", str(tmp_path))
+    page = clone(f'<link rel="stylesheet" href="{ORIGIN}/style.css">', "store")
+
+    stored = {name: (tmp_path / name).read_bytes() for name in os.listdir(tmp_path)}
+    css = next(content for content in stored.values() if content.startswith(b"body"))
+    assert ORIGIN.encode() not in css
+    assert css.count(b"/api/v1/phishlets/assets/") == 2
+    assert FILES["/img/bg.png"][0] in stored.values() and FILES["/font.woff"][0] in stored.values()
+    assert ORIGIN not in page
+
+
+def test_assets_past_the_count_or_byte_limits_stay_linked(monkeypatch):
+    monkeypatch.setattr(cloner, "CLONE_MAX_ASSETS", 1)
+    page = clone(f'<img src="{ORIGIN}/logo.png"><img src="{ORIGIN}/big.png">', "inline")
+    assert "data:image/png" in page and f"{ORIGIN}/big.png" in page
+
+    monkeypatch.setattr(cloner, "CLONE_MAX_ASSETS", 10)
+    monkeypatch.setattr(cloner, "CLONE_MAX_TOTAL_BYTES", 500)
+    page = clone(f'<img src="{ORIGIN}/logo.png"><img src="{ORIGIN}/big.png">', "inline")
+    assert "data:image/png" in page and f"{ORIGIN}/big.png" in page
@@ -0,0 +1,48 @@
+import asyncio
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from database import db
+from utils.delivery import DELIVERY_CLAIM_TIMEOUT, DeliveryEngine, enqueue_campaign
+
+
+def claimed_rows(count: int, claimed_at: datetime):
+    user_id = db.users.insert(username=uuid4().hex, email=f"{uuid4().hex}@example.com", password="x")
+    campaign_id = db.campaigns.insert(
+        name="claims", user_id=user_id, status="running", target_type="individual",
+        sender_profile_id=None, email_template_id=None,
+    )
+    target_ids = [db.targets.insert(email=f"t{i}@example.com", user_id=user_id) for i in range(count)]
+    enqueue_campaign(campaign_id, target_ids)
+    queue = db.delivery_queue
+    db(queue.campaign_id == campaign_id).update(status="in_flight", claimed_at=claimed_at)
+    db.commit()
+    return list(db(queue.campaign_id == campaign_id).select(orderby=queue.id))
+
+
+def test_claims_are_renewed_before_a_late_send():
+    """Rows that waited for a slot past half the claim timeout are not requeued under the sender"""
+    engine = DeliveryEngine(workers=1)
+    rows = claimed_rows(3, datetime.utcnow() - timedelta(seconds=DELIVERY_CLAIM_TIMEOUT * 3 // 4))
+    # requeue_stale already handed the last row back to the queue
+    db(db.delivery_queue.id == rows[2].id).update(status="queued", claimed_at=None)
+    db.commit()
+
+    lost = asyncio.run(engine._lost_claims(rows))
+    db.commit()
+
+    assert lost == {rows[2].id}
+    renewed = db(db.delivery_queue.id.belongs([rows[0].id, rows[1].id])).select()
+    assert all(row.claimed_at > rows[0].claimed_at for row in renewed)
+    engine.requeue_stale()
+    assert db(db.delivery_queue.id == rows[0].id).select().first().status == "in_flight"
+
+
+def test_fresh_claims_are_not_written():
+    engine = DeliveryEngine(workers=1)
+    rows = claimed_rows(1, datetime.utcnow().replace(microsecond=0))
+    before = db(db.delivery_queue.id == rows[0].id).select().first().updated_at
+
+    assert asyncio.run(engine._lost_claims(rows)) == set()
+    db.commit()
+    assert db(db.delivery_queue.id == rows[0].id).select().first().updated_at == before
@@ -0,0 +1,75 @@
+from uuid import uuid4
+
+import pytest
+
+import migrate_database
+from database import INDEXES, db, ensure_indexes, existing_indexes
+
+# Deleting any of these must leave the campaign (and its results) in place
+SET_NULL = {
+    'campaigns': ['sender_profile_id', 'email_template_id', 'phishlet_id', 'target_group_id', 'attachment_id'],
+    'targets': ['group_id'],
+}
+
+
+def set_on_delete(action):
+    """Put the references back the way an older release created them"""
+    for table_name, columns in SET_NULL.items():
+        actions = {column: action for column in columns}
+        if db._adapter.dbengine == 'sqlite':
+            migrate_database.rebuild_sqlite_table(table_name, actions)
+        else:
+            migrate_database.alter_postgres_table(table_name, actions)
+
+
+@pytest.fixture
+def old_database():
+    ensure_indexes()
+    set_on_delete('CASCADE')
+    yield
+    migrate_database.fix_foreign_keys()
+
+
+def seed_campaign():
+    user_id = db.users.insert(username=uuid4().hex, email=f"{uuid4().hex}@example.com", password='x')
+    group_id = db.groups.insert(name='group', user_id=user_id)
+    target_id = db.targets.insert(email='t@example.com', user_id=user_id, group_id=group_id)
+    campaign_id = db.campaigns.insert(
+        name='campaign', user_id=user_id, target_type='group', target_group_id=group_id,
+        sender_profile_id=db.sender_profiles.insert(
+            name='profile', user_id=user_id, auth_type='smtp', from_address='from@example.com'),
+        email_template_id=db.email_templates.insert(name='template', user_id=user_id, subject='Hello'),
+    )
+    db.campaign_results.insert(campaign_id=campaign_id, target_id=target_id, email_sent=True)
+    db.commit()
+    return db.campaigns[campaign_id]
+
+
+def test_new_database_declares_set_null():
+    assert migrate_database.stale_foreign_keys() == {}
+    for table_name, columns in SET_NULL.items():
+        actions = migrate_database.on_delete_actions(table_name)
+        assert {column: actions[column] for column in columns} == {column: 'SET NULL' for column in columns}
+
+
+def test_old_database_cascades_until_migrated(old_database):
+    campaign = seed_campaign()
+    db(db.email_templates.id == campaign.email_template_id).delete()
+    db.commit()
+    assert db.campaigns[campaign.id] is None
+    assert set(migrate_database.stale_foreign_keys()) == set(SET_NULL)
+
+    campaign = seed_campaign()
+    rows = migrate_database.table_counts()
+    assert migrate_database.fix_foreign_keys()
+    assert migrate_database.stale_foreign_keys() == {}
+    assert migrate_database.table_counts() == rows
+    assert {index[1] for index in INDEXES if index[0] in SET_NULL} <= existing_indexes()
+
+    db(db.email_templates.id == campaign.email_template_id).delete()
+    db(db.groups.id == campaign.target_group_id).delete()
+    db.commit()
+    kept = db.campaigns[campaign.id]
+    assert kept.email_template_id is None and kept.target_group_id is None
+    assert db(db.campaign_results.campaign_id == campaign.id).count() == 1
+    assert db(db.targets.user_id == campaign.user_id).select().first().group_id is None
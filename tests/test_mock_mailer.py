@@ -0,0 +1,79 @@
+import asyncio
+
+import httpx
+
+from database import db
+from utils import delivery, mock_mailer
+from utils.delivery import DeliveryEngine, campaign_progress, enqueue_campaign
+
+
+def post(path: str, payload: dict) -> httpx.Response:
+    # starlette 0.27's TestClient doesn't run on httpx 0.28, so call the app through ASGITransport
+    async def request():
+        transport = httpx.ASGITransport(app=mock_mailer.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://mailer") as client:
+            return await client.post(path, json=payload)
+    return asyncio.run(request())
+
+
+def test_send_batch_returns_one_result_per_recipient_in_order():
+    """DeliveryEngine._deliver_batch matches results to recipients by position"""
+    response = post("/send/batch", {
+        "subject": "Hello",
+        "html_body": "<a href='/t/{{TARGET}}'>x</a>",
+        "recipients": [
+            {"to": "a@example.com", "substitutions": {"{{TARGET}}": "1"}},
+            {"to": ""},
+            {"to": "b@example.com", "substitutions": {"{{TARGET}}": "2"}},
+        ],
+    })
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [result["status"] for result in results] == ["sent", "failed", "sent"]
+    assert results[0]["to"] == "a@example.com"
+    assert results[1]["error"]
+    assert results[2]["to"] == "b@example.com"
+    assert mock_mailer.messages[-1]["html_body"] == "<a href='/t/2'>x</a>"
+
+
+def test_delivery_engine_records_batch_outcomes(monkeypatch):
+    """A queued batch posted to the mock mailer ends up sent or failed per recipient"""
+    # Fail a refused recipient for good instead of scheduling a retry
+    monkeypatch.setattr(delivery, "DELIVERY_MAX_ATTEMPTS", 1)
+    user_id = db.users.insert(username="mailer-test", email="mailer-test@example.com", password="x")
+    campaign_id = db.campaigns.insert(
+        name="batch", user_id=user_id, target_type="individual", status="running",
+        sender_profile_id=db.sender_profiles.insert(
+            name="profile", user_id=user_id, auth_type="smtp", from_address="it@example.com"),
+        email_template_id=db.email_templates.insert(
+            name="template", user_id=user_id, subject="Hello", html_content="<p>Hi</p>"),
+    )
+    emails = ["a@example.com", "", "b@example.com"]
+    target_ids = [db.targets.insert(email=email, user_id=user_id) for email in emails]
+    enqueue_campaign(campaign_id, target_ids)
+    db.commit()
+
+    async def run():
+        engine = DeliveryEngine(workers=1, mailer_batch_size=10, transport="http")
+        engine.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=mock_mailer.app))
+        await engine.start()
+        try:
+            for _ in range(100):
+                progress = await asyncio.to_thread(campaign_progress, campaign_id)
+                if not progress["queued"] and not progress["in_flight"] and not progress["retry"]:
+                    return progress
+                await asyncio.sleep(0.05)
+        finally:
+            await engine.close()
+
+    progress = asyncio.run(run())
+    db.commit()  # start a fresh read of what the engine's threads wrote
+
+    assert (progress["sent"], progress["failed"]) == (2, 1)
+    queue = {row.target_id: row for row in db(db.delivery_queue.campaign_id == campaign_id).select()}
+    assert [queue[target_id].status for target_id in target_ids] == ["sent", "failed", "sent"]
+    assert "Missing recipient" in queue[target_ids[1]].last_error
+    results = db(db.campaign_results.campaign_id == campaign_id).select()
+    assert {result.target_id for result in results if result.email_sent} == {target_ids[0], target_ids[2]}
+    assert db.campaigns[campaign_id].status == "completed"
@@ -0,0 +1,17 @@
+import pytest
+
+from database import db, ensure_indexes
+from migrate_add_indexes import hot_queries
+
+pytestmark = pytest.mark.skipif(db._adapter.dbengine != 'sqlite', reason="EXPLAIN QUERY PLAN is SQLite's")
+
+
+@pytest.fixture(scope='module', autouse=True)
+def indexes():
+    ensure_indexes()
+
+
+@pytest.mark.parametrize('description', list(hot_queries()))
+def test_hot_lookup_uses_an_index(description):
+    plan = [row[-1] for row in db.executesql("EXPLAIN QUERY PLAN " + hot_queries()[description])]
+    assert all(detail.startswith('SEARCH') for detail in plan), plan
@@ -0,0 +1,135 @@
+import asyncio
+import smtplib
+import socketserver
+import threading
+import time
+
+import pytest
+
+from utils import smtp_transport
+from utils.smtp_transport import SMTPTransport
+
+
+class SinkHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP to take messages; recipients starting with 'refused' get a 550"""
+
+    def reply(self, line: str):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        sink = self.server
+        with sink.lock:
+            sink.connections += 1
+            sink.open += 1
+            sink.max_open = max(sink.max_open, sink.open)
+        try:
+            self.reply("220 sink")
+            for raw in self.rfile:
+                command = raw.decode().strip()
+                verb = command.split(" ", 1)[0].upper()
+                if verb in ("EHLO", "HELO"):
+                    self.reply("250 sink")
+                elif verb == "RCPT" and "<refused" in command:
+                    self.reply("550 no such user")
+                elif verb in ("MAIL", "RCPT", "RSET", "NOOP"):
+                    self.reply("250 ok")
+                elif verb == "DATA":
+                    self.reply("354 go ahead")
+                    lines = []
+                    for data in self.rfile:
+                        if data == b".\r\n":
+                            break
+                        lines.append(data)
+                    # Hold the session a little so concurrent sends overlap
+                    time.sleep(0.05)
+                    with sink.lock:
+                        sink.messages.append(b"".join(lines))
+                    self.reply("250 queued")
+                elif verb == "QUIT":
+                    self.reply("221 bye")
+                    return
+                else:
+                    self.reply("502 not implemented")
+        finally:
+            with sink.lock:
+                sink.open -= 1
+
+
+class Sink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), SinkHandler)
+        self.lock = threading.Lock()
+        self.messages = []
+        self.connections = self.open = self.max_open = 0
+
+
+class Template:
+    def render(self, target_id):
+        return f"<p>Hello {target_id}</p>"
+
+
+class Sender:
+    id = 1
+    from_name = "IT"
+    from_address = "it@example.com"
+    smtp_username = smtp_password = None
+
+    def __init__(self, port):
+        self.smtp_host = "127.0.0.1"
+        self.smtp_port = port
+
+
+class Context:
+    def __init__(self, port):
+        self.sender = Sender(port)
+        self.template = Template()
+        self.shared_payload = {"subject": "Hello", "plain_body": "Hello"}
+        self.attachments_payload = []
+
+
+class Target:
+    def __init__(self, id, email):
+        self.id = id
+        self.email = email
+
+
+@pytest.fixture
+def sink():
+    server = Sink()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_sessions_are_reused_and_kept_after_a_refused_recipient(sink):
+    context = Context(sink.server_address[1])
+
+    async def run():
+        transport = SMTPTransport()
+        await transport.send(context, Target(1, "a@example.com"))
+        with pytest.raises(smtplib.SMTPRecipientsRefused):
+            await transport.send(context, Target(2, "refused@example.com"))
+        await transport.send(context, Target(3, "b@example.com"))
+        await transport.close()
+
+    asyncio.run(run())
+    assert sink.connections == 1
+    assert len(sink.messages) == 2
+    assert b"Hello 3" in sink.messages[-1]
+
+
+def test_open_sessions_are_capped_per_profile(sink, monkeypatch):
+    monkeypatch.setattr(smtp_transport, "SMTP_MAX_SESSIONS", 2)
+    context = Context(sink.server_address[1])
+
+    async def run():
+        transport = SMTPTransport()
+        await asyncio.gather(*(transport.send(context, Target(i, f"t{i}@example.com")) for i in range(8)))
+        await transport.close()
+
+    asyncio.run(run())
+    assert len(sink.messages) == 8
+    assert sink.max_open == 2
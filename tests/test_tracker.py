@@ -0,0 +1,37 @@
+import asyncio
+from uuid import uuid4
+
+import httpx
+from fastapi import FastAPI
+
+from database import db
+from routers import tracker_router
+
+app = FastAPI()
+app.include_router(tracker_router.router, prefix="/api/v1/track")
+
+
+def test_concurrent_form_submissions_count_once_and_keep_every_capture():
+    user_id = db.users.insert(username=uuid4().hex, email=f"{uuid4().hex}@example.com", password="x")
+    campaign_id = db.campaigns.insert(name="f2", user_id=user_id, target_type="individual",
+                                      sender_profile_id=None, email_template_id=None)
+    target_id = db.targets.insert(email="t@example.com", user_id=user_id)
+    result_id = db.campaign_results.insert(campaign_id=campaign_id, target_id=target_id, email_sent=True)
+    db.commit()
+
+    async def submit_all():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://tracker") as client:
+            return await asyncio.gather(*(
+                client.post(f"/api/v1/track/f2/{campaign_id}*{target_id}", json={"fields": {"password": str(i)}})
+                for i in range(10)
+            ))
+
+    responses = asyncio.run(submit_all())
+    db.commit()  # start a fresh read of what the DB workers wrote
+
+    assert [response.status_code for response in responses] == [200] * 10
+    counters = db(db.campaign_counters.campaign_id == campaign_id).select().first()
+    assert (counters.form_submissions, counters.credentials_captured) == (1, 1)
+    result = db.campaign_results[result_id]
+    assert result.form_submitted and result.credentials_captured and result.form_submitted_at
+    assert len(result.captured_data.split("\n")) == 10
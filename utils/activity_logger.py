@@ -1,7 +1,105 @@
+import asyncio
 import json
+import os
+import threading
 from datetime import datetime
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from database import db
+from utils.offload import run_db
+from utils.user_directory import user_directory
+
+ACTIVITY_FLUSH_INTERVAL_MS = int(os.getenv("ACTIVITY_FLUSH_INTERVAL_MS", "1000"))
+ACTIVITY_BATCH_SIZE = int(os.getenv("ACTIVITY_BATCH_SIZE", "500"))  # rows per transaction
+ACTIVITY_QUEUE_SIZE = int(os.getenv("ACTIVITY_QUEUE_SIZE", "10000"))  # records held before new ones are dropped
+
+
+class ActivitySink:
+    """Write-behind queue for user_activities.
+
+    Logging only appends to a bounded in-memory queue, from the event loop
+    or a DB worker thread alike. A background task writes the queue with
+    multi-row inserts, batch_size rows per transaction, every
+    flush_interval_ms or as soon as a full batch has piled up. Until
+    start() (and after close()) records are written right away, so
+    scripts keep working without the app's lifespan.
+    """
+
+    def __init__(
+        self,
+        flush_interval_ms: int = ACTIVITY_FLUSH_INTERVAL_MS,
+        batch_size: int = ACTIVITY_BATCH_SIZE,
+        max_size: int = ACTIVITY_QUEUE_SIZE,
+    ):
+        self.flush_interval = max(flush_interval_ms, 1) / 1000
+        self.batch_size = max(1, batch_size)
+        self.max_size = max(1, max_size)
+        self.dropped = 0
+        self._queue: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is None:
+            self._loop = asyncio.get_running_loop()
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._loop = None
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.flush()
+
+    def put(self, record: Dict[str, Any]):
+        loop = self._loop
+        if loop is None:
+            db.user_activities.insert(**record)
+            db.commit()
+            return
+        with self._lock:
+            if len(self._queue) >= self.max_size:
+                self.dropped += 1
+                return
+            self._queue.append(record)
+            full = len(self._queue) == self.batch_size
+        if full:
+            loop.call_soon_threadsafe(self._wakeup.set)
+
+    def flush(self) -> int:
+        """Write every queued record, batch_size rows per transaction; returns how many were written"""
+        with self._lock:
+            records, self._queue = self._queue, []
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            print(f"Activity queue full, dropped {dropped} records")
+        written = 0
+        for start in range(0, len(records), self.batch_size):
+            batch = records[start:start + self.batch_size]
+            try:
+                db.user_activities.bulk_insert(batch)
+                db.commit()
+                written += len(batch)
+            except Exception as e:
+                db.rollback()
+                print(f"Error logging {len(batch)} activities: {e}")
+        return written
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await run_db(self.flush)
+
+
+activity_sink = ActivitySink()
+
 
 class ActivityLogger:
     """Utility class for logging user activities"""
@@ -18,11 +116,11 @@ class ActivityLogger:
         user_agent: Optional[str] = None,
         metadata: Optional[Dict[str, Any]] = None
     ):
-        """Log a user activity"""
+        """Log a user activity; it is queued and written in the background by activity_sink"""
         try:
             metadata_json = json.dumps(metadata) if metadata else None
             
-            db.user_activities.insert(
+            activity_sink.put(dict(
                 user_id=user_id,
                 activity_type=activity_type,
                 resource_type=resource_type,
@@ -33,8 +131,7 @@ class ActivityLogger:
                 user_agent=user_agent,
                 metadata=metadata_json,
                 timestamp=datetime.utcnow()
-            )
-            db.commit()
+            ))
         except Exception as e:
             # Log error but don't fail the main operation
             print(f"Error logging activity: {e}")
@@ -42,8 +139,14 @@ class ActivityLogger:
     @staticmethod
     def checkIfAdmin(user_id: int) -> bool:
         """Check if a user is admin"""
-        user = db(db.users.id == user_id).select().first()
-        return user.is_admin if user else False
+        return user_directory.is_admin(user_id)
+    
+    @staticmethod
+    def resolve_admin(user_id: int, is_admin: Optional[bool] = None) -> bool:
+        """The caller's admin flag (e.g. current_user.is_admin), looked up only when not given"""
+        if is_admin is None:
+            return ActivityLogger.checkIfAdmin(user_id)
+        return bool(is_admin)
     
     @staticmethod
     def log_login(user_id: int, ip_address: Optional[str] = None, user_agent: Optional[str] = None):
@@ -68,9 +171,9 @@ class ActivityLogger:
         )
     
     @staticmethod
-    def log_campaign_created(user_id: int, campaign_id: int, campaign_name: str, ip_address: Optional[str] = None, user_agent: Optional[str] = None):
+    def log_campaign_created(user_id: int, campaign_id: int, campaign_name: str, ip_address: Optional[str] = None, user_agent: Optional[str] = None, is_admin: Optional[bool] = None):
         """Log campaign creation"""
-        if ActivityLogger.checkIfAdmin(user_id):
+        if ActivityLogger.resolve_admin(user_id, is_admin):
               ActivityLogger.log_activity(
                   user_id=user_id,
                   activity_type="campaign_created",
@@ -94,9 +197,9 @@ class ActivityLogger:
               )
     
     @staticmethod
-    def log_campaign_updated(user_id: int, campaign_id: int, campaign_name: str, changes: Dict[str, Any], ip_address: Optional[str] = None, user_agent: Optional[str] = None):
+    def log_campaign_updated(user_id: int, campaign_id: int, campaign_name: str, changes: Dict[str, Any], ip_address: Optional[str] = None, user_agent: Optional[str] = None, is_admin: Optional[bool] = None):
         """Log campaign update"""
-        if ActivityLogger.checkIfAdmin(user_id):
+        if ActivityLogger.resolve_admin(user_id, is_admin):
               ActivityLogger.log_activity(
                   user_id=user_id,
                   activity_type="campaign_updated",
@@ -122,9 +225,9 @@ class ActivityLogger:
         )
     
     @staticmethod
-    def log_campaign_deleted(user_id: int, campaign_id: int, campaign_name: str, ip_address: Optional[str] = None, user_agent: Optional[str] = None):
+    def log_campaign_deleted(user_id: int, campaign_id: int, campaign_name: str, ip_address: Optional[str] = None, user_agent: Optional[str] = None, is_admin: Optional[bool] = None):
         """Log campaign deletion"""
-        if ActivityLogger.checkIfAdmin(user_id):
+        if ActivityLogger.resolve_admin(user_id, is_admin):
               ActivityLogger.log_activity(
                  user_id=user_id,
                  activity_type="campaign_deleted",
@@ -148,9 +251,9 @@ class ActivityLogger:
              )
          
     @staticmethod
-    def log_target_added(user_id: int, target_id: int, target_email: str, ip_address: Optional[str] = None, user_agent: Optional[str] = None):
+    def log_target_added(user_id: int, target_id: int, target_email: str, ip_address: Optional[str] = None, user_agent: Optional[str] = None, is_admin: Optional[bool] = None):
         """Log target addition"""
-        if ActivityLogger.checkIfAdmin(user_id):
+        if ActivityLogger.resolve_admin(user_id, is_admin):
              ActivityLogger.log_activity(
                  user_id=user_id,
                  activity_type="target_added",
@@ -172,11 +275,26 @@ class ActivityLogger:
                  ip_address=ip_address,
                  user_agent=user_agent
              )
-    
+
+    @staticmethod
+    def log_targets_imported(user_id: int, file_name: str, inserted: int, skipped: int, errors: int, ip_address: Optional[str] = None, user_agent: Optional[str] = None, is_admin: Optional[bool] = None):
+        """Log a CSV target import as one summary record"""
+        by = "admin" if ActivityLogger.resolve_admin(user_id, is_admin) else "you"
+        ActivityLogger.log_activity(
+            user_id=user_id,
+            activity_type="targets_imported",
+            resource_type="target",
+            resource_name=file_name,
+            description=f"Imported {inserted} targets from {file_name} by {by}",
+            ip_address=ip_address,
+            user_agent=user_agent,
+            metadata={"inserted": inserted, "skipped_duplicates": skipped, "errors": errors}
+        )
+
     @staticmethod
-    def log_target_updated(user_id: int, target_id: int, target_email: str, ip_address: Optional[str] = None, user_agent: Optional[str] = None):
+    def log_target_updated(user_id: int, target_id: int, target_email: str, ip_address: Optional[str] = None, user_agent: Optional[str] = None, is_admin: Optional[bool] = None):
         """Log target update"""
-        if ActivityLogger.checkIfAdmin(user_id):
+        if ActivityLogger.resolve_admin(user_id, is_admin):
             ActivityLogger.log_activity(
                 user_id=user_id,
                 activity_type="target_updated",
@@ -201,9 +319,9 @@ class ActivityLogger:
             
     
     @staticmethod
-    def log_target_deleted(user_id: int, target_id: int, target_email: str, ip_address: Optional[str] = None, user_agent: Optional[str] = None):
+    def log_target_deleted(user_id: int, target_id: int, target_email: str, ip_address: Optional[str] = None, user_agent: Optional[str] = None, is_admin: Optional[bool] = None):
         """Log target deletion"""
-        if ActivityLogger.checkIfAdmin(user_id):
+        if ActivityLogger.resolve_admin(user_id, is_admin):
             ActivityLogger.log_activity(
                 user_id=user_id,
                 activity_type="target_deleted",
@@ -228,9 +346,9 @@ class ActivityLogger:
             
     
     @staticmethod
-    def log_group_created(user_id: int, group_id: int, group_name: str, ip_address: Optional[str] = None, user_agent: Optional[str] = None):
+    def log_group_created(user_id: int, group_id: int, group_name: str, ip_address: Optional[str] = None, user_agent: Optional[str] = None, is_admin: Optional[bool] = None):
         """Log group creation"""
-        if ActivityLogger.checkIfAdmin(user_id):
+        if ActivityLogger.resolve_admin(user_id, is_admin):
             ActivityLogger.log_activity(
                 user_id=user_id,
                 activity_type="group_created",
@@ -255,9 +373,9 @@ class ActivityLogger:
             
     
     @staticmethod
-    def log_group_updated(user_id: int, group_id: int, group_name: str, ip_address: Optional[str] = None, user_agent: Optional[str] = None):
+    def log_group_updated(user_id: int, group_id: int, group_name: str, ip_address: Optional[str] = None, user_agent: Optional[str] = None, is_admin: Optional[bool] = None):
         """Log group update"""
-        if ActivityLogger.checkIfAdmin(user_id):
+        if ActivityLogger.resolve_admin(user_id, is_admin):
             description = f"Updated group:{group_name} by admin"
         else:
             description = f"Updated group:{group_name} by you"
@@ -273,9 +391,9 @@ class ActivityLogger:
         )
     
     @staticmethod
-    def log_group_deleted(user_id: int, group_id: int, group_name: str, ip_address: Optional[str] = None, user_agent: Optional[str] = None):
+    def log_group_deleted(user_id: int, group_id: int, group_name: str, ip_address: Optional[str] = None, user_agent: Optional[str] = None, is_admin: Optional[bool] = None):
         """Log group deletion"""
-        if ActivityLogger.checkIfAdmin(user_id):
+        if ActivityLogger.resolve_admin(user_id, is_admin):
             description = f"Deleted group: {group_name} by admin"
         else:
             description = f"Deleted group: {group_name} by you"
@@ -291,9 +409,9 @@ class ActivityLogger:
         )
 
     @staticmethod
-    def log_template_created(user_id: int, template_id: int, template_name: str, ip_address: Optional[str] = None, user_agent: Optional[str] = None):
+    def log_template_created(user_id: int, template_id: int, template_name: str, ip_address: Optional[str] = None, user_agent: Optional[str] = None, is_admin: Optional[bool] = None):
         """Log template creation"""
-        if ActivityLogger.checkIfAdmin(user_id):
+        if ActivityLogger.resolve_admin(user_id, is_admin):
             description = f"Created email template: {template_name} by admin"
         else:
             description = f"Created email template: {template_name} by you"
@@ -309,9 +427,9 @@ class ActivityLogger:
         )
 
     @staticmethod
-    def log_template_updated(user_id: int, template_id: int, template_name: str, ip_address: Optional[str] = None, user_agent: Optional[str] = None):
+    def log_template_updated(user_id: int, template_id: int, template_name: str, ip_address: Optional[str] = None, user_agent: Optional[str] = None, is_admin: Optional[bool] = None):
         """Log template update"""
-        if ActivityLogger.checkIfAdmin(user_id):
+        if ActivityLogger.resolve_admin(user_id, is_admin):
             description = f"Updated email template: {template_name} by admin"
         else:
             description = f"Updated email template: {template_name} by you"
@@ -327,9 +445,9 @@ class ActivityLogger:
         )
 
     @staticmethod
-    def log_template_deleted(user_id: int, template_id: int, template_name: str, ip_address: Optional[str] = None, user_agent: Optional[str] = None):
+    def log_template_deleted(user_id: int, template_id: int, template_name: str, ip_address: Optional[str] = None, user_agent: Optional[str] = None, is_admin: Optional[bool] = None):
         """Log template deletion"""
-        if ActivityLogger.checkIfAdmin(user_id):
+        if ActivityLogger.resolve_admin(user_id, is_admin):
             description = f"Deleted email template: {template_name} by admin"
         else:
             description = f"Deleted email template: {template_name} by you"
@@ -345,9 +463,9 @@ class ActivityLogger:
         )
 
     @staticmethod
-    def log_phishlet_created(user_id: int, phishlet_id: int, phishlet_name: str, ip_address: Optional[str] = None, user_agent: Optional[str] = None):
+    def log_phishlet_created(user_id: int, phishlet_id: int, phishlet_name: str, ip_address: Optional[str] = None, user_agent: Optional[str] = None, is_admin: Optional[bool] = None):
         """Log phishlet creation"""
-        if ActivityLogger.checkIfAdmin(user_id):
+        if ActivityLogger.resolve_admin(user_id, is_admin):
             description = f"Created phishlet: {phishlet_name} by admin"
         else:
             description = f"Created phishlet: {phishlet_name} by you"
@@ -363,9 +481,9 @@ class ActivityLogger:
         )
 
     @staticmethod
-    def log_phishlet_updated(user_id: int, phishlet_id: int, phishlet_name: str, ip_address: Optional[str] = None, user_agent: Optional[str] = None):
+    def log_phishlet_updated(user_id: int, phishlet_id: int, phishlet_name: str, ip_address: Optional[str] = None, user_agent: Optional[str] = None, is_admin: Optional[bool] = None):
         """Log phishlet update"""
-        if ActivityLogger.checkIfAdmin(user_id):
+        if ActivityLogger.resolve_admin(user_id, is_admin):
             description = f"Updated phishlet: {phishlet_name} by admin"
         else:
             description = f"Updated phishlet: {phishlet_name} by you"
@@ -381,9 +499,9 @@ class ActivityLogger:
         )
 
     @staticmethod
-    def log_phishlet_deleted(user_id: int, phishlet_id: int, phishlet_name: str, ip_address: Optional[str] = None, user_agent: Optional[str] = None):
+    def log_phishlet_deleted(user_id: int, phishlet_id: int, phishlet_name: str, ip_address: Optional[str] = None, user_agent: Optional[str] = None, is_admin: Optional[bool] = None):
         """Log phishlet deletion"""
-        if ActivityLogger.checkIfAdmin(user_id):
+        if ActivityLogger.resolve_admin(user_id, is_admin):
             description = f"Deleted phishlet: {phishlet_name} by admin"
         else:
             description = f"Deleted phishlet: {phishlet_name} by you"
@@ -399,9 +517,9 @@ class ActivityLogger:
         )
 
     @staticmethod
-    def log_email_sent(user_id: int, campaign_id: int, campaign_name: str, target_email: str, ip_address: Optional[str] = None, user_agent: Optional[str] = None):
+    def log_email_sent(user_id: int, campaign_id: int, campaign_name: str, target_email: str, ip_address: Optional[str] = None, user_agent: Optional[str] = None, is_admin: Optional[bool] = None):
         """Log email sent"""
-        if ActivityLogger.checkIfAdmin(user_id):
+        if ActivityLogger.resolve_admin(user_id, is_admin):
             description = f"Sent email to {target_email} from campaign: {campaign_name} by admin"
         else:
             description = f"Sent email to {target_email} from campaign: {campaign_name} by you"
@@ -417,9 +535,9 @@ class ActivityLogger:
         )
 
     @staticmethod
-    def log_form_submitted(user_id: int, campaign_id: int, campaign_name: str, target_email: str, ip_address: Optional[str] = None, user_agent: Optional[str] = None):
+    def log_form_submitted(user_id: int, campaign_id: int, campaign_name: str, target_email: str, ip_address: Optional[str] = None, user_agent: Optional[str] = None, is_admin: Optional[bool] = None):
         """Log form submission"""
-        if ActivityLogger.checkIfAdmin(user_id):
+        if ActivityLogger.resolve_admin(user_id, is_admin):
             description = f"Form submitted by {target_email} from campaign: {campaign_name} (recorded by admin)"
         else:
             description = f"Form submitted by {target_email} from campaign: {campaign_name} (recorded by you)"
@@ -435,9 +553,9 @@ class ActivityLogger:
         )
 
     @staticmethod
-    def log_settings_updated(user_id: int, setting_type: str, ip_address: Optional[str] = None, user_agent: Optional[str] = None):
+    def log_settings_updated(user_id: int, setting_type: str, ip_address: Optional[str] = None, user_agent: Optional[str] = None, is_admin: Optional[bool] = None):
         """Log settings update"""
-        if ActivityLogger.checkIfAdmin(user_id):
+        if ActivityLogger.resolve_admin(user_id, is_admin):
             description = f"Updated {setting_type} settings by admin"
         else:
             description = f"Updated {setting_type} settings by you"
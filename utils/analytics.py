@@ -0,0 +1,186 @@
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+from database import db
+
+# campaign_results flags counted per campaign, by output key
+RESULT_FLAGS = {
+    'emails_sent': 'email_sent',
+    'emails_opened': 'email_opened',
+    'clicks': 'link_clicked',
+    'form_submissions': 'form_submitted',
+    'credentials_captured': 'credentials_captured',
+}
+
+
+COUNTER_FIELDS = ('total_targets',) + tuple(RESULT_FLAGS)
+
+CAMPAIGN_FIELDS = ('id', 'name', 'status', 'created_at', 'updated_at')
+
+
+def count_results(query) -> List[Dict[str, Any]]:
+    """Count campaign_results of every campaign matching query in one GROUP BY round-trip.
+
+    This is the source of truth campaign_counters is rebuilt from.
+    """
+    campaigns = db.campaigns
+    results = db.campaign_results
+    total = results.id.count()
+    sums = {
+        key: (results[flag] == True).case(1, 0).sum()
+        for key, flag in RESULT_FLAGS.items()
+    }
+    fields = [campaigns[name] for name in CAMPAIGN_FIELDS]
+
+    rows = db(query).select(
+        *fields, total, *sums.values(),
+        left=results.on(results.campaign_id == campaigns.id),
+        groupby=campaigns.id | campaigns.name | campaigns.status | campaigns.created_at | campaigns.updated_at,
+        orderby=campaigns.id
+    )
+
+    stats = []
+    for row in rows:
+        entry = {name: row.campaigns[name] for name in CAMPAIGN_FIELDS}
+        entry['total_targets'] = row[total] or 0
+        for key, expression in sums.items():
+            entry[key] = row[expression] or 0
+        stats.append(entry)
+    return stats
+
+
+def campaign_stats(query) -> List[Dict[str, Any]]:
+    """Result counts for every campaign matching query, read from campaign_counters.
+
+    Each entry holds the campaign's id, name, status, created_at and
+    updated_at plus one count per COUNTER_FIELDS key.
+    """
+    campaigns = db.campaigns
+    counters = db.campaign_counters
+    rows = db(query).select(
+        *[campaigns[name] for name in CAMPAIGN_FIELDS],
+        *[counters[name] for name in COUNTER_FIELDS],
+        left=counters.on(counters.campaign_id == campaigns.id),
+        orderby=campaigns.id
+    )
+
+    stats = []
+    for row in rows:
+        entry = {name: row.campaigns[name] for name in CAMPAIGN_FIELDS}
+        for name in COUNTER_FIELDS:
+            entry[name] = row.campaign_counters[name] or 0
+        stats.append(entry)
+    return stats
+
+
+# Weights of the per-target open, click and submission rates in risk_score
+RISK_WEIGHTS = (0.3, 0.4, 0.3)
+
+
+def target_performance(query, limitby: Optional[Tuple[int, int]] = None) -> List[Dict[str, Any]]:
+    """Per-target result counts and risk scores for targets matching query, riskiest first.
+
+    Counts come back from one GROUP BY, which also computes the score, sorts
+    by it and applies limitby (start, stop), so a page of targets costs one
+    query and only that page is read.
+    """
+    targets = db.targets
+    results = db.campaign_results
+    campaigns_participated = results.campaign_id.count(distinct=True)
+    sums = {
+        key: (results[flag] == True).case(1, 0).sum()
+        for key, flag in (('emails_received', 'email_sent'), ('emails_opened', 'email_opened'),
+                          ('clicks', 'link_clicked'), ('form_submissions', 'form_submitted'))
+    }
+    for total in sums.values():
+        # PyDAL leaves SUM(CASE ...) untyped; the score below needs it numeric, and
+        # as 'double' so the weights are not rendered as integers
+        total.type = 'double'
+    open_w, click_w, submit_w = RISK_WEIGHTS
+    received = sums['emails_received']
+    weighted = sums['emails_opened'] * open_w + sums['clicks'] * click_w + sums['form_submissions'] * submit_w
+    score = (received > 0).case(weighted * 100.0 / received, 0)
+    rows = db(query).select(
+        targets.id, targets.first_name, targets.last_name, targets.email,
+        campaigns_participated, *sums.values(), score,
+        left=results.on(results.target_id == targets.id),
+        groupby=targets.id | targets.first_name | targets.last_name | targets.email,
+        # Riskiest first; ties keep target order
+        orderby=~score | targets.id,
+        limitby=limitby,
+        cacheable=True
+    )
+
+    performance = []
+    for row in rows:
+        target = row.targets
+        performance.append({
+            'target_id': target.id,
+            'target_name': f"{target.first_name or ''} {target.last_name or ''}".strip() or target.email,
+            'target_email': target.email,
+            'campaigns_participated': row[campaigns_participated] or 0,
+            'emails_received': int(row[sums['emails_received']] or 0),
+            'emails_opened': int(row[sums['emails_opened']] or 0),
+            'clicks': int(row[sums['clicks']] or 0),
+            'form_submissions': int(row[sums['form_submissions']] or 0),
+            'risk_score': round(row[score] or 0, 2),
+        })
+    return performance
+
+
+def rate(count: int, emails_sent: int) -> float:
+    """Percentage of sent emails, rounded the way the analytics endpoints report it"""
+    return round(count / emails_sent * 100, 2) if emails_sent > 0 else 0.0
+
+
+# campaign_results flags rolled up per campaign and day, by daily_rollups column
+ROLLUP_FIELDS = ('emails_sent', 'emails_opened', 'clicks', 'form_submissions')
+
+
+def count_daily(query) -> List[Dict[str, Any]]:
+    """Count campaign_results of campaigns matching query per campaign and day the email was sent.
+
+    This is the source of truth daily_rollups is rebuilt from.
+    """
+    campaigns = db.campaigns
+    results = db.campaign_results
+    sent_at = results.email_sent_at
+    year, month, day = sent_at.year(), sent_at.month(), sent_at.day()
+    # Every row with a send time counts as sent on that day
+    sent = results.id.count()
+    sums = {
+        key: (results[RESULT_FLAGS[key]] == True).case(1, 0).sum()
+        for key in ROLLUP_FIELDS if key != 'emails_sent'
+    }
+
+    rows = db(query & (results.campaign_id == campaigns.id) & (sent_at != None)).select(
+        results.campaign_id, year, month, day, sent, *sums.values(),
+        groupby=results.campaign_id | year | month | day
+    )
+
+    counts = []
+    for row in rows:
+        entry = {
+            'campaign_id': row.campaign_results.campaign_id,
+            'day': date(row[year], row[month], row[day]),
+            'emails_sent': row[sent] or 0,
+        }
+        for key, expression in sums.items():
+            entry[key] = row[expression] or 0
+        counts.append(entry)
+    return counts
+
+
+def daily_stats(query, since: date) -> Dict[str, Dict[str, int]]:
+    """Summed daily_rollups of campaigns matching query from since on, keyed by 'YYYY-MM-DD' in date order"""
+    rollups = db.daily_rollups
+    sums = {key: rollups[key].sum() for key in ROLLUP_FIELDS}
+    rows = db(query & (rollups.campaign_id == db.campaigns.id) & (rollups.day >= since)).select(
+        rollups.day, *sums.values(),
+        groupby=rollups.day,
+        orderby=rollups.day
+    )
+    return {
+        row.daily_rollups.day.strftime('%Y-%m-%d'): {key: row[expression] or 0 for key, expression in sums.items()}
+        for row in rows
+    }
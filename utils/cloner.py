@@ -0,0 +1,225 @@
+import asyncio
+import base64
+import hashlib
+import mimetypes
+import os
+import re
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlparse
+
+import httpx
+from bs4 import BeautifulSoup
+
+from utils.offload import run_cpu
+
+CLONE_TIMEOUT = float(os.getenv("CLONE_TIMEOUT", "10"))
+CLONE_MAX_CONNECTIONS = int(os.getenv("CLONE_MAX_CONNECTIONS", "20"))
+CLONE_PER_HOST = int(os.getenv("CLONE_PER_HOST", "6"))  # concurrent asset fetches per origin host
+CLONE_MAX_ASSET_BYTES = int(os.getenv("CLONE_MAX_ASSET_BYTES", str(5 * 1024 * 1024)))
+CLONE_MAX_TOTAL_BYTES = int(os.getenv("CLONE_MAX_TOTAL_BYTES", str(50 * 1024 * 1024)))  # all assets of one page
+CLONE_MAX_ASSETS = int(os.getenv("CLONE_MAX_ASSETS", "200"))  # assets fetched per page, stylesheet url()s included
+CLONE_ASSET_MODE = os.getenv("CLONE_ASSET_MODE", "link")  # 'link' (hot-link origin), 'inline' or 'store'
+CLONE_ASSET_DIR = os.getenv("CLONE_ASSET_DIR", os.path.join("uploads", "phishlet_assets"))
+
+ASSET_MODES = ('link', 'inline', 'store')
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+CSS_URL = re.compile(r"url\(\s*['\"]?([^'\")]+)['\"]?\s*\)")
+
+
+class ByteBudget:
+    """Bytes the assets of one page may still download, shared by its concurrent fetches"""
+
+    def __init__(self, limit: int):
+        self.remaining = limit
+
+    def take(self, size: int) -> bool:
+        self.remaining -= size
+        return self.remaining >= 0
+
+
+class WebsiteCloner:
+    """Fetches pages and their subresources through one pooled async client.
+
+    Assets of a page are fetched concurrently, limited per host, and each
+    URL only once, up to CLONE_MAX_ASSETS of them and CLONE_MAX_TOTAL_BYTES
+    in all; assets past either limit stay hot-linked. In 'inline' mode they
+    are embedded into the page; in 'store' mode they are written under
+    CLONE_ASSET_DIR by content hash, so identical files cloned from any site
+    are stored once. url() references of the page's stylesheets (fonts,
+    background images) are localized the same way, one level deep: those of
+    a stylesheet pulled in by @import stay absolute. Parsing and rewriting
+    the page (including those writes) run on the CPU pool.
+    """
+
+    def __init__(self, per_host: int = CLONE_PER_HOST):
+        self.per_host = max(1, per_host)
+        self.client: Optional[httpx.AsyncClient] = None
+        # Per-host slots exist only while a fetch from that host is pending
+        self._hosts: Dict[str, asyncio.Semaphore] = {}
+        self._host_users: Dict[str, int] = {}
+
+    def _client(self) -> httpx.AsyncClient:
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                timeout=CLONE_TIMEOUT,
+                follow_redirects=True,
+                headers={'User-Agent': USER_AGENT},
+                limits=httpx.Limits(max_connections=CLONE_MAX_CONNECTIONS),
+            )
+        return self.client
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    @asynccontextmanager
+    async def _host_slot(self, url: str):
+        host = urlparse(url).netloc
+        if host not in self._hosts:
+            self._hosts[host] = asyncio.Semaphore(self.per_host)
+        self._host_users[host] = self._host_users.get(host, 0) + 1
+        try:
+            async with self._hosts[host]:
+                yield
+        finally:
+            self._host_users[host] -= 1
+            if not self._host_users[host]:
+                del self._host_users[host], self._hosts[host]
+
+    async def fetch(self, url: str) -> httpx.Response:
+        async with self._host_slot(url):
+            response = await self._client().get(url)
+        response.raise_for_status()
+        return response
+
+    async def fetch_page(self, url: str) -> str:
+        return (await self.fetch(url)).text
+
+    async def _fetch_asset(self, url: str, budget: ByteBudget) -> Optional[Tuple[bytes, str]]:
+        """Download an asset, giving up once it exceeds CLONE_MAX_ASSET_BYTES or the page's budget"""
+        try:
+            async with self._host_slot(url):
+                async with self._client().stream('GET', url) as response:
+                    response.raise_for_status()
+                    length = response.headers.get('content-length', '')
+                    if length.isdigit() and int(length) > min(CLONE_MAX_ASSET_BYTES, budget.remaining):
+                        return None
+                    content = bytearray()
+                    async for block in response.aiter_bytes():
+                        content += block
+                        if len(content) > CLONE_MAX_ASSET_BYTES or not budget.take(len(block)):
+                            return None
+        except (httpx.HTTPError, ValueError):
+            return None
+        content_type = response.headers.get('content-type', '').split(';')[0].strip()
+        return bytes(content), content_type or mimetypes.guess_type(url)[0] or 'application/octet-stream'
+
+    def _store(self, content: bytes, content_type: str, url: str) -> str:
+        digest = hashlib.sha256(content).hexdigest()
+        ext = os.path.splitext(urlparse(url).path)[1] or mimetypes.guess_extension(content_type) or ''
+        filename = f"{digest}{ext[:10]}"
+        os.makedirs(CLONE_ASSET_DIR, exist_ok=True)
+        path = os.path.join(CLONE_ASSET_DIR, filename)
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(content)
+        return f"{os.getenv('BACKEND_URL', 'http://localhost:8000')}/api/v1/phishlets/assets/{filename}"
+
+    async def localize_assets(self, html_content: str, mode: str = CLONE_ASSET_MODE) -> str:
+        """Replace absolute asset URLs of a page with inlined or locally stored copies"""
+        if mode not in ASSET_MODES or mode == 'link':
+            return html_content
+
+        soup, refs = await run_cpu(self._parse, html_content)
+        budget = ByteBudget(CLONE_MAX_TOTAL_BYTES)
+        # In document order, so the first assets of the page are the ones kept
+        urls = list(dict.fromkeys(tag[attr] for tag, attr in refs if tag[attr].startswith(('http://', 'https://'))))
+        fetched = await self._fetch_assets(urls[:CLONE_MAX_ASSETS], budget)
+
+        stylesheets = [(tag[attr], fetched[tag[attr]][0]) for tag, attr in refs
+                       if self._is_stylesheet(tag) and fetched.get(tag[attr])]
+        nested = [url for url in await run_cpu(self._css_urls, stylesheets) if url not in fetched]
+        fetched.update(await self._fetch_assets(nested[:max(0, CLONE_MAX_ASSETS - len(fetched))], budget))
+        return await run_cpu(self._rewrite, soup, refs, fetched, mode)
+
+    async def _fetch_assets(self, urls: List[str], budget: ByteBudget) -> Dict[str, Optional[Tuple[bytes, str]]]:
+        return dict(zip(urls, await asyncio.gather(*(self._fetch_asset(url, budget) for url in urls))))
+
+    @staticmethod
+    def _is_stylesheet(tag) -> bool:
+        return tag.name == 'link' and 'stylesheet' in (tag.get('rel') or [])
+
+    @staticmethod
+    def _css_urls(stylesheets: List[Tuple[str, bytes]]) -> List[str]:
+        """Absolute url() references of the fetched stylesheets, in order"""
+        urls = []
+        for sheet_url, content in stylesheets:
+            for match in CSS_URL.finditer(content.decode('utf-8', errors='replace')):
+                url = urljoin(sheet_url, match.group(1))
+                if url.startswith(('http://', 'https://')):
+                    urls.append(url)
+        return list(dict.fromkeys(urls))
+
+    def _local_url(self, asset: Tuple[bytes, str], url: str, mode: str) -> str:
+        """Where a rewritten reference points: a data: URI or the stored copy"""
+        content, content_type = asset
+        if mode == 'inline':
+            return f"data:{content_type};base64,{base64.b64encode(content).decode()}"
+        return self._store(content, content_type, url)
+
+    @staticmethod
+    def _parse(html_content: str) -> Tuple[BeautifulSoup, List[Tuple[object, str]]]:
+        """The parsed page and its (tag, attribute) asset references"""
+        soup = BeautifulSoup(html_content, 'html.parser')
+        refs = []
+        for tag in soup.find_all('img', src=True):
+            refs.append((tag, 'src'))
+        for tag in soup.find_all('script', src=True):
+            refs.append((tag, 'src'))
+        for tag in soup.find_all('link', href=True):
+            if 'stylesheet' in (tag.get('rel') or []) or 'icon' in (tag.get('rel') or []):
+                refs.append((tag, 'href'))
+        return soup, refs
+
+    def _rewrite(self, soup: BeautifulSoup, refs, fetched: Dict[str, Optional[Tuple[bytes, str]]], mode: str) -> str:
+        """Point the references at the fetched assets and serialize the page"""
+        for tag, attr in refs:
+            url = tag[attr]
+            asset = fetched.get(url)
+            if asset is None:
+                continue
+            content, content_type = asset
+
+            if self._is_stylesheet(tag):
+                css = CSS_URL.sub(
+                    lambda m, sheet_url=url: self._css_reference(m, sheet_url, fetched, mode),
+                    content.decode('utf-8', errors='replace')
+                )
+                if mode == 'inline':
+                    style = soup.new_tag('style')
+                    style.string = css
+                    tag.replace_with(style)
+                    continue
+                content = css.encode('utf-8')
+
+            if mode == 'inline' and tag.name == 'script':
+                del tag['src']
+                tag.string = content.decode('utf-8', errors='replace')
+            else:
+                tag[attr] = self._local_url((content, content_type), url, mode)
+
+        return str(soup)
+
+    def _css_reference(self, match, sheet_url: str, fetched, mode: str) -> str:
+        """A stylesheet url() pointing at the localized asset, or at its absolute origin URL"""
+        if match.group(1).startswith('data:'):
+            return match.group(0)
+        url = urljoin(sheet_url, match.group(1))
+        asset = fetched.get(url)
+        # Unfetched references must stay resolvable once the stylesheet moved
+        return f"url('{self._local_url(asset, url, mode) if asset else url}')"
+
+
+website_cloner = WebsiteCloner()
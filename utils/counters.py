@@ -0,0 +1,149 @@
+import asyncio
+import os
+from datetime import datetime
+from typing import Optional
+
+from database import db
+from utils.analytics import COUNTER_FIELDS, RESULT_FLAGS, ROLLUP_FIELDS, count_daily
+from utils.offload import run_db
+
+COUNTERS_RECONCILE_INTERVAL = int(os.getenv("COUNTERS_RECONCILE_INTERVAL", "3600"))  # seconds, 0 = only at startup
+
+
+def is_unset(field):
+    """Query for a boolean flag that has not flipped to True yet"""
+    return (field == False) | (field == None)
+
+
+def bump_counters(campaign_id: int, **deltas: int):
+    """Add deltas to a campaign's counters.
+
+    Call this in the same transaction as the campaign_results change it
+    accounts for, and only when a flag actually flipped; the caller commits.
+    """
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    counters = db.campaign_counters
+    updates = {name: counters[name] + delta for name, delta in deltas.items()}
+    if not db(counters.campaign_id == campaign_id).update(updated_at=datetime.utcnow(), **updates):
+        counters.insert(campaign_id=campaign_id, updated_at=datetime.utcnow(), **deltas)
+
+
+def bump_daily(campaign_id: int, sent_at: Optional[datetime], **deltas: int):
+    """Add deltas to the daily_rollups row of the day the result's email was sent.
+
+    Same contract as bump_counters; results without a send time are not
+    part of any day and keys other than ROLLUP_FIELDS are ignored.
+    """
+    deltas = {name: delta for name, delta in deltas.items() if delta and name in ROLLUP_FIELDS}
+    if sent_at is None or not deltas:
+        return
+    rollups = db.daily_rollups
+    day = sent_at.date()
+    updates = {name: rollups[name] + delta for name, delta in deltas.items()}
+    if not db((rollups.campaign_id == campaign_id) & (rollups.day == day)).update(**updates):
+        rollups.insert(campaign_id=campaign_id, day=day, **deltas)
+
+
+def lock_for_rebuild(table):
+    """Start a transaction holding the write lock on table, so no bump can commit
+    between a rebuild's count and its write. Postgres and SQLite only."""
+    adapter = db._adapter
+    if adapter.dbengine == 'sqlite':
+        if not adapter.connection.in_transaction:
+            db.executesql('BEGIN IMMEDIATE')
+    elif adapter.dbengine == 'postgres':
+        # Blocks other writers of table, not readers, until commit
+        db.executesql(f'LOCK TABLE {table._rname} IN SHARE ROW EXCLUSIVE MODE')
+
+
+def rebuild_counters(query=None) -> int:
+    """Recompute campaign_counters from campaign_results; returns the number of campaigns.
+
+    Results are counted in the statement that reads the counters, so both
+    come from one snapshot, and each counter is moved by its drift
+    (count + recounted - seen) through bump_counters instead of being
+    overwritten; bumps committed while the rebuild runs are kept.
+    """
+    if query is None:
+        query = db.campaigns.id > 0
+    campaigns = db.campaigns
+    results = db.campaign_results
+    counters = db.campaign_counters
+    recounted = {'total_targets': results.id.count()}
+    recounted.update({key: (results[flag] == True).case(1, 0).sum() for key, flag in RESULT_FLAGS.items()})
+    seen = {name: counters[name].max() for name in COUNTER_FIELDS}
+    rows = db(query).select(
+        campaigns.id, *recounted.values(), *seen.values(),
+        # campaign_id is unique in campaign_counters, so the join doesn't repeat results
+        left=[results.on(results.campaign_id == campaigns.id), counters.on(counters.campaign_id == campaigns.id)],
+        groupby=campaigns.id,
+    )
+    for row in rows:
+        bump_counters(row.campaigns.id, **{
+            name: (row[recounted[name]] or 0) - (row[seen[name]] or 0) for name in COUNTER_FIELDS
+        })
+    db.commit()
+    return len(rows)
+
+
+def rebuild_daily_rollups(query=None) -> int:
+    """Recompute daily_rollups from campaign_results (backfill); returns the number of rows written.
+
+    Each campaign is rebuilt in its own transaction that takes the write
+    lock before counting, so the lock is held briefly and no bump_daily
+    lands between the count and the rewrite.
+    """
+    if query is None:
+        query = db.campaigns.id > 0
+    rollups = db.daily_rollups
+    written = 0
+    for campaign in db(query).select(db.campaigns.id, orderby=db.campaigns.id):
+        lock_for_rebuild(rollups)
+        counts = count_daily(db.campaigns.id == campaign.id)
+        db(rollups.campaign_id == campaign.id).delete()
+        if counts:
+            rollups.bulk_insert(counts)
+        db.commit()
+        written += len(counts)
+    return written
+
+
+class CounterReconciler:
+    """Rebuilds campaign_counters and daily_rollups at startup and then every interval seconds,
+    so counters that drifted (e.g. after a crash mid-write or a manual edit)
+    converge back to the raw results."""
+
+    def __init__(self, interval: int = COUNTERS_RECONCILE_INTERVAL):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await run_db(rebuild_counters)
+                await run_db(rebuild_daily_rollups)
+            except Exception as e:
+                print(f"Error reconciling campaign counters: {e}")
+            if self.interval <= 0:
+                return
+            await asyncio.sleep(self.interval)
+
+
+counter_reconciler = CounterReconciler()
+
+
+if __name__ == "__main__":
+    print(f"Rebuilt counters for {rebuild_counters()} campaigns")
+    print(f"Backfilled {rebuild_daily_rollups()} daily rollups")
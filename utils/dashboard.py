@@ -0,0 +1,108 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from database import db, after_commit
+from utils.analytics import RESULT_FLAGS
+
+DASHBOARD_CACHE_TTL = float(os.getenv("DASHBOARD_CACHE_TTL", "5"))  # seconds
+
+ACTIVE_STATUSES = ('running', 'scheduled')
+
+# Owned tables counted on the dashboard, by output key
+RESOURCE_TABLES = {
+    'total_campaigns': 'campaigns',
+    'total_targets': 'targets',
+    'total_templates': 'email_templates',
+    'total_phishlets': 'phishlets',
+    'total_sender_profiles': 'sender_profiles',
+    'total_groups': 'groups',
+}
+
+
+def dashboard_counts(user_id: int, scope_all: bool = False) -> Dict[str, int]:
+    """Every dashboard counter of a user in one compound SELECT.
+
+    Each counter is a scalar subquery built by PyDAL, so the whole set
+    costs one round-trip. With scope_all (admins) resources and results
+    of every user are counted; recent activity is always the user's own.
+    Result totals are summed from campaign_counters.
+    """
+    def owned(table):
+        return table.id > 0 if scope_all else table.user_id == user_id
+
+    campaigns = db.campaigns
+    counters = db.campaign_counters
+    activities = db.user_activities
+    week_ago = datetime.utcnow() - timedelta(days=7)
+    scope = db(owned(campaigns))._select(campaigns.id)
+
+    subqueries = {key: db(owned(db[table]))._count() for key, table in RESOURCE_TABLES.items()}
+    subqueries['active_campaigns'] = db(owned(campaigns) & campaigns.status.belongs(ACTIVE_STATUSES))._count()
+    for key in RESULT_FLAGS:
+        subqueries[key] = db(counters.campaign_id.belongs(scope))._select(counters[key].sum())
+    subqueries['recent_activity_count'] = db((activities.user_id == user_id) & (activities.timestamp >= week_ago))._count()
+
+    row = db.executesql("SELECT " + ", ".join(f"({sql.rstrip(';')})" for sql in subqueries.values()))[0]
+    return {key: value or 0 for key, value in zip(subqueries, row)}
+
+
+class DashboardCache:
+    """Per-user dashboard counters kept for ttl seconds.
+
+    Writes to the counted tables drop the affected entries through PyDAL
+    after-insert/update/delete hooks, when written and again after the
+    commit. Tracking events only move
+    campaign_counters, and nearly every request logs a user_activities
+    row; neither table is watched, so those totals and
+    recent_activity_count refresh when the entry expires instead of on
+    every open, click or request. Entries are read and written from DB
+    worker threads, hence the lock.
+    """
+
+    def __init__(self, ttl: float = DASHBOARD_CACHE_TTL):
+        self.ttl = ttl
+        self._entries: Dict[Tuple[int, bool], Tuple[float, Dict[str, int]]] = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int, scope_all: bool = False) -> Dict[str, int]:
+        key = (user_id, scope_all)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                return entry[1]
+            generation = self._generation
+        counts = dashboard_counts(user_id, scope_all)
+        with self._lock:
+            # Don't keep counts that a write invalidated while they were computed
+            if self.ttl > 0 and generation == self._generation:
+                self._entries[key] = (time.monotonic() + self.ttl, counts)
+        return counts
+
+    def invalidate(self, user_id: Optional[int] = None):
+        """Drop a user's entries and every all-users entry, or everything without a user"""
+        with self._lock:
+            self._generation += 1
+            if user_id is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if key[0] == user_id or key[1]]:
+                self._entries.pop(key, None)
+
+    def written(self, user_id: Optional[int] = None):
+        # A count may still read the old rows until the write commits
+        self.invalidate(user_id)
+        after_commit(self.invalidate, user_id)
+
+    def watch(self, table):
+        table._after_insert.append(lambda fields, id: self.written(fields.get('user_id')))
+        table._after_update.append(lambda dbset, fields: self.written())
+        table._after_delete.append(lambda dbset: self.written())
+
+
+dashboard_cache = DashboardCache()
+for _table in RESOURCE_TABLES.values():
+    dashboard_cache.watch(db[_table])
@@ -0,0 +1,613 @@
+import asyncio
+import base64
+import json
+import os
+import smtplib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+import httpx
+
+from database import db
+from utils.counters import bump_counters, bump_daily, is_unset
+from utils.email_template import CompiledTemplate
+from utils.offload import run_db
+from utils.smtp_transport import SMTPTransport
+
+# Mailer settings (overridable through the environment)
+MAILER_API_URL = os.getenv("EMAIL_API_URL", "http://localhost:8001/send")
+MAILER_TIMEOUT = float(os.getenv("MAILER_TIMEOUT", "60"))
+MAILER_MAX_CONNECTIONS = int(os.getenv("MAILER_MAX_CONNECTIONS", "100"))
+MAILER_CONCURRENCY = int(os.getenv("MAILER_CONCURRENCY", "10"))  # in-flight sends per sender profile
+MAILER_RATE_LIMIT = float(os.getenv("MAILER_RATE_LIMIT", "0"))  # sends per second per sender profile, 0 = unlimited
+MAILER_BATCH_SIZE = int(os.getenv("MAILER_BATCH_SIZE", "0"))  # recipients per batch request, 0/1 = one request per target
+MAILER_BATCH_API_URL = os.getenv("EMAIL_BATCH_API_URL", MAILER_API_URL.rstrip("/") + "/batch")
+MAILER_TRANSPORT = os.getenv("MAILER_TRANSPORT", "http")  # 'http' (mailer API) or 'smtp' (direct to the sender profile's server)
+
+# Queue settings
+DELIVERY_WORKERS = int(os.getenv("DELIVERY_WORKERS", "4"))
+DELIVERY_BATCH_SIZE = int(os.getenv("DELIVERY_BATCH_SIZE", "50"))
+DELIVERY_POLL_INTERVAL = float(os.getenv("DELIVERY_POLL_INTERVAL", "2"))
+DELIVERY_MAX_ATTEMPTS = int(os.getenv("DELIVERY_MAX_ATTEMPTS", "3"))
+DELIVERY_RETRY_DELAY = int(os.getenv("DELIVERY_RETRY_DELAY", "60"))  # seconds, doubled per attempt
+DELIVERY_CLAIM_TIMEOUT = int(os.getenv("DELIVERY_CLAIM_TIMEOUT", "600"))  # seconds before a stuck in-flight row is requeued
+
+# Stands in for the target id in batch payloads
+TARGET_TOKEN = "{{TARGET_ID}}"
+
+CLAIMABLE = ('queued', 'retry')
+PENDING = ('queued', 'in_flight', 'retry')
+
+
+class RateLimiter:
+    """Token bucket limiting how many sends may start per second"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._allowance = max(rate, 1.0)
+        self._last = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._allowance = min(max(self.rate, 1.0), self._allowance + (now - self._last) * self.rate)
+                self._last = now
+                if self._allowance >= 1:
+                    self._allowance -= 1
+                    return
+                await asyncio.sleep((1 - self._allowance) / self.rate)
+
+
+class CampaignContext:
+    """Everything needed to build mailer payloads for one campaign"""
+
+    def __init__(self, campaign, sender, email_temp, phishlet=None, attachment=None):
+        self.campaign = campaign
+        self.sender = sender
+        self.email_temp = email_temp
+        self.phishlet = phishlet
+        self.attachments_payload = []
+        self.image_src = os.getenv("BACKEND_URL", "")
+
+        # Attachment is encoded once for the whole campaign
+        if attachment:
+            file_path = attachment.attachmentFile.replace("\\", "/")
+            with open(file_path, "rb") as f:
+                file_bytes = f.read()
+            self.attachments_payload.append({
+                "filename": attachment.name,
+                "content_base64": base64.b64encode(file_bytes).decode(),
+                "mime_type": attachment.file_type,
+            })
+
+        # Phishlet links are only spliced in when there is no attachment
+        link_base = phishlet.clone_url if phishlet and not self.attachments_payload else None
+        self.template = CompiledTemplate(email_temp.html_content, self.image_src, campaign.id, link_base)
+        self.batch_html = self.template.render(TARGET_TOKEN)
+
+        if link_base is not None:
+            plain_body = f"{email_temp.text_content}\n\nClick here: {phishlet.clone_url}"
+        else:
+            plain_body = email_temp.text_content
+
+        # Fields shared by every message of the campaign
+        self.shared_payload = {
+            "smtp_host": sender.smtp_host,
+            "smtp_port": sender.smtp_port,
+            "smtp_username": sender.smtp_username,
+            "smtp_password": sender.smtp_password,
+            "from_address": sender.from_address,
+            "subject": email_temp.subject or "No Subject",
+            "plain_body": plain_body,
+            "attachments": self.attachments_payload,
+        }
+
+    @classmethod
+    def load(cls, campaign_id: int) -> "CampaignContext":
+        campaign = db.campaigns(campaign_id)
+        if not campaign:
+            raise ValueError("Campaign not found")
+        sender = db.sender_profiles(campaign.sender_profile_id)
+        if not sender:
+            raise ValueError("Sender profile not found")
+        email_temp = db.email_templates(campaign.email_template_id)
+        if not email_temp:
+            raise ValueError("Email template not found")
+        phishlet = db.phishlets(campaign.phishlet_id) if campaign.phishlet_id else None
+        attachment = db.attachments(campaign.attachment_id) if campaign.attachment_id else None
+        return cls(campaign, sender, email_temp, phishlet, attachment)
+
+    def build_payload(self, target) -> Dict[str, Any]:
+        payload = dict(self.shared_payload)
+        payload["to"] = target.email
+        payload["html_body"] = self.template.render(target.id)
+        return payload
+
+    def build_batch_payload(self, targets) -> Dict[str, Any]:
+        """One payload for many targets; the mailer replaces TARGET_TOKEN per recipient"""
+        payload = dict(self.shared_payload)
+        payload["html_body"] = self.batch_html
+        payload["recipients"] = [
+            {"to": target.email, "substitutions": {TARGET_TOKEN: str(target.id)}}
+            for target in targets
+        ]
+        return payload
+
+
+def campaign_targets(campaign) -> List[Any]:
+    """Active targets of a campaign, by group or by its individual id list"""
+    if campaign.target_type == "individual":
+        try:
+            target_ids = json.loads(campaign.target_individuals or "[]")
+        except json.JSONDecodeError:
+            raise ValueError("Invalid target individuals format")
+        if not target_ids:
+            return []
+        targets = db(db.targets.id.belongs(target_ids)).select(orderby=db.targets.id)
+    else:
+        group = db.groups(campaign.target_group_id) if campaign.target_group_id else None
+        if not group:
+            raise LookupError("Target group not found")
+        targets = db(db.targets.group_id == group.id).select(orderby=db.targets.id)
+    return [t for t in targets if t.is_active]
+
+
+def enqueue_campaign(campaign_id: int, target_ids: Iterable[int]) -> int:
+    """Add one queue row per target that is not already queued for the campaign"""
+    queue = db.delivery_queue
+    existing = set(
+        row.target_id for row in db(queue.campaign_id == campaign_id).select(queue.target_id)
+    )
+    now = datetime.utcnow()
+    rows = []
+    for target_id in target_ids:
+        if target_id in existing:
+            continue
+        existing.add(target_id)
+        rows.append(dict(
+            campaign_id=campaign_id,
+            target_id=target_id,
+            status='queued',
+            attempts=0,
+            created_at=now,
+            updated_at=now
+        ))
+    if rows:
+        queue.bulk_insert(rows)
+    db.commit()
+    return len(rows)
+
+
+def backfill_delivery_queue() -> int:
+    """Give campaigns sent before the delivery queue existed their queue rows.
+
+    Campaigns sent by the old per-request sender have email_sent results but
+    no delivery_queue rows, so they look as if they were never queued. Every
+    sent result gets a 'sent' row and such campaigns still marked scheduled
+    or running are marked completed, so nothing fires them again and a
+    resend only queues the targets that were not sent. Returns the number
+    of campaigns backfilled.
+    """
+    campaigns = db.campaigns
+    results = db.campaign_results
+    queue = db.delivery_queue
+    queued = db(queue.id > 0)._select(queue.campaign_id, distinct=True)
+    sent = db((results.email_sent == True) & (~results.campaign_id.belongs(queued)))._select(
+        results.campaign_id, distinct=True
+    )
+    campaign_ids = [row.id for row in db(campaigns.id.belongs(sent)).select(campaigns.id)]
+    now = datetime.utcnow()
+    for campaign_id in campaign_ids:
+        rows = db((results.campaign_id == campaign_id) & (results.email_sent == True)).select(
+            results.target_id, results.email_sent_at
+        )
+        queue.bulk_insert([
+            dict(campaign_id=campaign_id, target_id=row.target_id, status='sent', attempts=1,
+                 sent_at=row.email_sent_at, created_at=now, updated_at=now)
+            for row in rows
+        ])
+        db((campaigns.id == campaign_id) & campaigns.status.belongs(('scheduled', 'running'))).update(
+            status='completed', updated_at=now
+        )
+    return len(campaign_ids)
+
+
+def complete_drained(campaign_ids: Iterable[int]) -> int:
+    """Mark running campaigns among campaign_ids completed once none of their rows is pending"""
+    campaigns = db.campaigns
+    queue = db.delivery_queue
+    pending = db(queue.campaign_id.belongs(list(campaign_ids)) & queue.status.belongs(PENDING))._select(
+        queue.campaign_id, distinct=True
+    )
+    return db(
+        campaigns.id.belongs(list(campaign_ids)) &
+        (campaigns.status == 'running') &
+        (~campaigns.id.belongs(pending))
+    ).update(status='completed', updated_at=datetime.utcnow())
+
+
+def campaign_progress(campaign_id: int) -> Dict[str, Any]:
+    """Count queue rows of a campaign by state"""
+    queue = db.delivery_queue
+    count = queue.id.count()
+    rows = db(queue.campaign_id == campaign_id).select(queue.status, count, groupby=queue.status)
+    by_status = {row.delivery_queue.status: row[count] for row in rows}
+    total = sum(by_status.values())
+    return {
+        "job_id": campaign_id,
+        "campaign_id": campaign_id,
+        "status": "running" if any(by_status.get(s) for s in PENDING) else ("completed" if total else "empty"),
+        "total": total,
+        "queued": by_status.get('queued', 0),
+        "in_flight": by_status.get('in_flight', 0),
+        "retry": by_status.get('retry', 0),
+        "sent": by_status.get('sent', 0),
+        "failed": by_status.get('failed', 0),
+    }
+
+
+class DeliveryEngine:
+    """Drains the delivery_queue table with a pool of worker coroutines.
+
+    Workers claim batches of queue rows, send them through a shared
+    httpx.AsyncClient and record the outcome on the row in the same
+    transaction as campaign_results, so a restart resumes where it stopped.
+    Claiming and recording run on DB worker threads through run_db; only
+    the sends themselves run on the event loop.
+    Each sender profile gets its own concurrency slots and rate limiter.
+    With mailer_batch_size > 1, rows of one campaign are posted together to
+    the batch endpoint so shared fields and attachments travel once.
+    """
+
+    def __init__(
+        self,
+        workers: int = DELIVERY_WORKERS,
+        batch_size: int = DELIVERY_BATCH_SIZE,
+        concurrency: int = MAILER_CONCURRENCY,
+        rate_limit: float = MAILER_RATE_LIMIT,
+        mailer_batch_size: int = MAILER_BATCH_SIZE,
+        transport: str = MAILER_TRANSPORT,
+    ):
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.mailer_batch_size = max(1, mailer_batch_size)
+        self.smtp = SMTPTransport() if transport == 'smtp' else None
+        self.concurrency = max(1, concurrency)
+        self.rate_limit = rate_limit
+        self.client: Optional[httpx.AsyncClient] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._claimed: set = set()
+        self._contexts: "OrderedDict[Any, CampaignContext]" = OrderedDict()
+        self._contexts_lock = threading.Lock()
+        self._semaphores: Dict[int, asyncio.Semaphore] = {}
+        self._limiters: Dict[int, RateLimiter] = {}
+
+    async def start(self):
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                timeout=MAILER_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=MAILER_MAX_CONNECTIONS,
+                    max_keepalive_connections=MAILER_MAX_CONNECTIONS,
+                ),
+            )
+        if not self._worker_tasks:
+            self._wakeup = asyncio.Event()
+            self._loop = asyncio.get_running_loop()
+            await run_db(self.requeue_stale)
+            self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self):
+        for task in self._worker_tasks:
+            task.cancel()
+        if self._worker_tasks:
+            await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        self._loop = None
+
+        # Hand rows this process still held back to the queue
+        if self._claimed:
+            claimed = list(self._claimed)
+            await run_db(lambda: db(db.delivery_queue.id.belongs(claimed) &
+                                    (db.delivery_queue.status == 'in_flight')).update(status='queued', claimed_at=None))
+            self._claimed.clear()
+
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+        if self.smtp is not None:
+            await self.smtp.close()
+
+    def notify(self):
+        """Wake idle workers after new rows were queued; safe to call from DB worker threads"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def requeue_stale(self):
+        """Return in-flight rows whose worker died back to the queue"""
+        cutoff = datetime.utcnow() - timedelta(seconds=DELIVERY_CLAIM_TIMEOUT)
+        queue = db.delivery_queue
+        db((queue.status == 'in_flight') & (queue.claimed_at < cutoff)).update(
+            status='queued', claimed_at=None, updated_at=datetime.utcnow()
+        )
+        db.commit()
+
+    def claim_batch(self) -> List[Any]:
+        """Mark up to batch_size claimable rows in flight and return them"""
+        queue = db.delivery_queue
+        now = datetime.utcnow()
+        claimable = (
+            (queue.status == 'queued') |
+            ((queue.status == 'retry') & (queue.retry_at <= now))
+        )
+        candidates = db(
+            claimable &
+            (queue.campaign_id == db.campaigns.id) &
+            (~db.campaigns.status.belongs(('paused', 'cancelled')))
+        ).select(queue.id, orderby=queue.id, limitby=(0, self.batch_size))
+
+        claimed_ids = []
+        for row in candidates:
+            # Conditional update so two processes never claim the same row
+            if db((queue.id == row.id) & queue.status.belongs(CLAIMABLE)).update(
+                status='in_flight', claimed_at=now, updated_at=now
+            ):
+                claimed_ids.append(row.id)
+        db.commit()
+        if not claimed_ids:
+            return []
+        self._claimed.update(claimed_ids)
+        return list(db(queue.id.belongs(claimed_ids)).select(orderby=queue.id))
+
+    def _context(self, campaign_id: int) -> CampaignContext:
+        campaign = db.campaigns(campaign_id)
+        key = (campaign_id, campaign.updated_at if campaign else None)
+        # Workers resolve contexts on several DB threads at once
+        with self._contexts_lock:
+            context = self._contexts.get(key)
+        if context is None:
+            context = CampaignContext.load(campaign_id)
+            with self._contexts_lock:
+                self._contexts[key] = context
+                while len(self._contexts) > 32:
+                    self._contexts.popitem(last=False)
+        return context
+
+    def _slots(self, sender_profile_id: int):
+        if sender_profile_id not in self._semaphores:
+            self._semaphores[sender_profile_id] = asyncio.Semaphore(self.concurrency)
+            self._limiters[sender_profile_id] = RateLimiter(self.rate_limit)
+        return self._semaphores[sender_profile_id], self._limiters[sender_profile_id]
+
+    async def _worker(self):
+        while True:
+            try:
+                rows = await run_db(self.claim_batch)
+            except Exception as e:
+                print(f"Error claiming delivery batch: {e}")
+                rows = []
+
+            if not rows:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=DELIVERY_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    try:
+                        await run_db(self.requeue_stale)
+                    except Exception as e:
+                        print(f"Error requeueing stale deliveries: {e}")
+                continue
+
+            if self.mailer_batch_size > 1 and self.smtp is None:
+                await asyncio.gather(*(self._deliver_batch(chunk) for chunk in self._chunks(rows)))
+            else:
+                await asyncio.gather(*(self._deliver(row) for row in rows))
+            try:
+                await run_db(complete_drained, {row.campaign_id for row in rows})
+            except Exception as e:
+                print(f"Error completing drained campaigns: {e}")
+
+    def _chunks(self, rows) -> List[List[Any]]:
+        """Split claimed rows into per-campaign chunks of mailer_batch_size"""
+        by_campaign: Dict[int, List[Any]] = {}
+        for row in rows:
+            by_campaign.setdefault(row.campaign_id, []).append(row)
+        return [
+            campaign_rows[i:i + self.mailer_batch_size]
+            for campaign_rows in by_campaign.values()
+            for i in range(0, len(campaign_rows), self.mailer_batch_size)
+        ]
+
+    def _prepare(self, row):
+        """Resolve the context and target of a row, failing it for good if either is gone"""
+        try:
+            context = self._context(row.campaign_id)
+            target = db.targets(row.target_id)
+            if not target or not target.is_active:
+                raise ValueError("Target not found or inactive")
+        except Exception as e:
+            self._record_failure(row, str(e), retry=False)
+            return None, None
+        return context, target
+
+    async def _deliver(self, row):
+        context, target = await run_db(self._prepare, row)
+        if context is None:
+            return
+
+        semaphore, limiter = self._slots(context.sender.id)
+        async with semaphore:
+            await limiter.acquire()
+            if await self._lost_claims([row]):
+                return
+            try:
+                if self.smtp is not None:
+                    await self.smtp.send(context, target)
+                else:
+                    resp = await self.client.post(MAILER_API_URL, json=context.build_payload(target))
+                    if resp.status_code != 200:
+                        await run_db(self._record_failure, row, f"Mailer API error: {resp.status_code} {resp.text}")
+                        return
+            except smtplib.SMTPException as e:
+                await run_db(self._record_failure, row, f"SMTP error: {str(e)}")
+                return
+            except OSError as e:
+                await run_db(self._record_failure, row, f"SMTP connection error: {str(e)}")
+                return
+            except httpx.RequestError as e:
+                await run_db(self._record_failure, row, f"Mailer request error: {str(e)}")
+                return
+            except Exception as e:
+                await run_db(self._record_failure, row, f"Unexpected error: {str(e)}")
+                return
+
+        try:
+            await run_db(self._record_sent, row, context, target)
+        except Exception as e:
+            print(f"Error recording delivery {row.id}: {e}")
+
+    async def _deliver_batch(self, rows):
+        prepared = await run_db(self._prepare_batch, rows)
+        if not prepared:
+            return
+        context = prepared[0][1]
+
+        semaphore, limiter = self._slots(context.sender.id)
+        async with semaphore:
+            for _ in prepared:
+                await limiter.acquire()
+            lost = await self._lost_claims([row for row, _, _ in prepared])
+            prepared = [item for item in prepared if item[0].id not in lost]
+            if not prepared:
+                return
+            payload = context.build_batch_payload([target for _, _, target in prepared])
+            try:
+                resp = await self.client.post(MAILER_BATCH_API_URL, json=payload)
+                if resp.status_code != 200:
+                    await run_db(self._record_batch_failure, prepared, f"Mailer API error: {resp.status_code} {resp.text}")
+                    return
+                results = resp.json().get("results", [])
+            except httpx.RequestError as e:
+                await run_db(self._record_batch_failure, prepared, f"Mailer request error: {str(e)}")
+                return
+            except Exception as e:
+                await run_db(self._record_batch_failure, prepared, f"Unexpected error: {str(e)}")
+                return
+
+        await run_db(self._record_batch, prepared, results)
+
+    async def _lost_claims(self, rows) -> set:
+        """Renew the claims of rows that waited past half of DELIVERY_CLAIM_TIMEOUT for a slot.
+
+        Returns the ids of rows requeue_stale already handed back; another
+        worker may send those, so they are skipped. Fresh claims cost no write.
+        """
+        renew_before = datetime.utcnow() - timedelta(seconds=DELIVERY_CLAIM_TIMEOUT / 2)
+        waited = [row for row in rows if row.claimed_at is None or row.claimed_at < renew_before]
+        if not waited:
+            return set()
+        return await run_db(self._renew_claims, waited)
+
+    def _renew_claims(self, rows) -> set:
+        """Move claimed_at of rows still held by this worker to now; returns the ids no longer held"""
+        now = datetime.utcnow()
+        queue = db.delivery_queue
+        lost = set()
+        for row in rows:
+            held = (queue.id == row.id) & (queue.status == 'in_flight') & (queue.claimed_at == row.claimed_at)
+            if not db(held).update(claimed_at=now, updated_at=now):
+                lost.add(row.id)
+                self._claimed.discard(row.id)
+        return lost
+
+    def _prepare_batch(self, rows):
+        prepared = []
+        for row in rows:
+            context, target = self._prepare(row)
+            if context is not None:
+                prepared.append((row, context, target))
+        return prepared
+
+    def _record_batch(self, prepared, results):
+        """Record a batch response; results come back in recipient order"""
+        for i, (row, context, target) in enumerate(prepared):
+            result = results[i] if i < len(results) else {"status": "failed", "error": "Missing from mailer response"}
+            if result.get("status") != "sent":
+                self._record_failure(row, f"Mailer error: {result.get('error', 'unknown')}")
+                continue
+            try:
+                self._record_sent(row, context, target)
+            except Exception as e:
+                db.rollback()
+                print(f"Error recording delivery {row.id}: {e}")
+
+    def _record_batch_failure(self, prepared, error: str):
+        for row, _, _ in prepared:
+            self._record_failure(row, error)
+
+    def _record_sent(self, row, context: CampaignContext, target):
+        now = datetime.utcnow()
+
+        # Log email events
+        db.email_events.insert(
+            campaign_id=row.campaign_id,
+            target_id=target.id,
+            event_type="sent",
+            event_data=json.dumps({
+                "subject": context.email_temp.subject,
+                "from": context.sender.from_address,
+                "to": target.email
+            })
+        )
+
+        # Update campaign results, counting only rows whose email_sent flips; a
+        # resend keeps the first send time so the row stays in its daily rollup
+        results = db.campaign_results
+        result_query = (results.campaign_id == row.campaign_id) & (results.target_id == target.id)
+        if db(result_query & is_unset(results.email_sent)).update(email_sent=True, email_sent_at=now, updated_at=now):
+            bump_counters(row.campaign_id, emails_sent=1)
+            bump_daily(row.campaign_id, now, emails_sent=1)
+        elif not db(result_query).update(updated_at=now):
+            results.insert(
+                campaign_id=row.campaign_id,
+                target_id=target.id,
+                email_sent=True,
+                email_sent_at=now,
+                updated_at=now
+            )
+            bump_counters(row.campaign_id, total_targets=1, emails_sent=1)
+            bump_daily(row.campaign_id, now, emails_sent=1)
+
+        db(db.delivery_queue.id == row.id).update(
+            status='sent', sent_at=now, attempts=row.attempts + 1, last_error=None, updated_at=now
+        )
+        db.commit()
+        self._claimed.discard(row.id)
+
+    def _record_failure(self, row, error: str, retry: bool = True):
+        now = datetime.utcnow()
+        attempts = row.attempts + 1
+        update = dict(attempts=attempts, last_error=error, claimed_at=None, updated_at=now)
+        if retry and attempts < DELIVERY_MAX_ATTEMPTS:
+            update.update(status='retry', retry_at=now + timedelta(seconds=DELIVERY_RETRY_DELAY * 2 ** (attempts - 1)))
+        else:
+            update.update(status='failed')
+        try:
+            db(db.delivery_queue.id == row.id).update(**update)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"Error recording delivery failure {row.id}: {e}")
+        self._claimed.discard(row.id)
+
+
+delivery_engine = DeliveryEngine()
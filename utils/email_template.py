@@ -0,0 +1,37 @@
+from typing import List, Optional
+
+PHISHLET_PLACEHOLDER = "{{PHISHLET_URL}}"
+
+
+class CompiledTemplate:
+    """An email template split once into static chunks around its per-target slots.
+
+    Rendering for a target only joins the chunks with that target's phishlet
+    link and tracking pixel id, so nothing is re-parsed or re-formatted per send.
+    """
+
+    def __init__(self, html_content: Optional[str], image_src: str, campaign_id: int, link_base: Optional[str] = None):
+        html_content = html_content or ""
+        if link_base is not None:
+            # Text between the {{PHISHLET_URL}} occurrences
+            self.chunks: List[str] = html_content.split(PHISHLET_PLACEHOLDER)
+            self.link_prefix = f"{link_base}*{campaign_id}*"
+        else:
+            self.chunks = [html_content]
+            self.link_prefix = ""
+
+        # Tracking pixel, appended after the template body
+        self.chunks[0] = "\n            " + self.chunks[0]
+        self.pixel_prefix = (
+            "\n            <br>\n"
+            f'            <img width="1" height="1" src="{image_src}/api/v1/track/f1/{campaign_id}*'
+        )
+        self.pixel_suffix = '">\n        '
+
+    def render(self, target_id: int) -> str:
+        target_id = str(target_id)
+        if len(self.chunks) > 1:
+            body = (self.link_prefix + target_id).join(self.chunks)
+        else:
+            body = self.chunks[0]
+        return body + self.pixel_prefix + target_id + self.pixel_suffix
@@ -0,0 +1,84 @@
+"""Local stand-in for the mailer API, for development and load testing.
+
+Accepts both the single-message and the batch protocol, renders messages
+the way the real mailer would and keeps them in memory instead of sending.
+
+    uvicorn utils.mock_mailer:app --port 8001
+"""
+import asyncio
+import os
+from typing import Any, Dict, List
+
+from fastapi import FastAPI, HTTPException, Request
+
+MOCK_MAILER_LATENCY = float(os.getenv("MOCK_MAILER_LATENCY", "0"))  # seconds per request
+MOCK_MAILER_KEEP = int(os.getenv("MOCK_MAILER_KEEP", "100"))  # rendered messages kept for inspection
+
+app = FastAPI(title="Mock mailer")
+
+stats = {"requests": 0, "messages": 0, "bytes": 0}
+messages: List[Dict[str, Any]] = []
+
+
+def _store(message: Dict[str, Any]):
+    stats["messages"] += 1
+    messages.append(message)
+    if len(messages) > MOCK_MAILER_KEEP:
+        del messages[0]
+
+
+async def _read(request: Request) -> Dict[str, Any]:
+    body = await request.body()
+    stats["requests"] += 1
+    stats["bytes"] += len(body)
+    if MOCK_MAILER_LATENCY:
+        await asyncio.sleep(MOCK_MAILER_LATENCY)
+    return await request.json()
+
+
+@app.post("/send")
+async def send(request: Request):
+    payload = await _read(request)
+    if not payload.get("to"):
+        raise HTTPException(status_code=400, detail="Missing recipient")
+    _store({
+        "to": payload["to"],
+        "subject": payload.get("subject"),
+        "html_body": payload.get("html_body"),
+        "attachments": len(payload.get("attachments") or []),
+    })
+    return {"status": "sent"}
+
+
+@app.post("/send/batch")
+async def send_batch(request: Request):
+    payload = await _read(request)
+    html_body = payload.get("html_body") or ""
+    results = []
+    for recipient in payload.get("recipients") or []:
+        if not recipient.get("to"):
+            results.append({"status": "failed", "error": "Missing recipient"})
+            continue
+        body = html_body
+        for key, value in (recipient.get("substitutions") or {}).items():
+            body = body.replace(key, value)
+        _store({
+            "to": recipient["to"],
+            "subject": payload.get("subject"),
+            "html_body": body,
+            "attachments": len(payload.get("attachments") or []),
+        })
+        results.append({"to": recipient["to"], "status": "sent"})
+    return {"results": results}
+
+
+@app.get("/stats")
+async def get_stats():
+    return {**stats, "recent": messages[-10:]}
+
+
+@app.delete("/stats")
+async def reset_stats():
+    stats.update(requests=0, messages=0, bytes=0)
+    messages.clear()
+    return {"status": "reset"}
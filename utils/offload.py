@@ -0,0 +1,61 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from database import db
+
+DB_WORKERS = int(os.getenv("DB_WORKERS", "8"))  # threads running PyDAL work, 0 = run on the event loop
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", str(min(4, os.cpu_count() or 1))))  # threads for bcrypt and HTML parsing, 0 = run on the event loop
+
+_db_executor: Optional[ThreadPoolExecutor] = (
+    ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db") if DB_WORKERS > 0 else None
+)
+_cpu_executor: Optional[ThreadPoolExecutor] = (
+    ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="cpu") if CPU_WORKERS > 0 else None
+)
+
+
+def _transaction(fn: Callable, args, kwargs):
+    try:
+        result = fn(*args, **kwargs)
+    except BaseException:
+        db.rollback()
+        raise
+    db.commit()
+    return result
+
+
+async def run_db(fn: Callable, *args, **kwargs) -> Any:
+    """Run fn as one unit of database work on a DB worker thread.
+
+    PyDAL connections are per thread, so the unit is committed (or rolled
+    back when fn raises) on the thread that did the work; nothing it
+    started is left open for another request to commit.
+    """
+    if _db_executor is None:
+        return _transaction(fn, args, kwargs)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, functools.partial(_transaction, fn, args, kwargs))
+
+
+async def run_cpu(fn: Callable, *args, **kwargs) -> Any:
+    """Run CPU-bound fn (bcrypt, HTML parsing) on the bounded CPU pool"""
+    if _cpu_executor is None:
+        return fn(*args, **kwargs)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_cpu_executor, functools.partial(fn, *args, **kwargs))
+
+
+def db_endpoint(fn: Callable) -> Callable:
+    """Make a synchronous route handler async, running its body through run_db.
+
+    FastAPI reads the handler's parameters through functools.wraps, so
+    path, query, body and Depends() parameters are resolved as before.
+    """
+    @functools.wraps(fn)
+    async def endpoint(*args, **kwargs):
+        return await run_db(fn, *args, **kwargs)
+    return endpoint
+
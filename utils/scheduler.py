@@ -0,0 +1,164 @@
+import asyncio
+import heapq
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from database import db
+from utils.delivery import backfill_delivery_queue, campaign_targets, delivery_engine, enqueue_campaign
+from utils.offload import run_db
+
+
+def to_utc_naive(value: Optional[datetime]) -> datetime:
+    """Normalize a datetime to naive UTC, the way timestamps are stored"""
+    if value is None:
+        return datetime.utcnow()
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+RECOVERY_CUTOFF_SETTING = 'scheduler_recovery_cutoff'
+
+
+def recovery_cutoff() -> datetime:
+    """When this database moved to the in-process scheduler.
+
+    The first call backfills the delivery queue of campaigns sent before
+    (see backfill_delivery_queue) and records the time in app_settings.
+    The setting row is inserted first, so when several processes start at
+    once only one of them backfills; the others wait for its commit, fail
+    the unique name and read its time.
+    """
+    settings = db.app_settings
+    row = db(settings.name == RECOVERY_CUTOFF_SETTING).select(settings.value).first()
+    if row:
+        return datetime.fromisoformat(row.value)
+    cutoff = datetime.utcnow()
+    try:
+        settings.insert(name=RECOVERY_CUTOFF_SETTING, value=cutoff.isoformat())
+    except db._adapter.driver.IntegrityError:
+        db.rollback()
+        row = db(settings.name == RECOVERY_CUTOFF_SETTING).select(settings.value).first()
+        return datetime.fromisoformat(row.value)
+    backfilled = backfill_delivery_queue()
+    db.commit()
+    if backfilled:
+        print(f"Backfilled the delivery queue of {backfilled} campaigns sent before the in-process scheduler")
+    return cutoff
+
+
+class CampaignScheduler:
+    """Fires campaigns into the delivery queue when their scheduled_at is due.
+
+    Due times live in a min-heap. Rescheduling pushes a new entry and the
+    stale one is skipped when it reaches the top, so schedule/cancel are O(log n).
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[datetime, int]] = []
+        self._due: Dict[int, datetime] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._loop = asyncio.get_running_loop()
+            await run_db(self.load_pending)
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            self._loop = None
+
+    def load_pending(self):
+        """Recover schedules lost with the previous process (DB thread).
+
+        Only campaigns still 'scheduled' and never queued are picked up, and
+        only those scheduled (or, without a time, created) after the recovery
+        cutoff; older ones belong to the EasyCron era. Campaigns launched
+        right away are stored 'running' and fired in the same request.
+        """
+        cutoff = recovery_cutoff()
+        campaigns = db.campaigns
+        queued = db(db.delivery_queue.id > 0)._select(db.delivery_queue.campaign_id, distinct=True)
+        pending = db(
+            (campaigns.is_active == True) &
+            (campaigns.status == 'scheduled') &
+            (~campaigns.id.belongs(queued)) &
+            ((campaigns.scheduled_at >= cutoff) | ((campaigns.scheduled_at == None) & (campaigns.created_at >= cutoff)))
+        ).select(campaigns.id, campaigns.scheduled_at)
+        for campaign in pending:
+            self.schedule(campaign.id, campaign.scheduled_at)
+
+    def _off_loop(self) -> bool:
+        """Whether the caller is not on the scheduler's loop, e.g. a route handler on a DB worker thread"""
+        if self._loop is None:
+            return False
+        try:
+            return asyncio.get_running_loop() is not self._loop
+        except RuntimeError:
+            return True
+
+    def schedule(self, campaign_id: int, when: Optional[datetime] = None):
+        if self._off_loop():
+            self._loop.call_soon_threadsafe(self.schedule, campaign_id, when)
+            return
+        when = to_utc_naive(when)
+        self._due[campaign_id] = when
+        heapq.heappush(self._heap, (when, campaign_id))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def cancel(self, campaign_id: int):
+        if self._off_loop():
+            self._loop.call_soon_threadsafe(self.cancel, campaign_id)
+            return
+        self._due.pop(campaign_id, None)
+
+    async def _run(self):
+        while True:
+            # Drop entries superseded by a reschedule or cancel
+            while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            delay = (self._heap[0][0] - datetime.utcnow()).total_seconds()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, campaign_id = heapq.heappop(self._heap)
+            self._due.pop(campaign_id, None)
+            try:
+                await run_db(self.fire, campaign_id)
+            except Exception as e:
+                print(f"Error firing campaign {campaign_id}: {e}")
+                continue
+            # Wake the workers only once the queued rows are committed
+            delivery_engine.notify()
+
+    def fire(self, campaign_id: int) -> int:
+        """Queue a due campaign's targets and mark it running (DB thread)"""
+        campaign = db.campaigns(campaign_id)
+        if not campaign or not campaign.is_active or campaign.status not in ('scheduled', 'running'):
+            return 0
+
+        queued = enqueue_campaign(campaign.id, [target.id for target in campaign_targets(campaign)])
+        if campaign.status != 'running':
+            db(db.campaigns.id == campaign.id).update(status='running', updated_at=datetime.utcnow())
+        return queued
+
+
+campaign_scheduler = CampaignScheduler()
@@ -0,0 +1,170 @@
+import asyncio
+import base64
+import os
+import smtplib
+import ssl
+import threading
+import weakref
+from email import encoders
+from email.mime.base import MIMEBase
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import formataddr
+from typing import Dict, List, Tuple
+
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "30"))
+SMTP_MAX_IDLE = int(os.getenv("SMTP_MAX_IDLE", "10"))  # idle sessions kept per sender profile
+SMTP_MAX_SESSIONS = int(os.getenv("SMTP_MAX_SESSIONS", "10"))  # sessions open at once per sender profile
+
+# Refusals the server answers within the session; smtplib resets the
+# transaction before raising, so the session stays usable
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+
+class SMTPPool:
+    """Authenticated SMTP sessions for one sender profile, reused across messages.
+
+    Methods block and are meant to run in a worker thread. Callers hold
+    one of the `slots` while sending, which caps the sessions open at once
+    (profiles sharing a server and login share the pool and the cap).
+    """
+
+    def __init__(self, host: str, port: int, username: str, password: str):
+        self.host = host
+        self.port = port or 587
+        self.username = username
+        self.password = password
+        self._idle: List[smtplib.SMTP] = []
+        self._lock = threading.Lock()
+        self.slots = asyncio.Semaphore(max(1, SMTP_MAX_SESSIONS))
+
+    def _connect(self) -> smtplib.SMTP:
+        if self.port == 465:
+            conn = smtplib.SMTP_SSL(self.host, self.port, timeout=SMTP_TIMEOUT, context=ssl.create_default_context())
+        else:
+            conn = smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT)
+            conn.ehlo()
+            if conn.has_extn("starttls"):
+                conn.starttls(context=ssl.create_default_context())
+                conn.ehlo()
+        if self.username:
+            conn.login(self.username, self.password)
+        return conn
+
+    def _checkout(self) -> smtplib.SMTP:
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                return self._connect()
+            # RSET clears any leftover transaction and tells us the session is still alive
+            try:
+                conn.rset()
+                return conn
+            except smtplib.SMTPException:
+                self._discard(conn)
+
+    def _checkin(self, conn: smtplib.SMTP):
+        with self._lock:
+            if len(self._idle) < SMTP_MAX_IDLE:
+                self._idle.append(conn)
+                return
+        self._discard(conn)
+
+    def _discard(self, conn: smtplib.SMTP):
+        try:
+            conn.quit()
+        except Exception:
+            conn.close()
+
+    def send(self, from_address: str, to_address: str, message: bytes):
+        conn = self._checkout()
+        try:
+            try:
+                conn.sendmail(from_address, [to_address], message)
+            except smtplib.SMTPServerDisconnected:
+                # Server dropped an idle session; reconnect once and retry
+                conn.close()
+                conn = self._connect()
+                conn.sendmail(from_address, [to_address], message)
+        except MESSAGE_ERRORS:
+            self._checkin(conn)
+            raise
+        except Exception:
+            self._discard(conn)
+            raise
+        self._checkin(conn)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._discard(conn)
+
+
+class SMTPTransport:
+    """Sends campaign messages straight to each sender profile's SMTP server.
+
+    Messages are built (MIME, base64, serialization) and sent in a worker
+    thread, so the lookups below are shared between threads, hence the lock.
+    """
+
+    def __init__(self):
+        self._pools: Dict[Tuple, SMTPPool] = {}
+        # MIME attachment parts, encoded once per campaign context
+        self._attachments = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _pool(self, sender) -> SMTPPool:
+        key = (sender.smtp_host, sender.smtp_port, sender.smtp_username, sender.smtp_password)
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = self._pools[key] = SMTPPool(*key)
+        return pool
+
+    def _attachment_parts(self, context) -> List[MIMEBase]:
+        with self._lock:
+            parts = self._attachments.get(context)
+        if parts is None:
+            parts = []
+            for attachment in context.attachments_payload:
+                maintype, _, subtype = (attachment["mime_type"] or "application/octet-stream").partition("/")
+                part = MIMEBase(maintype, subtype or "octet-stream")
+                part.set_payload(base64.b64decode(attachment["content_base64"]))
+                encoders.encode_base64(part)
+                part.add_header("Content-Disposition", "attachment", filename=attachment["filename"])
+                parts.append(part)
+            with self._lock:
+                self._attachments[context] = parts
+        return parts
+
+    def build_message(self, context, target) -> bytes:
+        sender = context.sender
+        msg = MIMEMultipart("mixed")
+        msg["From"] = formataddr((sender.from_name, sender.from_address)) if sender.from_name else sender.from_address
+        msg["To"] = target.email
+        msg["Subject"] = context.shared_payload["subject"]
+
+        body = MIMEMultipart("alternative")
+        body.attach(MIMEText(context.shared_payload["plain_body"] or "", "plain"))
+        body.attach(MIMEText(context.template.render(target.id), "html"))
+        msg.attach(body)
+        for part in self._attachment_parts(context):
+            msg.attach(part)
+        return msg.as_bytes()
+
+    def _send(self, context, target):
+        message = self.build_message(context, target)
+        self._pool(context.sender).send(context.sender.from_address, target.email, message)
+
+    async def send(self, context, target):
+        async with self._pool(context.sender).slots:
+            await asyncio.to_thread(self._send, context, target)
+
+    async def close(self):
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools.clear()
+        for pool in pools:
+            await asyncio.to_thread(pool.close)
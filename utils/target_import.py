@@ -0,0 +1,325 @@
+import asyncio
+import codecs
+import csv
+import io
+import json
+import os
+import shutil
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple
+
+from database import db
+from utils.activity_logger import ActivityLogger
+from utils.offload import run_db
+
+TARGET_IMPORT_CHUNK_SIZE = int(os.getenv("TARGET_IMPORT_CHUNK_SIZE", "1000"))  # CSV rows per transaction
+IMPORT_JOB_MAX_ERRORS = int(os.getenv("IMPORT_JOB_MAX_ERRORS", "1000"))  # row errors kept on an import job
+IMPORT_JOB_LEASE = int(os.getenv("IMPORT_JOB_LEASE", "300"))  # seconds a running job stays claimed without committing a chunk
+IMPORT_JOB_MAX_ATTEMPTS = int(os.getenv("IMPORT_JOB_MAX_ATTEMPTS", "5"))  # runs ending in a database or OS error before a job fails
+IMPORT_JOB_RETRY_DELAY = int(os.getenv("IMPORT_JOB_RETRY_DELAY", "30"))  # seconds, doubled per attempt
+IMPORT_JOB_POLL_INTERVAL = float(os.getenv("IMPORT_JOB_POLL_INTERVAL", "5"))  # seconds between looks for jobs queued or abandoned by other workers
+IMPORT_NODE = os.getenv("IMPORT_NODE", socket.gethostname())  # nodes sharing one IMPORT_DIR volume may run each other's jobs when set alike
+IMPORT_DIR = os.path.join("uploads", "imports")  # spooled uploads of import jobs
+
+FALSE_VALUES = ("0", "false", "no", "n")
+
+
+class InvalidTargetCSV(ValueError):
+    """The upload has no email and first_name columns"""
+
+
+class LeaseLost(Exception):
+    """Another worker took over an import job whose lease ran out"""
+
+
+def csv_encoding(raw: BinaryIO) -> str:
+    """utf-8-sig when the whole upload is valid UTF-8, latin-1 otherwise.
+
+    The file is checked block by block and rewound, so it never has to be
+    held in memory.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        for block in iter(lambda: raw.read(1 << 20), b""):
+            decoder.decode(block)
+        decoder.decode(b"", final=True)
+        return "utf-8-sig"
+    except UnicodeDecodeError:
+        return "latin-1"
+    finally:
+        raw.seek(0)
+
+
+def import_targets(
+    raw: BinaryIO,
+    user_id: int,
+    skip_rows: int = 0,
+    on_chunk: Optional[Callable[[int, int, int, List[Dict[str, str]]], bool]] = None,
+) -> Tuple[int, int, List[Dict[str, str]]]:
+    """Stream a targets CSV from raw into the user's targets.
+
+    Expected headers: first_name,last_name,email,position,group_name,is_active.
+    Emails the user already has (or that appear earlier in the file) are
+    skipped; invalid rows are reported as {"row", "error"} and do not stop
+    the import. Every TARGET_IMPORT_CHUNK_SIZE rows are inserted and
+    committed as one transaction, so the write lock is released in between.
+
+    skip_rows data rows are read past without importing them (resuming a
+    job). on_chunk(rows_read, inserted, skipped, chunk_errors) runs inside
+    each chunk's transaction; the chunk's errors are handed to it instead
+    of being collected, and returning False stops after that chunk.
+
+    Returns (inserted, skipped_duplicates, errors).
+    """
+    stream = io.TextIOWrapper(raw, encoding=csv_encoding(raw), newline="")
+    try:
+        reader = csv.DictReader(stream)
+        columns = set(reader.fieldnames or [])
+        if "email" not in columns or not columns & {"first_name", "first name"}:
+            raise InvalidTargetCSV("CSV needs email and first_name columns")
+
+        existing = {row.email for row in db(db.targets.user_id == user_id).select(db.targets.email)}
+        groups = {
+            row.name: row.id
+            for row in db(db.groups.user_id == user_id).select(db.groups.id, db.groups.name)
+        }
+        inserted = 0
+        skipped = 0
+        errors: List[Dict[str, str]] = []
+        chunk: List[dict] = []
+        chunk_errors: List[Dict[str, str]] = []
+
+        def flush(rows_read: int) -> bool:
+            nonlocal inserted, chunk, chunk_errors
+            if chunk:
+                db.targets.bulk_insert(chunk)
+                inserted += len(chunk)
+            go_on = True
+            if on_chunk is not None:
+                go_on = on_chunk(rows_read, inserted, skipped, chunk_errors) is not False
+            else:
+                errors.extend(chunk_errors)
+            db.commit()
+            chunk, chunk_errors = [], []
+            return go_on
+
+        idx = 0
+        try:
+            for idx, row in enumerate(reader, start=1):
+                if idx <= skip_rows:
+                    continue
+                email = (row.get("email") or "").strip()
+                first_name = (row.get("first_name") or row.get("first name") or "").strip()
+                if not email or not first_name:
+                    chunk_errors.append({"row": str(idx), "error": "email and first_name are required"})
+                elif email in existing:
+                    skipped += 1
+                else:
+                    existing.add(email)
+                    is_active_val = (row.get("is_active") or "").strip().lower()
+                    group_name = (row.get("group_name") or "").strip()
+                    if group_name and group_name not in groups:
+                        groups[group_name] = db.groups.insert(name=group_name, user_id=user_id, is_active=True)
+
+                    chunk.append(dict(
+                        first_name=first_name,
+                        last_name=(row.get("last_name") or "").strip() or None,
+                        email=email,
+                        position=(row.get("position") or "").strip() or None,
+                        group_id=groups.get(group_name) if group_name else None,
+                        user_id=user_id,
+                        is_active=is_active_val not in FALSE_VALUES,
+                    ))
+                if idx % TARGET_IMPORT_CHUNK_SIZE == 0 and not flush(idx):
+                    return inserted, skipped, errors
+        except csv.Error as e:
+            # A malformed line leaves the parser out of step; keep what came before it
+            chunk_errors.append({"row": str(idx + 1), "error": str(e)})
+        flush(max(idx, skip_rows))
+        return inserted, skipped, errors
+    finally:
+        # Leave the upload open; its owner closes it
+        stream.detach()
+
+
+def spool_upload(upload: BinaryIO) -> str:
+    """Copy an upload into IMPORT_DIR for a job; returns its path. Blocking."""
+    os.makedirs(IMPORT_DIR, exist_ok=True)
+    file_path = os.path.join(IMPORT_DIR, f"{uuid.uuid4().hex}.csv")
+    with open(file_path, "wb") as spool:
+        shutil.copyfileobj(upload, spool, 1 << 20)
+    return file_path
+
+
+class ImportWorker:
+    """Runs queued import_jobs one at a time on a DB worker thread.
+
+    A job's progress is committed in the same transaction as each chunk of
+    targets, so an interrupted job resumes after its last committed chunk.
+    Every API process runs a worker; a job is claimed with a conditional
+    update that records the worker as owner and a lease, which the owner
+    renews with each chunk. A job whose owner died is resumed by another
+    worker once the lease runs out. Uploads are spooled to local disk, so
+    only workers of the node that spooled a job (same IMPORT_NODE) claim it. A run that hits a database or OS error
+    (e.g. "database is locked") puts the job back in the queue with a
+    backoff; only other errors, or IMPORT_JOB_MAX_ATTEMPTS of them, fail it.
+    """
+
+    def __init__(self):
+        self.owner: Optional[str] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = threading.Event()
+
+    async def start(self):
+        if self._task is None:
+            os.makedirs(IMPORT_DIR, exist_ok=True)
+            self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+            self._stopping.clear()
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            # A running job stops after its current chunk and goes back to the queue
+            self._stopping.set()
+            self._wakeup.set()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def submit(self):
+        """Wake the worker for a newly queued job"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.clear()
+            try:
+                job_id = await run_db(self.claim_job)
+                if job_id is None:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=IMPORT_JOB_POLL_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await run_db(self.run_job, job_id)
+            except Exception as e:
+                print(f"Error running import job: {e}")
+                await asyncio.sleep(1)
+
+    def claim_job(self) -> Optional[int]:
+        """Claim the oldest running job whose lease ran out, else the oldest queued one.
+
+        The claim is a conditional update, so of several workers racing for
+        a job only one gets it, and a job cancelled meanwhile is not started.
+        """
+        jobs = db.import_jobs
+        now = datetime.utcnow()
+        # Jobs spooled before nodes were recorded can run anywhere
+        local = (jobs.node == IMPORT_NODE) | (jobs.node == None)
+        for claimable in (
+            (jobs.status == 'running') & ((jobs.lease_until == None) | (jobs.lease_until < now)),
+            (jobs.status == 'queued') & ((jobs.retry_at == None) | (jobs.retry_at <= now)),
+        ):
+            for job in db(local & claimable).select(jobs.id, orderby=jobs.id, limitby=(0, 10)):
+                if db((jobs.id == job.id) & local & claimable).update(
+                    status='running', owner=self.owner,
+                    lease_until=now + timedelta(seconds=IMPORT_JOB_LEASE), updated_at=now
+                ):
+                    return job.id
+        return None
+
+    def run_job(self, job_id: int):
+        """Import a job this worker has claimed"""
+        jobs = db.import_jobs
+        job = jobs[job_id]
+        owned = (jobs.id == job_id) & (jobs.owner == self.owner)
+
+        kept_errors = json.loads(job.errors) if job.errors else []
+        outcome = {'error_count': job.error_count or 0, 'cancelled': False, 'stopped': False}
+
+        def on_chunk(rows_read, inserted, skipped, chunk_errors):
+            outcome['error_count'] += len(chunk_errors)
+            kept_errors.extend(chunk_errors[:max(0, IMPORT_JOB_MAX_ERRORS - len(kept_errors))])
+            now = datetime.utcnow()
+            if not db(owned).update(
+                rows_processed=rows_read,
+                inserted_count=(job.inserted_count or 0) + inserted,
+                skipped_duplicates=(job.skipped_duplicates or 0) + skipped,
+                error_count=outcome['error_count'],
+                errors=json.dumps(kept_errors),
+                lease_until=now + timedelta(seconds=IMPORT_JOB_LEASE),
+                updated_at=now,
+            ):
+                # Raising rolls this chunk back; the new owner imports it
+                raise LeaseLost(f"Import job {job_id} was taken over by another worker")
+            current = db(jobs.id == job_id).select(jobs.status).first()
+            outcome['cancelled'] = current is None or current.status == 'cancelled'
+            outcome['stopped'] = self._stopping.is_set()
+            return not (outcome['cancelled'] or outcome['stopped'])
+
+        try:
+            with open(job.file_path, 'rb') as raw:
+                import_targets(raw, job.user_id, skip_rows=job.rows_processed or 0, on_chunk=on_chunk)
+        except LeaseLost:
+            db.rollback()
+            return
+        except Exception as e:
+            db.rollback()
+            attempts = (job.attempts or 0) + 1
+            now = datetime.utcnow()
+            if self.retryable(e) and attempts < IMPORT_JOB_MAX_ATTEMPTS:
+                # Resumes after its last committed chunk once the delay has passed
+                db(owned & (jobs.status == 'running')).update(
+                    status='queued', owner=None, lease_until=None, attempts=attempts, last_error=str(e),
+                    retry_at=now + timedelta(seconds=IMPORT_JOB_RETRY_DELAY * 2 ** (attempts - 1)), updated_at=now
+                )
+                db.commit()
+                return
+            db(owned & (jobs.status == 'running')).update(
+                status='failed', attempts=attempts, last_error=str(e), finished_at=now, updated_at=now
+            )
+            db.commit()
+            self.remove_file(job.file_path)
+            return
+
+        if outcome['cancelled']:
+            self.remove_file(job.file_path)
+            return
+        if outcome['stopped']:
+            # Back to the queue, so the next start resumes it without waiting out the lease;
+            # even a stop on the last chunk just completes then
+            db(owned & (jobs.status == 'running')).update(
+                status='queued', owner=None, lease_until=None, updated_at=datetime.utcnow()
+            )
+            db.commit()
+            return
+        db(owned & (jobs.status == 'running')).update(
+            status='completed', finished_at=datetime.utcnow(), updated_at=datetime.utcnow()
+        )
+        db.commit()
+        self.remove_file(job.file_path)
+        job = jobs[job_id]
+        ActivityLogger.log_targets_imported(job.user_id, job.file_name, job.inserted_count,
+                                            job.skipped_duplicates, job.error_count)
+
+    @staticmethod
+    def retryable(error: Exception) -> bool:
+        """Whether a run may succeed when tried again: database errors such as a
+        locked database, or OS errors other than the spooled file being gone"""
+        if isinstance(error, FileNotFoundError):
+            return False
+        operational_error = getattr(db._adapter.driver, 'OperationalError', None)
+        return isinstance(error, OSError) or (operational_error is not None and isinstance(error, operational_error))
+
+    @staticmethod
+    def remove_file(path: Optional[str]):
+        if path and os.path.exists(path):
+            os.remove(path)
+
+
+import_worker = ImportWorker()
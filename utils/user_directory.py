@@ -0,0 +1,123 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from database import db, after_commit
+
+USER_DIRECTORY_SIZE = int(os.getenv("USER_DIRECTORY_SIZE", "4096"))  # users kept in memory
+USER_DIRECTORY_TTL = float(os.getenv("USER_DIRECTORY_TTL", "60"))  # seconds; bounds staleness from writes on other API nodes
+
+
+class DirectoryUser(NamedTuple):
+    is_admin: bool
+    full_name: Optional[str]
+
+
+class UserDirectory:
+    """Process-wide LRU of the user fields response builders show next to owned rows.
+
+    Owner flags and names used to be one users SELECT per row. load()
+    fetches every id not yet cached in a single belongs() query, so a list
+    endpoint costs at most one users query per page. Writes to users
+    through PyDAL drop the cache via after-insert/update/delete hooks,
+    when written and again after the commit; writes made by other API nodes show up once entries expire after ttl.
+    Entries are read and written from DB worker threads, hence the lock.
+    """
+
+    def __init__(self, size: int = USER_DIRECTORY_SIZE, ttl: float = USER_DIRECTORY_TTL):
+        self.size = max(1, size)
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, Tuple[float, Optional[DirectoryUser]]]" = OrderedDict()
+        self._admin_ids: Optional[Tuple[float, List[int]]] = None
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def load(self, user_ids: Iterable[int]) -> Dict[int, Optional[DirectoryUser]]:
+        """Directory entries for user_ids (None for unknown users), querying only the missing ones"""
+        wanted = {user_id for user_id in user_ids if user_id is not None}
+        found: Dict[int, Optional[DirectoryUser]] = {}
+        now = time.monotonic()
+        with self._lock:
+            for user_id in wanted:
+                entry = self._entries.get(user_id)
+                if entry is not None and entry[0] > now:
+                    self._entries.move_to_end(user_id)
+                    found[user_id] = entry[1]
+            generation = self._generation
+        missing = [user_id for user_id in wanted if user_id not in found]
+        if not missing:
+            return found
+
+        users = db.users
+        loaded = {user_id: None for user_id in missing}
+        for user in db(users.id.belongs(missing)).select(users.id, users.is_admin, users.full_name):
+            loaded[user.id] = DirectoryUser(bool(user.is_admin), user.full_name)
+        found.update(loaded)
+        with self._lock:
+            # Don't keep users that a write invalidated while they were read
+            if self.ttl > 0 and generation == self._generation:
+                expires = time.monotonic() + self.ttl
+                for user_id, user in loaded.items():
+                    self._entries[user_id] = (expires, user)
+                    self._entries.move_to_end(user_id)
+                while len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+        return found
+
+    def get(self, user_id: int) -> Optional[DirectoryUser]:
+        return self.load([user_id]).get(user_id)
+
+    def is_admin(self, user_id: int) -> bool:
+        """Check if a user is admin"""
+        user = self.get(user_id)
+        return user.is_admin if user else False
+
+    def full_name(self, user_id: int) -> Optional[str]:
+        user = self.get(user_id)
+        return user.full_name if user else None
+
+    def admin_flags(self, user_ids: Iterable[int]) -> Dict[int, bool]:
+        """is_admin of each user, from one load()"""
+        return {user_id: bool(user and user.is_admin) for user_id, user in self.load(user_ids).items()}
+
+    def full_names(self, user_ids: Iterable[int]) -> Dict[int, Optional[str]]:
+        """full_name of each user, from one load()"""
+        return {user_id: user.full_name if user else None for user_id, user in self.load(user_ids).items()}
+
+    def admin_ids(self) -> List[int]:
+        """Ids of every admin user"""
+        with self._lock:
+            if self._admin_ids is not None and self._admin_ids[0] > time.monotonic():
+                return self._admin_ids[1]
+            generation = self._generation
+        ids = [user.id for user in db(db.users.is_admin == True).select(db.users.id)]
+        with self._lock:
+            if self.ttl > 0 and generation == self._generation:
+                self._admin_ids = (time.monotonic() + self.ttl, ids)
+        return ids
+
+    def invalidate(self, user_id: Optional[int] = None):
+        """Drop one user, or everything without a user"""
+        with self._lock:
+            self._generation += 1
+            self._admin_ids = None
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+    def written(self, user_id: Optional[int] = None):
+        # A load may still read the old row until the write commits
+        self.invalidate(user_id)
+        after_commit(self.invalidate, user_id)
+
+    def watch(self, table):
+        table._after_insert.append(lambda fields, id: self.written(id))
+        table._after_update.append(lambda dbset, fields: self.written())
+        table._after_delete.append(lambda dbset: self.written())
+
+
+user_directory = UserDirectory()
+user_directory.watch(db.users)